@@ -7,3 +7,18 @@ Started: 2015-04-13
 '''
 
 from compman import *
+from compman_catalog import *
+from compman_cache import *
+from compman_exec import *
+from compman_lock import *
+from compman_sweep import *
+from compman_intern import *
+from compman_store import *
+from compman_profile import *
+from compman_stamp import *
+from compman_snapshot import *
+from compman_gc import *
+from compman_artifact import *
+from compman_queue import *
+from compman_cost import *
+from compman_prefetch import *
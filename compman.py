@@ -9,9 +9,18 @@ Last update: 2017-09-24
 version = '0.1.0'
 
 import os
+import errno
 import inspect
 import types
+import hashlib
+import weakref
+import threading
+import contextlib
 from collections import OrderedDict
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # --------------------
 # Exceptions:
@@ -38,9 +47,561 @@ class CMDuplicateNameError(Exception):
     def __init__(self,name):
         msg = ('Attempt to set name {0} simultaneously in two or '
                'more of self.__dict__, self.cmConfigDict, '
-               'self.cmExConfigDict'.format(name))
+               'self.cmExConfigDict, or to a class attribute '
+               'name'.format(name))
         Exception.__init__(self,msg)
 
+# --------------------
+# Hash backends:
+class HashBackend(object):
+    '''
+    Hash algorithm used by hashOnString() and hashMany().
+
+    Child classes implement hash(string), returning a hash string, and
+    may override hashMany(strings) with a faster batch version and
+    newHasher() with a true incremental hasher.
+    Register instances with registerHashBackend().
+    '''
+    def __init__(self,alg):
+        self.alg = alg
+
+    def hash(self,string):
+        raise NotImplementedError('Must be implemented by child class.')
+
+    def hashMany(self,strings):
+        return [self.hash(string) for string in strings]
+
+    def newHasher(self):
+        '''
+        Returns incremental hasher: call update(string) for each piece,
+        then result() returns the hash string of the concatenated pieces.
+        This default one keeps the pieces and hashes them joined.
+        '''
+        return _JoiningHasher(self)
+
+class PolynomialHashBackend(HashBackend):
+    '''
+    Multiplicative string hash of the djb2/sdbm family:
+        hashnum = seed
+        for each character c: hashnum = (hashnum * mult + ord(c)) % modulus
+    formatted as a zero padded decimal string of length width.
+
+    The per-character recurrence is the polynomial
+        seed*mult**n + sum(ord(c_i) * mult**(n-1-i))  (mod modulus)
+    so long strings and batches of strings are hashed with NumPy (if
+    available) as a dot product with a table of powers of mult. Both
+    code paths are bit-exact with the per-character loop.
+    '''
+    # strings at least this long are hashed with NumPy, if available
+    numpyMinLength = 2048
+
+    def __init__(self,alg,seed,mult,modulus,width):
+        HashBackend.__init__(self,alg)
+        self.seed     = seed
+        self.mult     = mult
+        self.modulus  = modulus
+        self.template = '{0:0' + str(width) + '}'
+        self.powers   = None # NumPy table of mult**k % modulus, k=0,1,...
+
+    def hash(self,string):
+        return self.template.format(self.updateHashNum(self.seed,string))
+
+    def newHasher(self):
+        return _PolynomialHasher(self)
+
+    def updateHashNum(self,hashnum,string):
+        '''
+        Returns the hash number after running the recurrence over the
+        characters of string, starting from hash number hashnum.
+        '''
+        mult    = self.mult
+        modulus = self.modulus
+        n = len(string)
+        if numpy is not None and n >= self.numpyMinLength:
+            powers = self.getPowers(n+1)
+            # exponents n-1,...,0; terms < 2**32 so the sum fits in uint64 for n < 2**32
+            terms  = (_getCharCodeArray(string) * powers[n-1::-1]) % numpy.uint64(modulus)
+            return (hashnum * pow(mult,n,modulus) + int(terms.sum())) % modulus
+        for c in _getCharCodes(string):
+            hashnum = (hashnum * mult + c) % modulus
+        return hashnum
+
+    def hashMany(self,strings):
+        if numpy is None:
+            return HashBackend.hashMany(self,strings)
+        strings = list(strings)
+        if not strings:
+            return []
+        lengths = numpy.array([len(string) for string in strings],dtype=numpy.int64)
+        powers  = self.getPowers(int(lengths.max())+1)
+        modulus = numpy.uint64(self.modulus)
+        # seed*mult**n part:
+        hashnums = (numpy.uint64(self.seed) * powers[lengths]) % modulus
+        total = int(lengths.sum())
+        if total > 0:
+            codes = numpy.concatenate([_getCharCodeArray(string) for string in strings])
+            # exponent n-1-i of each character, counted from the end of its own string:
+            ends      = numpy.cumsum(lengths)
+            exponents = numpy.repeat(ends,lengths) - 1 - numpy.arange(total,dtype=numpy.int64)
+            terms     = (codes * powers[exponents]) % modulus
+            nonEmpty  = lengths > 0
+            starts    = (ends - lengths)[nonEmpty]
+            # at most 2**32 terms, each less than 2**32, so sum fits in uint64:
+            sums = numpy.add.reduceat(terms,starts) % modulus
+            hashnums[nonEmpty] = (hashnums[nonEmpty] + sums) % modulus
+        return [self.template.format(int(hashnum)) for hashnum in hashnums]
+
+    def getPowers(self,n):
+        '''
+        Returns NumPy uint64 array with mult**k % modulus for k < n (at least).
+        Table is grown by doubling and kept for later calls.
+        '''
+        if self.powers is None:
+            self.powers = numpy.array([1],dtype=numpy.uint64)
+        modulus = numpy.uint64(self.modulus)
+        while len(self.powers) < n:
+            # (modulus-1)**2 < 2**64, so products fit in uint64
+            step = numpy.uint64(pow(self.mult,len(self.powers),self.modulus))
+            self.powers = numpy.concatenate((self.powers,(self.powers * step) % modulus))
+        return self.powers
+
+class DigestHashBackend(HashBackend):
+    '''
+    Wide cryptographic digest from hashlib, returned as a hex string.
+    Unicode strings are encoded as UTF-8 first.
+    '''
+    def __init__(self,alg,hashlibName,**hashlibKwargs):
+        HashBackend.__init__(self,alg)
+        self.hashlibName   = hashlibName
+        self.hashlibKwargs = hashlibKwargs
+
+    def hash(self,string):
+        if not isinstance(string,bytes):
+            string = string.encode('utf-8')
+        return getattr(hashlib,self.hashlibName)(string,**self.hashlibKwargs).hexdigest()
+
+    def newHasher(self):
+        return _DigestHasher(getattr(hashlib,self.hashlibName)(**self.hashlibKwargs))
+
+class _JoiningHasher(object):
+    '''
+    Internal class
+    '''
+    def __init__(self,backend):
+        self.backend = backend
+        self.pieces  = []
+
+    def update(self,string):
+        self.pieces.append(string)
+
+    def result(self):
+        return self.backend.hash(''.join(self.pieces))
+
+class _PolynomialHasher(object):
+    '''
+    Internal class
+    Incremental PolynomialHashBackend hasher. Pieces are buffered up to
+    bufferSize characters, so that long runs of short pieces are hashed
+    with NumPy too.
+    '''
+    bufferSize = 2**20
+
+    def __init__(self,backend):
+        self.backend = backend
+        self.hashnum = backend.seed
+        self.pieces  = []
+        self.size    = 0
+
+    def update(self,string):
+        self.pieces.append(string)
+        self.size += len(string)
+        if self.size >= self.bufferSize:
+            self._flush()
+
+    def result(self):
+        self._flush()
+        return self.backend.template.format(self.hashnum)
+
+    def _flush(self):
+        if self.pieces:
+            self.hashnum = self.backend.updateHashNum(self.hashnum,''.join(self.pieces))
+            self.pieces  = []
+            self.size    = 0
+
+class _DigestHasher(object):
+    '''
+    Internal class
+    Incremental DigestHashBackend hasher.
+    '''
+    def __init__(self,hasher):
+        self.hasher = hasher
+
+    def update(self,string):
+        if not isinstance(string,bytes):
+            string = string.encode('utf-8')
+        self.hasher.update(string)
+
+    def result(self):
+        return self.hasher.hexdigest()
+
+def _getCharCodes(string):
+    '''
+    Internal function
+    Returns sequence of ord(c) for each character c of string.
+    '''
+    if isinstance(string,bytearray):
+        return string
+    if isinstance(string,bytes):
+        return bytearray(string)
+    try:
+        return bytearray(string.encode('latin-1'))
+    except UnicodeEncodeError:
+        return [ord(c) for c in string]
+
+def _getCharCodeArray(string):
+    '''
+    Internal function
+    Returns NumPy uint64 array with ord(c) for each character c of string.
+    '''
+    codes = _getCharCodes(string)
+    if isinstance(codes,bytearray):
+        return numpy.frombuffer(bytes(codes),dtype=numpy.uint8).astype(numpy.uint64)
+    return numpy.array(codes,dtype=numpy.uint64)
+
+hashBackends = OrderedDict()
+
+def registerHashBackend(backend):
+    '''
+    Makes backend (a HashBackend instance) available as algorithm
+    backend.alg in hashOnString(), hashMany() and CompMan.cmHashAlg.
+    Replaces any backend previously registered under the same name.
+    '''
+    hashBackends[backend.alg] = backend
+
+def getHashBackend(alg):
+    if alg not in hashBackends:
+        raise Exception('Invalid hash algorithm: {}'.format(alg))
+    return hashBackends[alg]
+
+def hashOnString(string,alg='djb2'):
+    '''
+    Creates a hash string from string using the hash backend
+    registered as alg. See CompMan.hashOnString().
+    '''
+    return getHashBackend(alg).hash(string)
+
+def hashRows(rows,alg='djb2'):
+    '''
+    Returns hashOnString('\\n'.join(rows),alg) without building the
+    joined string: rows (any iterable of strings, eg: a generator) are
+    fed to an incremental hasher of the backend (see
+    HashBackend.newHasher()).
+    '''
+    hasher = getHashBackend(alg).newHasher()
+    first  = True
+    for row in rows:
+        if not first:
+            hasher.update('\n')
+        hasher.update(row)
+        first = False
+    return hasher.result()
+
+def hashMany(strings,alg='djb2'):
+    '''
+    Batch version of hashOnString(): returns list of hash strings, one
+    per element of strings. Much faster than repeated calls to
+    hashOnString() when NumPy is available.
+    '''
+    return getHashBackend(alg).hashMany(strings)
+
+registerHashBackend(PolynomialHashBackend('djb2', 5381,   33,2**32-1,10))
+registerHashBackend(PolynomialHashBackend('short',5381,   33,2**16-1, 5))
+registerHashBackend(PolynomialHashBackend('sdbm',    0,65599,2**32-1,10))
+registerHashBackend(DigestHashBackend('sha256','sha256'))
+if hasattr(hashlib,'blake2b'):
+    registerHashBackend(DigestHashBackend('blake2b','blake2b',digest_size=16))
+    registerHashBackend(DigestHashBackend('blake2s','blake2s',digest_size=16))
+
+# --------------------
+# Value digests:
+valueHashers = OrderedDict() # type -> function(value) returning digest string or None
+
+def registerValueHasher(valueType,func):
+    '''
+    Registers func(value) as the value hasher of config values of type
+    valueType (and of its subclasses without a hasher of their own),
+    used when CompMan.cmDigestValues is True. func returns the string
+    that stands for the value in the hash string, which must change
+    whenever the value does (eg: type, metadata and a digest of the
+    content), or None to fall back to str(value).
+    '''
+    valueHashers[valueType] = func
+
+def getValueDigest(val):
+    '''
+    Returns the digest string of val from its registered value hasher,
+    or None if there is none. Digests of read-only values are cached
+    per object.
+    '''
+    valueType = type(val)
+    for cls in valueType.__mro__:
+        func = valueHashers.get(cls)
+        if func is not None:
+            break
+    else:
+        return None
+    cached = _valueDigestCache.get(id(val))
+    if cached is not None and cached[0]() is val:
+        return cached[1]
+    digest = func(val)
+    if digest is not None and _isReadOnly(val):
+        try:
+            ref = weakref.ref(val,lambda ref,key=id(val): _valueDigestCache.pop(key,None))
+        except TypeError:
+            pass # no weak references to this type, not cached
+        else:
+            _valueDigestCache[id(val)] = (ref,digest)
+    return digest
+
+def digestBuffer(data,header=''):
+    '''
+    Returns header followed by the sha256 hex digest of header and of
+    the bytes of buffer data (bytes, bytearray, memoryview, contiguous
+    NumPy array), read directly from memory.
+    '''
+    hasher = hashlib.sha256(header.encode('utf-8'))
+    hasher.update(data)
+    return '{0} sha256:{1}'.format(header,hasher.hexdigest())
+
+_valueDigestCache = {} # id -> (weak reference,digest) for read-only values
+
+def _isReadOnly(val):
+    '''
+    Internal function
+    '''
+    if numpy is not None and isinstance(val,numpy.ndarray):
+        return not val.flags.writeable
+    if isinstance(val,memoryview):
+        return val.readonly
+    return isinstance(val,bytes)
+
+def _digestArray(val):
+    '''
+    Internal function
+    Value hasher of NumPy arrays: dtype, shape and raw data.
+    '''
+    if val.dtype.hasobject:
+        return None
+    dtype  = repr(val.dtype.descr) if val.dtype.fields else val.dtype.str
+    header = '<{0} {1} {2}>'.format(type(val).__name__,dtype,'x'.join(str(n) for n in val.shape))
+    return digestBuffer(numpy.ascontiguousarray(val).view(numpy.uint8),header)
+
+def _digestBytes(val):
+    '''
+    Internal function
+    Value hasher of bytearray, memoryview (and bytes on Python 3).
+    '''
+    if isinstance(val,memoryview):
+        header = '<memoryview {0} {1}>'.format(val.format,'x'.join(str(n) for n in val.shape))
+        if not getattr(val,'c_contiguous',True):
+            val = val.tobytes()
+    else:
+        header = '<{0} {1}>'.format(type(val).__name__,len(val))
+    return digestBuffer(val,header)
+
+if numpy is not None:
+    registerValueHasher(numpy.ndarray,_digestArray)
+registerValueHasher(bytearray,_digestBytes)
+registerValueHasher(memoryview,_digestBytes)
+if bytes is not str:
+    registerValueHasher(bytes,_digestBytes)
+
+# --------------------
+class CMConfigDict(OrderedDict):
+    '''
+    OrderedDict used for CompMan.cmConfigDict and CompMan.cmExConfigDict.
+    Tells the owning CompMan about every change, so it can invalidate
+    its cached hash tags, keep the reverse-dependency index of its
+    CompMan dependencies up to date and mirror config values into its
+    __dict__ (see CompMan.__getattr__()).
+    '''
+    def __init__(self,owner,*args,**kwargs):
+        self.cmOwnerRef = weakref.ref(owner)
+        OrderedDict.__init__(self,*args,**kwargs)
+
+    def _notify(self,key,oldValue,newValue,wasPresent):
+        owner = self.cmOwnerRef()
+        if owner is not None:
+            owner._configChanged(self,key,oldValue,newValue,wasPresent)
+
+    def __setitem__(self,key,value):
+        wasPresent = key in self
+        oldValue   = self.get(key)
+        OrderedDict.__setitem__(self,key,value)
+        self._notify(key,oldValue,value,wasPresent)
+
+    def __delitem__(self,key):
+        oldValue = self[key]
+        OrderedDict.__delitem__(self,key)
+        self._notify(key,oldValue,None,True)
+
+    def pop(self,key,*default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return OrderedDict.pop(self,key,*default)
+
+    def popitem(self,last=True):
+        key,value = OrderedDict.popitem(self,last)
+        self._notify(key,value,None,True)
+        return (key,value)
+
+    def setdefault(self,key,default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self,*args,**kwargs):
+        for (key,value) in OrderedDict(*args,**kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        oldItems = list(self.items())
+        OrderedDict.clear(self)
+        for (key,value) in oldItems:
+            self._notify(key,value,None,True)
+
+    def __reduce__(self):
+        # pickled as a plain OrderedDict, CompMan.__setstate__ re-wraps it
+        return (OrderedDict,(list(self.items()),))
+
+# --------------------
+class LazyDependency(object):
+    '''
+    Placeholder for a CompMan dependency that is only constructed when
+    needed. Store LazyDependency(factory,*args,**kwargs) as a config
+    value (eg: LazyDependency(TemplateMan,'p1',self.cmBasePath)) and
+    factory(*args,**kwargs) is called the first time the value is
+    accessed as an attribute or self is hashed, serialized or asked
+    for its dependencies, then replaces the placeholder in the config.
+    The result is kept, so a LazyDependency shared by several managers
+    is constructed once, even by several threads (or if it is None).
+    NOTE: only resolved as a direct config value, not inside lists or
+    other containers.
+    '''
+    def __init__(self,factory,*args,**kwargs):
+        self.factory   = factory
+        self.args      = args
+        self.kwargs    = kwargs
+        self.value     = None
+        self._resolved = False
+        self._lock     = threading.Lock()
+
+    def resolve(self):
+        if not self._resolved:
+            with self._lock:
+                if not self._resolved:
+                    self.value     = self.factory(*self.args,**self.kwargs)
+                    self._resolved = True
+        return self.value
+
+    def isResolved(self):
+        return self._resolved
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<LazyDependency {}>'.format(getattr(self.factory,'__name__',self.factory))
+
+# --------------------
+class CompManType(type):
+    '''
+    Metaclass of CMConstructionMixin, for CompMan child classes that
+    opt in to construction-time sharing. Inside sharedConstruction(),
+    returns the instance already constructed with the same class and
+    arguments for instances constructed while constructing another one
+    (ie: dependencies created in __init__() or configure_<metaParam>()).
+    Returns the canonical instance from the intern registry for
+    classes with cmIntern set (see CompMan.getInternRegistry()).
+    '''
+    def __call__(cls,*args,**kwargs):
+        return constructShared(cls,*args,**kwargs)
+
+def constructShared(cls,*args,**kwargs):
+    '''
+    Returns cls(*args,**kwargs) constructed the way CompManType
+    constructs instances of CMConstructionMixin classes, whether or not
+    cls uses it: its dependencies of such classes are shared inside
+    sharedConstruction() (cls itself is not shared at the top level).
+    '''
+    state = _constructionState
+    memo  = getattr(state,'memo',None)
+    if memo is None:
+        man = type.__call__(cls,*args,**kwargs)
+        if man.cmIntern:
+            man = man.getInternRegistry().intern(man)
+        return man
+    key = None
+    if state.depth > 0:
+        key = (cls,args,tuple(sorted(kwargs.items())))
+        try:
+            if key in memo:
+                return memo[key]
+        except TypeError:
+            key = None # unhashable arguments, no sharing
+    state.depth += 1
+    try:
+        man = type.__call__(cls,*args,**kwargs)
+    finally:
+        state.depth -= 1
+    if man.cmIntern:
+        man = man.getInternRegistry().intern(man)
+    if key is not None:
+        memo[key] = man
+    return man
+
+_constructionState = threading.local()
+
+@contextlib.contextmanager
+def sharedConstruction(deferHashing=True):
+    '''
+    Context manager for building many CompMan instances with identical
+    dependencies, eg: a parameter sweep (see compman_sweep.buildSweep()).
+    While active (in the current thread):
+      - a CompMan instance constructed during the construction of
+      another one (a dependency) with the same class and constructor
+      arguments as an earlier one is not constructed again: the
+      earlier instance is returned and shared. Dependencies must
+      therefore not be modified after construction. Only applies to
+      classes using CMConstructionMixin, constructed by such a class
+      (or by compman_sweep.buildSweep()).
+      - if deferHashing, cacheHashTag() does nothing, so hash tags can
+      be computed afterwards in one batch with cacheHashTags() (or
+      lazily by getHashTag()).
+    Instances constructed directly inside the with block are never
+    shared.
+    '''
+    state = _constructionState
+    if getattr(state,'memo',None) is not None:
+        yield # nested, outer one stays in charge
+        return
+    state.memo         = {}
+    state.depth        = 0
+    state.deferHashing = deferHashing
+    try:
+        yield
+    finally:
+        state.memo         = None
+        state.deferHashing = False
+
 # --------------------
 class CompMan(object):
     '''
@@ -57,10 +618,21 @@ class CompMan(object):
     understand how those changes affect the computation identity
     defined by the cmHashTag returned by getHashTag().
 
+    Hash tags are cached by getHashTag(). Changes made through the
+    setters, through cmConfigDict/cmExConfigDict item assignment or
+    deletion, or by assigning cmDesc, cmCodeTag, cmMetaParam, cmSep,
+    cmHashMode, cmHashAlg or cmDigestValues clear the cached hash tags
+    of the changed instance and of every CompMan instance that depends
+    on it (see invalidateHashTag()). In-place changes to mutable config
+    values (eg: appending to a list or writing to an array) are not
+    detected - call
+    invalidateHashTag() after making them.
+
     ----------
     When inheriting from CompMan, child classes of CompMan must:
       1. In __init__(), must call CompMan.__init__()
-      2. Implement getOutput()
+      2. Implement getOutput(), or implement computeOutput() to get a
+      cached getOutput() (see getOutput())
       3. Implement getOutputFilesList(), if needed
 
     ----------
@@ -79,6 +651,10 @@ class CompMan(object):
       - should indicate the Python file currently executing (with .py or
       .pyc extension removed) as well as the relevant class of function
       eg: analysiscode_TestMan
+      - child classes may declare it as class attribute cmCodeTag and
+      pass self.cmCodeTag to CompMan.__init__(), so that snapshots of
+      their instances are invalidated when it changes (see
+      compman_snapshot)
       - best not to have spaces in this
       - part of core computation configuration
       - affects the cmHashTag returned by getHashTag() as well as
@@ -175,8 +751,141 @@ class CompMan(object):
       configuration parameters depends on the application and style
       considerations, in some cases.
 
+    ----------
+    Hashing options (class attributes, may be overridden in child
+    classes or set on individual instances):
+
+    cmHashMode
+      - 'legacy' (default): each CompMan dependency contributes its
+      full string (including all of its own dependencies) to the hash
+      string. Produces the same cmHashTag values as earlier versions,
+      so existing output directories keep being found.
+      - 'merkle': each CompMan dependency contributes only its identity
+      fields (cmDesc, cmCodeTag, cmMetaParam, cmSep) and its own
+      cmHashTag. Hash string size no longer grows with the depth of the
+      dependency graph and shared dependencies are hashed once.
+      - NOTE: the two modes produce different cmHashTag values
+
+    cmHashAlg
+      - hash algorithm used by getHashTag(), see hashOnString()
+      - defaults to 'djb2'
+      - NOTE: changing it changes the cmHashTag values
+
+    cmDigestValues
+      - False (default): config values are turned into the hash string
+      with str(). NOTE: str() of large NumPy arrays is truncated with
+      '...', so different arrays can give the same cmHashTag.
+      - True: config values with a value hasher (NumPy arrays,
+      bytearray, memoryview, bytes on Python 3, and types registered
+      with registerValueHasher()) contribute a digest of their type,
+      metadata (eg: dtype, shape) and raw memory instead, computed
+      without string conversion and cached per read-only object.
+      - NOTE: changes the cmHashTag values of instances with such
+      config values
+
+    ----------
+    Lazy configuration (class attribute):
+
+    cmLazyConfigure
+      - False (default): configure() runs configure_<metaParam>() right
+      away and caches the hash tags
+      - True: configure() only records the metaparameter. The
+      configure_<metaParam>() call runs on first need of the config:
+      attribute access to a config value, getConfigDict(),
+      getExtraConfigDict(), setConfig(), setExConfig(), getHashTag()
+      (and so getTagPrefix(), getOutputPath(), ...), getDependencies(),
+      __str__(), saveConfigCSVFile() or getOutput(), see
+      ensureConfigured(). Hash tags are then computed when first
+      needed. Getters of the core fields (getDesc(), etc.) do not
+      configure. Combine with LazyDependency config values to also
+      defer construction of dependencies.
+      - NOTE: read and write config through those methods or attribute
+      access, not through cmConfigDict/cmExConfigDict directly, until
+      configured. Lazy instances are not interned until configured.
+
+    ----------
+    Interning (class attributes):
+
+    cmIntern
+      - False (default): every construction returns a new instance
+      - True, for child classes using CMConstructionMixin only:
+      constructing an instance identical to a live one (same
+      class, cmDesc, cmCodeTag, cmMetaParam, cmSep, cmBasePath, hashing
+      options and config values, with CompMan values compared by
+      identity) returns that canonical instance instead, so duplicate
+      nodes in dependency graphs are held, walked, hashed and loaded
+      once. See compman_intern.InternRegistry.
+      - interned instances are shared, so treat them as read only:
+      changing one removes it from the registry but affects every
+      holder. Other instance attributes set in __init__() are not
+      compared, so only use this for classes fully described by the
+      fields above.
+
+    cmInternRegistry
+      - registry used when cmIntern is True, None for the default one
+
+    ----------
+    Build stamps (class attribute):
+
+    markOutputComplete() also writes a build stamp recording the build
+    ids of the dependencies and fingerprints of the input files listed
+    by getInputFiles(), see compman_stamp and isOutputFresh().
+
+    cmInputFingerprint
+      - 'stat' (default): input files are fingerprinted by size and
+      mtime
+      - 'content': also by SHA-256 of their content, so input files
+      touched without being changed do not make the output stale
+
+    ----------
+    Artifact store (class attribute):
+
+    cmArtifactStore
+      - None (default): outputs are only looked for in getOutputPath()
+      - compman_artifact.ArtifactStore instance: shared store of
+      outputs addressed by getTagPrefix(True). For child classes that
+      implement computeOutput(), getOutput() fetches the output files
+      from the store before computing them, and publishes them after.
+      See compman_artifact.fetchOutputs() to fetch the outputs a whole
+      graph needs at once.
+
+    ----------
+    Prefetching (class attribute):
+
+    cmPrefetcher
+      - None (default): readOutputFile() uses the prefetcher entered
+      with a with statement in the calling thread, if any (see
+      compman_prefetch.getActivePrefetcher())
+      - compman_prefetch.Prefetcher instance: reads the output files of
+      dependencies in background threads, see prefetchDependencies().
+      Result files of child classes that implement computeOutput() are
+      read through readOutputFile() too.
+
     '''
 
+    cmHashMode     = 'legacy'
+    cmHashAlg      = 'djb2'
+    cmDigestValues = False
+
+    # result cache used by getOutput(), None for the default one
+    cmResultCache = None
+
+    # interning, see class doc
+    cmIntern         = False
+    cmInternRegistry = None
+
+    # lazy configuration, see class doc
+    cmLazyConfigure = False
+
+    # build stamps, see class doc
+    cmInputFingerprint = 'stat'
+
+    # shared artifact store, see class doc
+    cmArtifactStore = None
+
+    # output prefetcher, see class doc
+    cmPrefetcher = None
+
     def __init__(self,cmDesc,
                       cmCodeTag,
                       cmMetaParam,
@@ -184,7 +893,11 @@ class CompMan(object):
                       cmBasePath     = None,
                       cmConfigDict   = None,
                       cmExConfigDict = None):
+        if self.cmIntern and not isinstance(type(self),CompManType):
+            raise InvalidStateError('cmIntern requires CMConstructionMixin: class {0}(CMConstructionMixin,...)'
+                                    .format(type(self).__name__))
         self.validateSep(cmSep)
+        self.cmDependents   = weakref.WeakSet() # CompMan instances with self in their config
         self.cmDesc         = cmDesc
         self.cmCodeTag      = cmCodeTag
         self.cmMetaParam    = cmMetaParam
@@ -224,20 +937,78 @@ class CompMan(object):
         return self.cmSep
 
     def getConfigDict(self):
+        self.ensureConfigured()
         return self.cmConfigDict
 
     def getExtraConfigDict(self):
+        self.ensureConfigured()
         return self.cmExConfigDict
 
     def getBasePath(self):
         return self.cmBasePath
 
-    def getHashTag(self,includeExtraConfig):
+    def getHashTag(self,includeExtraConfig,memo=None):
+        '''
+        memo (optional) - dict shared by all managers hashed during one
+        pass over a dependency graph, so that a dependency reachable by
+        several paths is only hashed once. Internal, leave as None.
+        '''
         if includeExtraConfig and self.cmHashTagWithExtraConfig is not None:
             return self.cmHashTagWithExtraConfig
         if not includeExtraConfig and self.cmHashTagWithoutExtraConfig is not None:
             return self.cmHashTagWithoutExtraConfig
-        return self.hashOnString(self.generateHashString(includeExtraConfig))
+        if memo is None:
+            memo = {}
+        key = (id(self),'tag',includeExtraConfig)
+        if key not in memo:
+            self.ensureConfigured()
+            rows = self._iterHashStringRows(includeExtraConfig,memo)
+            if self._overrides('hashOnString'):
+                memo[key] = self.hashOnString('\n'.join(rows),alg=self.cmHashAlg)
+            else:
+                memo[key] = hashRows(rows,self.cmHashAlg)
+        if includeExtraConfig:
+            self.cmHashTagWithExtraConfig    = memo[key]
+        else:
+            self.cmHashTagWithoutExtraConfig = memo[key]
+        return memo[key]
+
+    def getDependencies(self,includeExtraConfig=True):
+        '''
+        Returns list of the CompMan instances that self depends on,
+        ie: CompMan values in self.cmConfigDict (and in
+        self.cmExConfigDict if includeExtraConfig), including ones inside
+        list, tuple, set or dict values. Each instance appears once, in
+        order of first appearance.
+        '''
+        self.ensureConfigured()
+        self._resolveLazyDependencies()
+        return self._getDependencies(includeExtraConfig)
+
+    def _getDependencies(self,includeExtraConfig=True):
+        '''
+        Internal function
+        getDependencies() without configuring or resolving anything.
+        '''
+        configDicts = [self.cmConfigDict]
+        if includeExtraConfig:
+            configDicts.append(self.cmExConfigDict)
+        depList = []
+        seen    = set()
+        for configDict in configDicts:
+            for val in configDict.itervalues():
+                for depMan in _iterCompMans(val):
+                    if id(depMan) not in seen:
+                        seen.add(id(depMan))
+                        depList.append(depMan)
+        return depList
+
+    def getDependents(self):
+        '''
+        Returns list of the CompMan instances that have self in their
+        configuration (the reverse of getDependencies()).
+        '''
+        return list(self.cmDependents)
 
     # --------------------
     # Setters:
@@ -277,7 +1048,9 @@ class CompMan(object):
         to avoid potentially problematic duplication between
         self.__dict__, self.cmConfigDict, and self.cmExConfigDict.
         '''
-        if name in self.__dict__ or name in self.cmExConfigDict:
+        self.ensureConfigured()
+        if ((name in self.__dict__ and name not in self.cmConfigDict) or
+            name in self.cmExConfigDict or hasattr(type(self),name)):
             raise CMDuplicateNameError(name)
         self.cmConfigDict[name] = value
 
@@ -289,79 +1062,280 @@ class CompMan(object):
         to avoid potentially problematic duplication between
         self.__dict__, self.cmConfigDict, and self.cmExConfigDict.
         '''
-        if name in self.__dict__ or name in self.cmConfigDict:
+        self.ensureConfigured()
+        if ((name in self.__dict__ and name not in self.cmExConfigDict) or
+            name in self.cmConfigDict or hasattr(type(self),name)):
             raise CMDuplicateNameError(name)
         self.cmExConfigDict[name] = value
 
     def cacheHashTag(self):
         '''
         Stores hash tags with and without extraconfig to speed things up.
+        Does nothing inside sharedConstruction(deferHashing=True).
         '''
-        self.cmHashTagWithExtraConfig    = self.getHashTag(True)
-        self.cmHashTagWithoutExtraConfig = self.getHashTag(False)
+        if getattr(_constructionState,'deferHashing',False):
+            return
+        memo = {}
+        self.cmHashTagWithExtraConfig    = self._getHashTag(True,memo)
+        self.cmHashTagWithoutExtraConfig = self._getHashTag(False,memo)
+
+    def invalidateHashTag(self):
+        '''
+        Clears the cached hash tags of self and, through the
+        reverse-dependency index, of every CompMan instance that
+        depends on self directly or indirectly. Hash tags are
+        recomputed on the next call to getHashTag().
+        Called automatically when the configuration changes.
+        '''
+        if self.cmHashTagWithExtraConfig is None and self.cmHashTagWithoutExtraConfig is None:
+            # dependents can only have cached hash tags computed from
+            # cached hash tags of self, so they are already cleared
+            return
+        self.cmHashTagWithExtraConfig    = None
+        self.cmHashTagWithoutExtraConfig = None
+        for depMan in list(self.cmDependents):
+            depMan.invalidateHashTag()
+
+    def _configChanged(self,configDict,key,oldValue,newValue,wasPresent):
+        '''
+        Internal function
+        Called by CMConfigDict when a config value is set or removed.
+        '''
+        selfDict = self.__dict__
+        if configDict is selfDict.get('cmConfigDict'):
+            otherDict = selfDict.get('cmExConfigDict',())
+        elif configDict is selfDict.get('cmExConfigDict'):
+            otherDict = selfDict.get('cmConfigDict',())
+        else:
+            return # configDict has been replaced, no longer part of self
+        self._mirrorConfig(key,wasPresent or key in otherDict)
+        if 'cmHashTagWithExtraConfig' in selfDict:
+            self.invalidateHashTag()
+        if 'cmInternKey' in selfDict:
+            self.getInternRegistry().discard(self)
+        for depMan in _iterCompMans(newValue):
+            _getDependentsSet(depMan).add(self)
+        oldDeps = list(_iterCompMans(oldValue))
+        if oldDeps:
+            currentDeps = set(id(depMan) for depMan in self._getDependencies())
+            for depMan in oldDeps:
+                if id(depMan) not in currentDeps:
+                    _getDependentsSet(depMan).discard(self)
+
+    def _mirrorConfig(self,key,wasConfig):
+        '''
+        Internal function
+        Keeps self.__dict__[key] equal to the config value of key (from
+        cmConfigDict, else cmExConfigDict) so that self.key is a plain
+        attribute lookup, or removes it if key is no longer a config
+        name. wasConfig: key was a config name before the change, ie:
+        self.__dict__[key] is a mirror rather than a normal attribute.
+        '''
+        selfDict = self.__dict__
+        if key in selfDict and not wasConfig:
+            return # normal attribute of the same name, leave it alone
+        for name in ('cmConfigDict','cmExConfigDict'):
+            configDict = selfDict.get(name)
+            if configDict is not None and key in configDict:
+                if isinstance(configDict[key],LazyDependency):
+                    break # not mirrored, so that __getattr__() resolves it
+                selfDict[key] = configDict[key]
+                return
+        selfDict.pop(key,None)
+
+    def _wrapConfigDict(self,configDict):
+        '''
+        Internal function
+        Returns CMConfigDict owned by self with the items of configDict,
+        and adds self to the reverse-dependency index of its CompMan
+        values. Does not mirror or invalidate anything.
+        '''
+        wrapped = CMConfigDict(self)
+        for (key,val) in configDict.items():
+            OrderedDict.__setitem__(wrapped,key,val)
+            for depMan in _iterCompMans(val):
+                _getDependentsSet(depMan).add(self)
+        return wrapped
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['cmDependents'] # weak references, rebuilt by __setstate__
+        state.pop('cmInternKey',None) # unpickled copies are not interned
+        state.pop('cmConfigureLock',None) # rebuilt by __setstate__ if still pending
+        state.pop('cmConfiguringThread',None)
+        for name in ('cmConfigDict','cmExConfigDict'):
+            for key in state[name]:
+                state.pop(key,None) # mirrors, rebuilt by __setstate__
+        return state
+
+    def __setstate__(self,state):
+        # restores cached hash tags as well, so no invalidation here
+        selfDict = self.__dict__
+        selfDict.update(state)
+        if 'cmPendingMetaParam' in selfDict:
+            selfDict['cmConfigureLock'] = threading.RLock()
+        _getDependentsSet(self)
+        for name in ('cmConfigDict','cmExConfigDict'):
+            selfDict[name] = self._wrapConfigDict(selfDict[name])
+        for name in ('cmExConfigDict','cmConfigDict'):
+            for (key,val) in selfDict[name].iteritems():
+                if not isinstance(val,LazyDependency):
+                    selfDict[key] = val
 
     # --------------------
-    def __getattribute__(self,name):
+    def __getattr__(self,name):
         '''
-        If name is not in self, look for it in self.cmConfigDict or
-        self.cmExConfigDict.
         Allows use of compManObject.foo instead of
-        compManObject.cmConfigDict['foo']
+        compManObject.cmConfigDict['foo'].
+        Config values are mirrored into self.__dict__ whenever
+        cmConfigDict or cmExConfigDict changes, so compManObject.foo is
+        normally a plain attribute lookup and this is only called when
+        normal attribute lookup fails: looks for name in
+        self.cmConfigDict, then in self.cmExConfigDict.
+        All other attribute accesses (including self.cmSep etc. inside
+        CompMan methods) run at normal Python speed too.
+        NOTE: class attributes and methods take precedence over config
+        names, setConfig() and setExConfig() refuse such names. Use
+        CMConfigFirstMixin to get the lookup order of earlier versions.
         '''
-        if ('cmConfigDict' in object.__getattribute__(self,'__dict__') and
-            name in object.__getattribute__(self,'cmConfigDict')):
-            return object.__getattribute__(self,'cmConfigDict')[name]
-        elif ('cmExConfigDict' in object.__getattribute__(self,'__dict__') and
-              name in object.__getattribute__(self,'cmExConfigDict')):
-            return object.__getattribute__(self,'cmExConfigDict')[name]
-        else:
-            return object.__getattribute__(self,name)
+        selfDict = self.__dict__
+        if ('cmPendingMetaParam' in selfDict and
+            selfDict.get('cmConfiguringThread') != threading.current_thread().ident):
+            self.ensureConfigured()
+            return getattr(self,name)
+        for configName in ('cmConfigDict','cmExConfigDict'):
+            if configName in selfDict and name in selfDict[configName]:
+                val = selfDict[configName][name]
+                if isinstance(val,LazyDependency):
+                    val = val.resolve()
+                    selfDict[configName][name] = val
+                return val
+        raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__,name))
 
     def __setattr__(self,name,value):
         '''
         Prevents duplication of name in self.__dict__, self.cmConfigDict,
         and self.cmExConfigDict.
+        Invalidates cached hash tags if name affects them.
         '''
-        if (('cmConfigDict' in self.__dict__ and name in self.cmConfigDict) or 
-            ('cmExConfigDict' in self.__dict__ and name in self.cmExConfigDict)):
+        selfDict = self.__dict__
+        if ((name in selfDict.get('cmConfigDict',())) or
+            (name in selfDict.get('cmExConfigDict',()))):
             raise CMDuplicateNameError(name)
-        object.__setattr__(self,name,value)
+        if name in ('cmConfigDict','cmExConfigDict'):
+            oldKeys = list(selfDict.get(name,()))
+            value   = self._wrapConfigDict(value)
+            object.__setattr__(self,name,value)
+            for key in oldKeys:
+                self._mirrorConfig(key,True)
+            for key in value:
+                self._mirrorConfig(key,False)
+        else:
+            object.__setattr__(self,name,value)
+        if name in _hashAffectingAttrNames and 'cmHashTagWithExtraConfig' in selfDict:
+            self.invalidateHashTag()
+        if (name in _hashAffectingAttrNames or name == 'cmBasePath') and 'cmInternKey' in selfDict:
+            self.getInternRegistry().discard(self)
 
     # --------------------
     # Functions for generating stuff:
-    def __str__(self,includeHashTag=True,includeExtraConfig=True):
+    def __str__(self,includeHashTag=True,includeExtraConfig=True,memo=None,includeConfig=True):
+        return '\n'.join(self.iterConfigRows(includeHashTag,includeExtraConfig,memo,includeConfig))
+
+    def iterConfigRows(self,includeHashTag=True,includeExtraConfig=True,memo=None,includeConfig=True):
+        '''
+        Generator of the rows (without newlines) of the string returned
+        by __str__(), which joins them with newlines: the class header,
+        then one className,name,value CSV row per core attribute and
+        config value. Lets getHashTag() and saveConfigCSVFile() stream
+        large configurations without building the whole string.
+        '''
+        self.ensureConfigured()
+        self._resolveLazyDependencies()
         className = self.__class__.__name__
-        string = '<' + className + '>\n'
+        yield '<' + className + '>'
         attrList = ('cmDesc','cmCodeTag','cmMetaParam','cmSep')
-        template = className + ',{0},{1}\n'
+        template = className + ',{0},{1}'
         for attrName in attrList:
-            string += template.format(attrName, self._getStringValue(getattr(self,attrName),includeExtraConfig))
+            yield template.format(attrName, self._getStringValue(getattr(self,attrName),includeExtraConfig,memo))
         if includeHashTag:
-            string += template.format('cmHashTag', self.getHashTag(includeExtraConfig))
-        for (key,val) in self.cmConfigDict.iteritems():
-            string += template.format(key, self._getStringValue(val,includeExtraConfig))
-        if includeExtraConfig:
-            for (key,val) in self.cmExConfigDict.iteritems():
-                string += template.format(key, self._getStringValue(val,includeExtraConfig))
-        if string[-1:] == '\n':
-            string = string[:-1]
-        return string
+            yield template.format('cmHashTag', self._getHashTag(includeExtraConfig,memo))
+        if includeConfig:
+            for (key,val) in self.cmConfigDict.iteritems():
+                yield template.format(key, self._getStringValue(val,includeExtraConfig,memo))
+            if includeExtraConfig:
+                for (key,val) in self.cmExConfigDict.iteritems():
+                    yield template.format(key, self._getStringValue(val,includeExtraConfig,memo))
+
+    def _iterHashStringRows(self,includeExtraConfig,memo=None):
+        '''
+        Internal function
+        Rows of generateHashString(), or the whole string as one row if
+        a child class overrides generateHashString() or __str__().
+        Overrides are called with their original arguments (without
+        memo).
+        '''
+        if self._overrides('generateHashString'):
+            return [self.generateHashString(includeExtraConfig)]
+        if self._overrides('__str__'):
+            return [self.__str__(includeHashTag=False,includeExtraConfig=includeExtraConfig)]
+        return self.iterConfigRows(False,includeExtraConfig,memo)
+
+    def _getHashTag(self,includeExtraConfig,memo):
+        '''
+        Internal function
+        getHashTag(), passing memo only to CompMan's own implementation
+        so that child classes can override getHashTag(self,includeExtraConfig).
+        '''
+        if self._overrides('getHashTag'):
+            return self.getHashTag(includeExtraConfig)
+        return self.getHashTag(includeExtraConfig,memo)
 
     def __repr__(self,includeExtraConfig=True):
         return '<{0} object, hashtag {1}>'.format(self.__class__.__name__,self.getHashTag(includeExtraConfig))
 
-    def _getStringValue(self,val,includeExtraConfig):
+    def _getStringValue(self,val,includeExtraConfig,memo=None):
         '''
         Internal function
         '''
         if type(val) in (types.FunctionType,types.MethodType,types.UnboundMethodType,types.BuiltinFunctionType,types.BuiltinMethodType):
             strVal = val.__name__
         elif issubclass(val.__class__,CompMan):
-            strVal = val.__str__(True,includeExtraConfig)
+            strVal = self._getDependencyString(val,includeExtraConfig,memo)
+        elif self.cmDigestValues:
+            key = (id(val),'digest')
+            if memo is not None and key in memo:
+                return memo[key]
+            strVal = getValueDigest(val)
+            if strVal is None:
+                strVal = str(val)
+            if memo is not None:
+                memo[key] = strVal
         else:
             strVal = str(val)
         return strVal
 
+    def _getDependencyString(self,depMan,includeExtraConfig,memo=None):
+        '''
+        Internal function
+        String contributed by a CompMan dependency, see cmHashMode.
+        Memoized in memo so a dependency shared by several managers in
+        the graph is only turned into a string once.
+        '''
+        if memo is None:
+            memo = {}
+        key = (id(depMan),self.cmHashMode,includeExtraConfig)
+        if key not in memo:
+            if self.cmHashMode not in ('legacy','merkle'):
+                raise InvalidStateError('Invalid cmHashMode: {}'.format(self.cmHashMode))
+            if depMan._overrides('__str__'):
+                memo[key] = depMan.__str__(True,includeExtraConfig)
+            elif self.cmHashMode == 'legacy':
+                memo[key] = depMan.__str__(True,includeExtraConfig,memo)
+            else:
+                memo[key] = depMan.__str__(True,includeExtraConfig,memo,includeConfig=False)
+        return memo[key]
+
 
     def prettyPrint(self):
         raise Exception('Not coded yet')
@@ -381,7 +1355,7 @@ class CompMan(object):
         return string
         '''
 
-    def generateHashString(self,includeExtraConfig):
+    def generateHashString(self,includeExtraConfig,memo=None):
         '''
         Creates CSV string from key-value pairs in cmConfigDict
         as well as the following five key-values pairs from each
@@ -391,11 +1365,15 @@ class CompMan(object):
             cmMetaParam
             cmSep
             cmHashTag - returned by getHashTag()
+        In 'legacy' cmHashMode, the dependency's own config key-value
+        pairs are included as well.
 
         Used for saving configuration in a .csv file and generating
         cmHashTag using hashOnString() - see getHashTag()
         '''
-        return self.__str__(includeHashTag=False,includeExtraConfig=includeExtraConfig)
+        if self._overrides('__str__'):
+            return self.__str__(includeHashTag=False,includeExtraConfig=includeExtraConfig)
+        return self.__str__(includeHashTag=False,includeExtraConfig=includeExtraConfig,memo=memo)
 
     '''
     def _getStringPiece(self,depAttrName,depMan,includeExtraConfig,index=None):
@@ -425,29 +1403,18 @@ class CompMan(object):
             'djb2' (default)
             'short'
             'sdbm'
+            'sha256'
+            'blake2b', 'blake2s' (if supported by hashlib)
+            or any other algorithm added with registerHashBackend()
         Returns hash string
         '''
-        if alg == 'djb2':
-            hashnum = 5381
-            modulus = 2**32-1
-            for c in string:
-                hashnum = (hashnum * 33 + ord(c)) % modulus
-            hashstr = '{0:010}'.format(hashnum)
-        elif alg == 'short':
-            hashnum = 5381
-            modulus = 2**16-1
-            for c in string:
-                hashnum = (hashnum * 33 + ord(c)) % modulus
-            hashstr = '{0:05}'.format(hashnum)
-        elif alg == 'sdbm':
-            hashnum = 0
-            modulus = 2**32-1
-            for c in string:
-                hashnum = (hashnum * 65599 + ord(c)) % modulus
-            hashstr = '{0:010}'.format(hashnum)
-        else:
-            raise Exception('Invalid hash algorith: {}'.format(alg))
-        return hashstr
+        return getHashBackend(alg).hash(string)
+
+    def hashMany(self,strings,alg='djb2'):
+        '''
+        Batch version of hashOnString(), returns list of hash strings.
+        '''
+        return getHashBackend(alg).hashMany(strings)
 
     def getTagPrefix(self,includeExtraConfig):
         '''
@@ -470,11 +1437,111 @@ class CompMan(object):
 
     def getOutput(self):
         '''
-        Must be implemented by child class.
         Returns the output.
+        Either implemented by child class, or child class implements
+        computeOutput() and getOutput() returns its result through the
+        result cache (see getResultCache()): from memory if already
+        computed or loaded in this process, else from the result file
+        in getOutputPath(), else by calling computeOutput() and saving
+        the result.
+        '''
+        if not self._overrides('computeOutput'):
+            raise NotImplementedError('Must be implemented by child class.')
+        self.ensureConfigured()
+        return self.getResultCache().getOutput(self)
+
+    def computeOutput(self):
+        '''
+        May be implemented by child class instead of getOutput().
+        Computes and returns the output, which must be picklable.
+        Dependencies should be obtained with their getOutput().
         '''
         raise NotImplementedError('Must be implemented by child class.')
 
+    def getResultCache(self):
+        '''
+        Returns self.cmResultCache, or compman_cache.defaultResultCache
+        if that is None.
+        '''
+        if self.cmResultCache is not None:
+            return self.cmResultCache
+        from compman_cache import defaultResultCache
+        return defaultResultCache
+
+    def getInternRegistry(self):
+        '''
+        Returns self.cmInternRegistry, or
+        compman_intern.defaultInternRegistry if that is None.
+        '''
+        if self.cmInternRegistry is not None:
+            return self.cmInternRegistry
+        from compman_intern import defaultInternRegistry
+        return defaultInternRegistry
+
+    def getArtifactStore(self):
+        '''
+        Returns self.cmArtifactStore (None if there is none).
+        '''
+        return self.cmArtifactStore
+
+    def getPrefetcher(self):
+        '''
+        Returns self.cmPrefetcher, or the active
+        compman_prefetch.Prefetcher if that is None (None if there is
+        none).
+        '''
+        if self.cmPrefetcher is not None:
+            return self.cmPrefetcher
+        from compman_prefetch import getActivePrefetcher
+        return getActivePrefetcher()
+
+    def prefetchDependencies(self,recursive=False):
+        '''
+        Starts reading the output files of the dependencies of self (of
+        its whole dependency graph if recursive) in the background, if
+        there is a prefetcher (see getPrefetcher()). getOutput() of
+        child classes can call it first and then read the files with
+        readOutputFile(), so reading overlaps with computing.
+        '''
+        prefetcher = self.getPrefetcher()
+        if prefetcher is not None:
+            prefetcher.prefetchDependencies(self,recursive)
+
+    def readOutputFile(self,filePath):
+        '''
+        Returns the content (bytes) of file filePath, eg: an output file
+        of a dependency (see getOutputFilesList()): from the prefetcher
+        if there is one (see getPrefetcher()), else read directly.
+        '''
+        prefetcher = self.getPrefetcher()
+        if prefetcher is not None:
+            return prefetcher.read(filePath)
+        with open(filePath,'rb') as f:
+            return f.read()
+
+    def getArtifactFiles(self):
+        '''
+        May be extended by child class.
+        Returns list of the paths of the output files of self published
+        to the artifact store (see compman_artifact): by default the
+        files in getOutputPath() written by CompMan for
+        getTagPrefix(True), ie: config CSV file, complete marker file,
+        build stamp, result file and getOutputFilePath() files.
+        '''
+        from compman_artifact import getArtifactFileRegex
+        regex      = getArtifactFileRegex(self.getTagPrefix(includeExtraConfig=True))
+        outputPath = self.getOutputPath()
+        return [os.path.join(outputPath,fileName) for fileName in sorted(os.listdir(outputPath))
+                if regex.match(fileName)]
+
+    def _overrides(self,methodName):
+        '''
+        Internal function
+        True if the class of self overrides CompMan method methodName.
+        '''
+        method = getattr(type(self),methodName)
+        return getattr(method,'__func__',method) is not getattr(CompMan.__dict__[methodName],'__func__',CompMan.__dict__[methodName])
+
     def getOutputPath(self):
         if self.cmBasePath is None:
             raise TypeError('self.cmBasePath must be a string, not None')
@@ -488,10 +1555,138 @@ class CompMan(object):
         '''
         raise NotImplementedError('Must be implemented by child class.')
 
+    def getOutputFilePath(self,name,ext=''):
+        '''
+        Path of output file name (plus extension ext) of self in
+        getOutputPath(), named compman_output.<tag prefix>.<name><ext>
+        with the tag prefix WITH extra config.
+        '''
+        fileName = 'compman_output.{0}.{1}{2}'.format(self.getTagPrefix(includeExtraConfig=True),name,ext)
+        return os.path.join(self.getOutputPath(),fileName)
+
+    def saveArrayOutput(self,array,name='output'):
+        '''
+        Saves NumPy array as output file name in memory-mappable .npy
+        format (see compman_store) and returns it as loadArrayOutput()
+        would, so computeOutput() can end with
+            return self.saveArrayOutput(array)
+        '''
+        from compman_store import saveArray
+        self.makeOutputPath()
+        saveArray(self.getOutputFilePath(name,'.npy'),array)
+        return self.loadArrayOutput(name)
+
+    def loadArrayOutput(self,name='output'):
+        '''
+        Returns output file name saved by saveArrayOutput() as a
+        read-only memory-mapped array, shared by all callers in this
+        process. Slicing it only reads the pages accessed.
+        '''
+        from compman_store import loadArray
+        return loadArray(self.getOutputFilePath(name,'.npy'))
+
+    def saveBufferOutput(self,data,name='output'):
+        '''
+        Saves bytes-like data as output file name and returns it as
+        loadBufferOutput() would.
+        '''
+        from compman_store import saveBuffer
+        self.makeOutputPath()
+        saveBuffer(self.getOutputFilePath(name,'.bin'),data)
+        return self.loadBufferOutput(name)
+
+    def loadBufferOutput(self,name='output'):
+        '''
+        Returns output file name saved by saveBufferOutput() as a
+        read-only memory-mapped compman_store.MappedBuffer (zero-copy
+        views from getView() or getArray()).
+        '''
+        from compman_store import loadBuffer
+        return loadBuffer(self.getOutputFilePath(name,'.bin'))
+
     def getConfigCSVFilePath(self):
         fileName = 'compman_config.{}.csv'.format(self.getTagPrefix(includeExtraConfig=True))
         return os.path.join(self.getOutputPath(),fileName)
 
+    def getCompleteFilePath(self):
+        '''
+        Path of the empty marker file written by markOutputComplete().
+        '''
+        fileName = 'compman_complete.{}'.format(self.getTagPrefix(includeExtraConfig=True))
+        return os.path.join(self.getOutputPath(),fileName)
+
+    def getStampFilePath(self):
+        '''
+        Path of the build stamp written by markOutputComplete(), see
+        compman_stamp.
+        '''
+        fileName = 'compman_stamp.{}.json'.format(self.getTagPrefix(includeExtraConfig=True))
+        return os.path.join(self.getOutputPath(),fileName)
+
+    def getInputFiles(self):
+        '''
+        May be implemented by child class.
+        Returns list of the paths of the files (other than dependency
+        outputs) that the output is computed from. They are fingerprinted
+        in the build stamp, and changing them makes the output stale.
+        '''
+        return []
+
+    def getComputeLockPath(self):
+        fileName = 'compman_lock.{}.lock'.format(self.getTagPrefix(includeExtraConfig=True))
+        return os.path.join(self.getOutputPath(),fileName)
+
+    def getComputeLock(self,**kwargs):
+        '''
+        Returns a compman_lock.ComputeLock on getComputeLockPath(), for
+        making sure that only one process (on any host sharing
+        cmBasePath) computes the output of self at a time:
+            with man.getComputeLock():
+                if output not there yet: compute and save it
+        kwargs are passed to ComputeLock(), eg: staleTimeout.
+        Creates the output directory.
+        '''
+        from compman_lock import ComputeLock
+        self.makeOutputPath()
+        return ComputeLock(self.getComputeLockPath(),**kwargs)
+
+    def getOutputCatalog(self):
+        '''
+        Returns the output catalog attached for self.cmBasePath (see
+        compman_catalog.OutputCatalog), or None.
+        '''
+        if not outputCatalogs or self.cmBasePath is None:
+            return None
+        return outputCatalogs.get(os.path.normpath(self.cmBasePath))
+
+    def getOutputStatus(self):
+        '''
+        Returns one of outputStatusLevels:
+            'missing'    - no output directory
+            'created'    - output directory exists
+            'configured' - config CSV file has been saved
+            'complete'   - markOutputComplete() has been called
+        Answered from the output catalog if one is attached for
+        self.cmBasePath, otherwise from the file system.
+        '''
+        catalog = self.getOutputCatalog()
+        if catalog is not None:
+            return catalog.getStatus(self)
+        if os.path.isfile(self.getCompleteFilePath()):
+            return 'complete'
+        if os.path.isfile(self.getConfigCSVFilePath()):
+            return 'configured'
+        if os.path.isdir(self.getOutputPath()):
+            return 'created'
+        return 'missing'
+
+    def outputExists(self,minStatus='created'):
+        '''
+        True if getOutputStatus() is minStatus or later in
+        outputStatusLevels.
+        '''
+        return outputStatusLevels.index(self.getOutputStatus()) >= outputStatusLevels.index(minStatus)
+
     def generateCompoundMetaParameter(self,local_metaparameter,dependenciesList):
         '''
         Used for combining local metaparameter and dependency
@@ -510,17 +1705,73 @@ class CompMan(object):
 
     # --------------------
     def makeOutputPath(self):
+        '''
+        Creates the output directory if needed. Safe when several
+        processes do this at the same time.
+        '''
         outputPath = self.getOutputPath()
         if not os.path.isdir(outputPath):
-            os.makedirs(outputPath)
+            try:
+                os.makedirs(outputPath)
+            except OSError as e:
+                if e.errno != errno.EEXIST or not os.path.isdir(outputPath):
+                    raise
+        self._recordOutputStatus('created')
 
     def saveConfigCSVFile(self,forceRebuild=False):
+        '''
+        Writes the config CSV file, via a temporary file renamed into
+        place, so other processes never see a partially written file.
+        Rows are streamed from iterConfigRows() to a buffered file, the
+        whole string is never built.
+        '''
         self.makeOutputPath()
         filePath = self.getConfigCSVFilePath()
         if not os.path.isfile(filePath) or forceRebuild:
-            string = self.generateHashString(includeExtraConfig=True)
-            with open(filePath,'w') as f:
-                f.write(string)
+            tmpPath = '{0}.tmp{1}'.format(filePath,os.getpid())
+            with open(tmpPath,'w',2**20) as f:
+                _writeRows(f,self._iterHashStringRows(includeExtraConfig=True))
+            os.rename(tmpPath,filePath)
+        self._recordOutputStatus('configured')
+
+    def markOutputComplete(self):
+        '''
+        Records that the output of self has been fully written, by
+        creating the file getCompleteFilePath() and writing a new build
+        stamp (see writeBuildStamp()). Child classes should call this at
+        the end of getOutput() once everything is saved.
+        '''
+        self.saveConfigCSVFile()
+        with open(self.getCompleteFilePath(),'w'):
+            pass
+        self.writeBuildStamp()
+        self._recordOutputStatus('complete')
+
+    def writeBuildStamp(self):
+        '''
+        Writes the build stamp of self with a new build id, which makes
+        the outputs built from the previous one stale. See
+        compman_stamp.writeStamp().
+        '''
+        from compman_stamp import writeStamp
+        return writeStamp(self)
+
+    def isOutputFresh(self,checkInputs=True):
+        '''
+        True if the output of self is complete and up to date with its
+        dependencies and input files, ie: does not need to be rebuilt.
+        See compman_stamp.checkFreshness() to check many nodes at once.
+        '''
+        from compman_stamp import checkFreshness
+        return checkFreshness(self,checkInputs)[self.getTagPrefix(True)] is None
+
+    def _recordOutputStatus(self,status):
+        '''
+        Internal function
+        '''
+        catalog = self.getOutputCatalog()
+        if catalog is not None:
+            catalog.recordStatus(self,status)
 
     # --------------------
     def configure(self,metaParam=None):
@@ -535,13 +1786,246 @@ class CompMan(object):
         func       = getattr(self,funcName,None)
         if func == None:
             raise InvalidMetaparameterError(metaParam)
+        if self.cmLazyConfigure:
+            # see ensureConfigured(), lock first: it is how other threads see pending work
+            object.__setattr__(self,'cmConfigureLock',threading.RLock())
+            object.__setattr__(self,'cmPendingMetaParam',metaParam)
+            return
         func() # configure self in-place
         self.cacheHashTag()
 
+    def ensureConfigured(self):
+        '''
+        Runs the configure_<metaParam>() call deferred by configure()
+        when cmLazyConfigure is True, if still pending. Called by every
+        method that needs the config, see cmLazyConfigure.
+        Runs under a lock of self: other threads wait until it is done.
+        Calls made by configure_<metaParam>() itself return at once. If
+        configure_<metaParam>() raises, the config is put back as it was
+        and the call stays pending, so the next call tries again.
+        '''
+        selfDict = self.__dict__
+        lock = selfDict.get('cmConfigureLock')
+        if lock is None:
+            return
+        with lock:
+            metaParam = selfDict.get('cmPendingMetaParam')
+            threadId  = threading.current_thread().ident
+            if metaParam is None or selfDict.get('cmConfiguringThread') == threadId:
+                return # configured meanwhile, or called while configuring
+            oldItems = [list(self.cmConfigDict.items()),list(self.cmExConfigDict.items())]
+            selfDict['cmConfiguringThread'] = threadId
+            try:
+                getattr(self,'configure_{}'.format(metaParam))()
+            except BaseException:
+                for (configDict,items) in zip((self.cmConfigDict,self.cmExConfigDict),oldItems):
+                    configDict.clear()
+                    configDict.update(items)
+                raise
+            finally:
+                del selfDict['cmConfiguringThread']
+            del selfDict['cmPendingMetaParam']
+            del selfDict['cmConfigureLock']
+
+    def isConfigured(self):
+        '''
+        False if a configure() call deferred by cmLazyConfigure is pending.
+        '''
+        return 'cmPendingMetaParam' not in self.__dict__
+
+    def _resolveLazyDependencies(self):
+        '''
+        Internal function
+        Replaces LazyDependency config values by their CompMan instance.
+        '''
+        for configDict in (self.cmConfigDict,self.cmExConfigDict):
+            lazyKeys = [key for (key,val) in configDict.iteritems() if isinstance(val,LazyDependency)]
+            for key in lazyKeys:
+                configDict[key] = configDict[key].resolve()
+
 # --------------------
-class TemplateMan(CompMan):
+class CMConfigFirstMixin(object):
     '''
-    Template child class of CompMan.
+    Attribute lookup of earlier CompMan versions: names in cmConfigDict
+    and cmExConfigDict take precedence over everything else, including
+    class attributes and methods. Costs several extra lookups on every
+    attribute access, so only use it for child classes that rely on
+    config names shadowing class attributes.
+    Usage: class MyMan(CMConfigFirstMixin,CompMan)
+    '''
+    def __getattribute__(self,name):
+        if ('cmConfigDict' in object.__getattribute__(self,'__dict__') and
+            name in object.__getattribute__(self,'cmConfigDict')):
+            return object.__getattribute__(self,'cmConfigDict')[name]
+        elif ('cmExConfigDict' in object.__getattribute__(self,'__dict__') and
+              name in object.__getattribute__(self,'cmExConfigDict')):
+            return object.__getattribute__(self,'cmExConfigDict')[name]
+        else:
+            return object.__getattribute__(self,name)
+
+CMConstructionMixin = CompManType('CMConstructionMixin',(object,),{'__doc__':'''
+    Opt-in construction-time sharing for CompMan child classes: sharing
+    of dependencies inside sharedConstruction() (eg:
+    compman_sweep.buildSweep()) and interning with cmIntern. Adds
+    metaclass CompManType, so it cannot be combined with another
+    metaclass (eg: abc.ABCMeta) without a metaclass deriving from both.
+    Usage: class MyMan(CMConstructionMixin,CompMan)
+    '''})
+
+# Output status values, in order, see CompMan.getOutputStatus():
+outputStatusLevels = ('missing','created','configured','complete')
+
+# os.path.normpath(cmBasePath) -> attached output catalog, see
+# compman_catalog.OutputCatalog.attach():
+outputCatalogs = {}
+
+_hashAffectingAttrNames = frozenset(('cmDesc','cmCodeTag','cmMetaParam','cmSep',
+                                     'cmHashMode','cmHashAlg','cmDigestValues',
+                                     'cmConfigDict','cmExConfigDict'))
+
+def _writeRows(f,rows):
+    '''
+    Internal function
+    Writes rows (iterable of strings) to file f separated by newlines.
+    '''
+    first = True
+    for row in rows:
+        if not first:
+            f.write('\n')
+        f.write(row)
+        first = False
+
+def _iterCompMans(val):
+    '''
+    Internal function
+    Yields the CompMan instances in val: val itself or the ones inside
+    list, tuple, set, frozenset or dict val (recursively).
+    '''
+    if isinstance(val,CompMan):
+        yield val
+    elif isinstance(val,(list,tuple,set,frozenset)):
+        for item in val:
+            for depMan in _iterCompMans(item):
+                yield depMan
+    elif isinstance(val,dict):
+        for item in val.values():
+            for depMan in _iterCompMans(item):
+                yield depMan
+
+def _getDependentsSet(depMan):
+    '''
+    Internal function
+    Returns depMan.cmDependents, creating it if needed (eg: while
+    unpickling, before depMan.__setstate__() has run).
+    '''
+    depDict = depMan.__dict__
+    if 'cmDependents' not in depDict:
+        depDict['cmDependents'] = weakref.WeakSet()
+    return depDict['cmDependents']
+
+def getDependencyGraph(roots,includeExtraConfig=True):
+    '''
+    Walks the dependency graph of CompMan instance(s) roots (see
+    CompMan.getDependencies()). Instances with the same
+    getTagPrefix(True) are treated as one node, represented by the
+    first one found.
+    Returns (nodes,deps):
+        nodes - OrderedDict tagPrefix -> CompMan instance, in
+                topological order (dependencies before dependents)
+        deps  - dict tagPrefix -> list of tag prefixes of the direct
+                dependencies of that node
+    '''
+    if isinstance(roots,CompMan):
+        roots = [roots]
+    nodes   = OrderedDict()
+    deps    = {}
+    visited = {} # id -> tagPrefix, of instances already reached
+    for root in roots:
+        if id(root) in visited:
+            continue
+        # iterative depth-first search, so deep graphs do not hit the recursion limit
+        stack = [(root,None)]
+        while stack:
+            (man,depIter) = stack[-1]
+            if depIter is None:
+                tagPrefix = man.getTagPrefix(True)
+                visited[id(man)] = tagPrefix
+                if tagPrefix in deps:
+                    # same node already reached through another instance
+                    stack.pop()
+                    continue
+                deps[tagPrefix] = []
+                depIter = iter(man.getDependencies(includeExtraConfig))
+                stack[-1] = (man,depIter)
+            for depMan in depIter:
+                if id(depMan) not in visited:
+                    stack.append((depMan,None))
+                    break
+            else:
+                stack.pop()
+                tagPrefix = visited[id(man)]
+                for depMan in man.getDependencies(includeExtraConfig):
+                    if visited[id(depMan)] not in deps[tagPrefix]:
+                        deps[tagPrefix].append(visited[id(depMan)])
+                nodes[tagPrefix] = man
+    return (nodes,deps)
+
+def cacheHashTags(managers,batchSize=4096):
+    '''
+    Computes and caches the hash tags, with and without extra config,
+    of CompMan instances managers and of all their dependencies, in
+    one batched pass: instances are processed by dependency level
+    (dependencies first), with the hash strings of up to batchSize
+    instances hashed at a time by hashMany(). Instances of child classes
+    overriding hashOnString() or hashMany() are hashed one by one by
+    getHashTag() instead, so their tags are the same either way.
+    Much faster than cacheHashTag() on each instance for large sweeps.
+    '''
+    levels = []
+    level  = {} # id -> dependency level
+    for root in managers:
+        if id(root) in level:
+            continue
+        stack = [(root,iter(root.getDependencies()))]
+        level[id(root)] = None # in progress
+        while stack:
+            (man,depIter) = stack[-1]
+            for depMan in depIter:
+                if id(depMan) not in level:
+                    level[id(depMan)] = None
+                    stack.append((depMan,iter(depMan.getDependencies())))
+                    break
+            else:
+                stack.pop()
+                depLevels = [level[id(depMan)] for depMan in man.getDependencies()]
+                manLevel  = 1 + max(depLevels) if depLevels else 0
+                level[id(man)] = manLevel
+                while len(levels) <= manLevel:
+                    levels.append([])
+                levels[manLevel].append(man)
+    for levelMans in levels:
+        for start in range(0,len(levelMans),batchSize):
+            memo = {}
+            for includeExtraConfig in (True,False):
+                attrName = 'cmHashTagWithExtraConfig' if includeExtraConfig else 'cmHashTagWithoutExtraConfig'
+                byAlg = OrderedDict()
+                for man in levelMans[start:start+batchSize]:
+                    if getattr(man,attrName) is not None:
+                        continue
+                    if man._overrides('hashOnString') or man._overrides('hashMany'):
+                        man._getHashTag(includeExtraConfig,memo) # hashed the way the child class does
+                    else:
+                        byAlg.setdefault(man.cmHashAlg,[]).append(man)
+                for (alg,algMans) in byAlg.items():
+                    strings = ['\n'.join(man._iterHashStringRows(includeExtraConfig,memo)) for man in algMans]
+                    for (man,hashTag) in zip(algMans,hashMany(strings,alg)):
+                        setattr(man,attrName,hashTag)
+
+# --------------------
+class TemplateMan(CMConstructionMixin,CompMan):
+    '''
+    Template child class of CompMan, shared when constructed inside
+    sharedConstruction().
     '''
     def __init__(self,cmMetaParam,cmBasePath):
         cmDesc        = 'TemplateMan example class'
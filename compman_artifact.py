@@ -0,0 +1,506 @@
+'''
+CompMan artifact stores.
+
+Shared stores of CompMan outputs addressed by getTagPrefix(True), so
+that an output computed on one machine is fetched by the others instead
+of being recomputed. An artifact is a .tar.gz archive of the output
+files of one instance (see CompMan.getArtifactFiles()), published with
+a .sha256 sidecar file holding its checksum, which is verified on fetch.
+
+Stores:
+  - LocalArtifactStore - a directory, eg: on a shared file system
+  - HTTPArtifactStore  - client of an ArtifactServer (a threaded HTTP
+  server over a LocalArtifactStore, see startArtifactServer(), fine for
+  testing and small teams)
+
+Child classes of CompMan set cmArtifactStore to use a store: getOutput()
+then fetches the output from the store before computing it, and
+publishes it after. An invalid artifact (checksum mismatch, corrupt
+archive) is discarded from the store with an ArtifactWarning, so the
+output is computed and published again. fetchOutputs() and
+publishOutputs() do the same for whole dependency graphs, concurrently.
+'''
+
+import os
+import re
+import zlib
+import shutil
+import tarfile
+import hashlib
+import tempfile
+import threading
+import warnings
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler,HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import quote,unquote
+    import urllib2 as urlrequest
+except ImportError:
+    from http.server import BaseHTTPRequestHandler,HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import quote,unquote
+    import urllib.request as urlrequest
+
+from compman import *
+
+# --------------------
+class ArtifactChecksumError(Exception):
+    def __init__(self,msg):
+        Exception.__init__(self,msg)
+
+class ArtifactWarning(UserWarning):
+    pass
+
+class ArtifactStore(object):
+    '''
+    Base class of artifact stores. Keys are tag prefixes WITH extra
+    config (see CompMan.getTagPrefix()). Child classes implement
+    has(), fetch(), publish() and discard().
+    '''
+    def has(self,key):
+        '''
+        True if artifact key is published (archive and checksum).
+        '''
+        raise NotImplementedError('Must be implemented by child class.')
+
+    def fetch(self,key,filePath):
+        '''
+        Downloads the archive of artifact key to file filePath and
+        verifies it. Returns False if there is no such artifact, raises
+        ArtifactChecksumError if the archive does not match its checksum.
+        '''
+        raise NotImplementedError('Must be implemented by child class.')
+
+    def publish(self,key,filePath,checksum):
+        '''
+        Publishes archive file filePath, with SHA-256 hex digest
+        checksum, as artifact key. The checksum is published last, so
+        readers never see a partial artifact.
+        '''
+        raise NotImplementedError('Must be implemented by child class.')
+
+    def discard(self,key):
+        '''
+        Removes artifact key, eg: because it is invalid. The checksum is
+        removed first, so readers never see a partial artifact.
+        '''
+        raise NotImplementedError('Must be implemented by child class.')
+
+    def hasMany(self,keys,numThreads=8):
+        '''
+        Returns list of has() of each key in keys, checked by numThreads
+        threads.
+        '''
+        return _mapThreads(self.has,keys,numThreads)
+
+    def getFileName(self,key):
+        '''
+        Name of the archive of artifact key (key quoted, so cmDesc may
+        hold any character).
+        '''
+        return quote(key,safe='') + '.tar.gz'
+
+class LocalArtifactStore(ArtifactStore):
+    '''
+    Artifact store in directory rootPath (created if needed).
+    '''
+    def __init__(self,rootPath):
+        self.rootPath = rootPath
+        if not os.path.isdir(rootPath):
+            try:
+                os.makedirs(rootPath)
+            except OSError:
+                if not os.path.isdir(rootPath):
+                    raise
+
+    def getPath(self,key):
+        return os.path.join(self.rootPath,self.getFileName(key))
+
+    def has(self,key):
+        return os.path.isfile(self.getPath(key) + '.sha256')
+
+    def getChecksum(self,key):
+        '''
+        Returns the published checksum of artifact key, or None.
+        '''
+        try:
+            with open(self.getPath(key) + '.sha256') as f:
+                return f.read().strip()
+        except (IOError,OSError):
+            return None
+
+    def fetch(self,key,filePath):
+        checksum = self.getChecksum(key)
+        if checksum is None:
+            return False
+        shutil.copyfile(self.getPath(key),filePath)
+        _verifyChecksum(key,filePath,checksum)
+        return True
+
+    def publish(self,key,filePath,checksum):
+        path = self.getPath(key)
+        _writeAtomically(path,filePath)
+        tmpPath = '{0}.sha256.tmp{1}.{2}'.format(path,os.getpid(),threading.current_thread().ident)
+        with open(tmpPath,'w') as f:
+            f.write(checksum + '\n')
+        os.rename(tmpPath,path + '.sha256')
+
+    def discard(self,key):
+        path = self.getPath(key)
+        for filePath in (path + '.sha256',path):
+            try:
+                os.remove(filePath)
+            except OSError:
+                pass
+
+class HTTPArtifactStore(ArtifactStore):
+    '''
+    Client of the ArtifactServer at url (eg: 'http://host:8765').
+    '''
+    def __init__(self,url,timeout=60):
+        self.url     = url.rstrip('/')
+        self.timeout = timeout
+
+    def getURL(self,key):
+        return '{0}/{1}'.format(self.url,self.getFileName(key))
+
+    def has(self,key):
+        return self._open(self.getURL(key) + '.sha256','HEAD') is not None
+
+    def fetch(self,key,filePath):
+        response = self._open(self.getURL(key) + '.sha256')
+        if response is None:
+            return False
+        checksum = response.read().decode('ascii').strip()
+        response = self._open(self.getURL(key))
+        if response is None:
+            return False
+        with open(filePath,'wb') as f:
+            shutil.copyfileobj(response,f,2**20)
+        _verifyChecksum(key,filePath,checksum)
+        return True
+
+    def publish(self,key,filePath,checksum):
+        with open(filePath,'rb') as f:
+            self._open(self.getURL(key),'PUT',f,os.fstat(f.fileno()).st_size)
+        data = (checksum + '\n').encode('ascii')
+        self._open(self.getURL(key) + '.sha256','PUT',data,len(data))
+
+    def discard(self,key):
+        self._open(self.getURL(key) + '.sha256','DELETE')
+        self._open(self.getURL(key),'DELETE')
+
+    def _open(self,url,method='GET',data=None,length=None):
+        '''
+        Returns the response, or None if not found (404). data may be a
+        file, streamed, in which case length must be given.
+        '''
+        request = urlrequest.Request(url,data)
+        request.get_method = lambda: method
+        if length is not None:
+            request.add_header('Content-Length',str(length))
+        try:
+            return urlrequest.urlopen(request,timeout=self.timeout)
+        except urlrequest.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+# --------------------
+class ArtifactServer(ThreadingMixIn,HTTPServer):
+    '''
+    Threaded HTTP server of LocalArtifactStore store, for
+    HTTPArtifactStore clients: GET and HEAD of archives and checksum
+    files, PUT to publish them and DELETE to discard them. No
+    authentication: only run it on a trusted network.
+    '''
+    daemon_threads = True
+
+    def __init__(self,store,address=('127.0.0.1',8765)):
+        self.store = store
+        HTTPServer.__init__(self,address,_ArtifactRequestHandler)
+
+    def getURL(self):
+        (host,port) = self.server_address[:2]
+        return 'http://{0}:{1}'.format(host,port)
+
+class _ArtifactRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Internal class
+    '''
+    def do_GET(self):
+        self._send(True)
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def do_PUT(self):
+        path = self._getPath()
+        if path is None:
+            return self.send_error(400)
+        length  = int(self.headers.get('Content-Length',0))
+        tmpPath = '{0}.tmp{1}.{2}'.format(path,os.getpid(),threading.current_thread().ident)
+        with open(tmpPath,'wb') as f:
+            while length > 0:
+                data = self.rfile.read(min(length,2**20))
+                if not data:
+                    break
+                f.write(data)
+                length -= len(data)
+        if length > 0:
+            os.remove(tmpPath)
+            return self.send_error(400,'Incomplete upload')
+        os.rename(tmpPath,path)
+        self.send_response(201)
+        self.send_header('Content-Length','0')
+        self.end_headers()
+
+    def do_DELETE(self):
+        path = self._getPath()
+        if path is None:
+            return self.send_error(400)
+        try:
+            os.remove(path)
+        except OSError:
+            return self.send_error(404)
+        self.send_response(204)
+        self.end_headers()
+
+    def _send(self,withBody):
+        path = self._getPath()
+        if path is None or not os.path.isfile(path):
+            return self.send_error(404)
+        with open(path,'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type','application/octet-stream')
+            self.send_header('Content-Length',str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            if withBody:
+                shutil.copyfileobj(f,self.wfile,2**20)
+
+    def _getPath(self):
+        fileName = unquote(self.path.lstrip('/'))
+        if not fileName or '/' in fileName or fileName.startswith('.'):
+            return None
+        if not (fileName.endswith('.tar.gz') or fileName.endswith('.tar.gz.sha256')):
+            return None
+        return os.path.join(self.server.store.rootPath,quote(fileName,safe=''))
+
+    def log_message(self,format,*args):
+        pass
+
+def startArtifactServer(rootPath,host='127.0.0.1',port=0):
+    '''
+    Starts an ArtifactServer of directory rootPath in a daemon thread
+    (port 0 for any free port). Returns the server: its getURL() is
+    the url of HTTPArtifactStore, stop it with shutdown().
+    '''
+    server = ArtifactServer(LocalArtifactStore(rootPath),(host,port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+# --------------------
+def fetchOutput(man,store=None):
+    '''
+    Fetches the output files of CompMan instance man from store
+    (defaults to man.getArtifactStore()) into man.getOutputPath().
+    Returns True if fetched, False if not in the store or if it could
+    not be fetched. In that case the files already extracted are
+    removed and an ArtifactWarning is issued; an invalid artifact
+    (checksum mismatch, corrupt archive, unsafe member names) is also
+    discarded from the store, so that publishOutput() replaces it.
+    '''
+    if store is None:
+        store = man.getArtifactStore()
+    key = man.getTagPrefix(True)
+    man.makeOutputPath()
+    (fd,archivePath) = tempfile.mkstemp('.tar.gz','compman_artifact.',man.getOutputPath())
+    os.close(fd)
+    extracted = []
+    try:
+        if not store.fetch(key,archivePath):
+            return False
+        _extractArchive(archivePath,man.getOutputPath(),extracted)
+    except (ArtifactChecksumError,tarfile.TarError,EOFError,zlib.error,IOError,OSError) as e:
+        for filePath in extracted:
+            try:
+                os.remove(filePath)
+            except OSError:
+                pass
+        invalid = not isinstance(e,(IOError,OSError)) # else download or local error, may be transient
+        warnings.warn('Could not fetch artifact {0}{1}: {2}'.format(key,' (discarded)' if invalid else '',e),
+                      ArtifactWarning)
+        if invalid:
+            try:
+                store.discard(key)
+            except (IOError,OSError):
+                pass
+        return False
+    finally:
+        os.remove(archivePath)
+    man._recordOutputStatus('complete')
+    return True
+
+def publishOutput(man,store=None):
+    '''
+    Publishes the output files of CompMan instance man (see
+    CompMan.getArtifactFiles()) to store (defaults to
+    man.getArtifactStore()), unless already there.
+    Returns True if published.
+    '''
+    if store is None:
+        store = man.getArtifactStore()
+    key = man.getTagPrefix(True)
+    if store.has(key):
+        return False
+    (fd,archivePath) = tempfile.mkstemp('.tar.gz','compman_artifact.',man.getOutputPath())
+    os.close(fd)
+    try:
+        with tarfile.open(archivePath,'w:gz') as tar:
+            for filePath in man.getArtifactFiles():
+                tar.add(filePath,os.path.basename(filePath))
+        store.publish(key,archivePath,_getFileChecksum(archivePath))
+    finally:
+        os.remove(archivePath)
+    return True
+
+def fetchOutputs(roots,store=None,numThreads=8):
+    '''
+    Fetches, concurrently with numThreads threads, the outputs that
+    running roots (CompMan instance or list of them) needs and that are
+    in the store (defaults to the getArtifactStore() of each node):
+    those of the roots, and of the dependencies of every needed node
+    that is neither complete locally nor in the store. Dependencies of
+    fetched outputs are not fetched.
+    Returns list of the tag prefixes fetched.
+    '''
+    (nodes,deps) = getDependencyGraph(roots)
+    stores = dict((tagPrefix,store if store is not None else man.getArtifactStore())
+                  for (tagPrefix,man) in nodes.items() if man.getBasePath() is not None)
+    stores = dict((tagPrefix,nodeStore) for (tagPrefix,nodeStore) in stores.items() if nodeStore is not None)
+    complete = dict(zip(stores,_mapThreads(lambda tagPrefix: nodes[tagPrefix].outputExists('complete'),
+                                           list(stores),numThreads)))
+    missing   = [tagPrefix for tagPrefix in stores if not complete[tagPrefix]]
+    available = set(tagPrefix for (tagPrefix,has) in
+                    zip(missing,_mapThreads(lambda tagPrefix: stores[tagPrefix].has(tagPrefix),missing,numThreads))
+                    if has)
+    if isinstance(roots,CompMan):
+        roots = [roots]
+    needed = set(root.getTagPrefix(True) for root in roots)
+    for tagPrefix in reversed(list(nodes)): # dependents before dependencies
+        if tagPrefix in needed and tagPrefix not in available and not complete.get(tagPrefix,False):
+            needed.update(deps[tagPrefix]) # computed here, so its dependencies are needed
+    toFetch = [tagPrefix for tagPrefix in nodes if tagPrefix in needed and tagPrefix in available]
+    fetched = _mapThreads(lambda tagPrefix: fetchOutput(nodes[tagPrefix],stores[tagPrefix]),toFetch,numThreads)
+    return [tagPrefix for (tagPrefix,ok) in zip(toFetch,fetched) if ok]
+
+def publishOutputs(roots,store=None,numThreads=8):
+    '''
+    Publishes, concurrently with numThreads threads, the complete
+    outputs of roots (CompMan instance or list of them) and of all of
+    their dependencies to store (defaults to the getArtifactStore() of
+    each node). Returns list of the tag prefixes published.
+    '''
+    (nodes,deps) = getDependencyGraph(roots)
+    items = [(tagPrefix,man,store if store is not None else man.getArtifactStore())
+             for (tagPrefix,man) in nodes.items() if man.getBasePath() is not None]
+    items = [item for item in items if item[2] is not None and item[1].outputExists('complete')]
+    published = _mapThreads(lambda item: publishOutput(item[1],item[2]),items,numThreads)
+    return [item[0] for (item,ok) in zip(items,published) if ok]
+
+# --------------------
+def _mapThreads(function,items,numThreads):
+    '''
+    Internal function
+    '''
+    items = list(items)
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(numThreads,len(items)))
+    try:
+        return pool.map(function,items)
+    finally:
+        pool.close()
+
+def _getFileChecksum(filePath):
+    '''
+    Internal function
+    SHA-256 hex digest of the content of file filePath.
+    '''
+    hasher = hashlib.sha256()
+    with open(filePath,'rb') as f:
+        for block in iter(lambda: f.read(2**20),b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _verifyChecksum(key,filePath,checksum):
+    '''
+    Internal function
+    '''
+    if _getFileChecksum(filePath) != checksum:
+        raise ArtifactChecksumError('Artifact {0} does not match its checksum'.format(key))
+
+def _writeAtomically(path,sourcePath):
+    '''
+    Internal function
+    Copies file sourcePath to path via a temporary file.
+    '''
+    tmpPath = '{0}.tmp{1}.{2}'.format(path,os.getpid(),threading.current_thread().ident)
+    shutil.copyfile(sourcePath,tmpPath)
+    os.rename(tmpPath,path)
+
+def _extractArchive(archivePath,outputPath,extracted):
+    '''
+    Internal function
+    Extracts the regular files of archive archivePath into directory
+    outputPath, each via a temporary file, appending their paths to
+    list extracted. Members with a directory part are refused, so an
+    archive cannot write outside outputPath. The complete marker file
+    is extracted last.
+    '''
+    with tarfile.open(archivePath,'r:gz') as tar:
+        members = [member for member in tar.getmembers() if member.isfile()]
+        for member in members:
+            if os.path.basename(member.name) != member.name or member.name.startswith('.'):
+                raise ArtifactChecksumError('Unsafe artifact member name {!r}'.format(member.name))
+        members.sort(key=lambda member: member.name.startswith('compman_complete.'))
+        for member in members:
+            filePath = os.path.join(outputPath,member.name)
+            tmpPath  = '{0}.tmp{1}.{2}'.format(filePath,os.getpid(),threading.current_thread().ident)
+            source = tar.extractfile(member)
+            try:
+                with open(tmpPath,'wb') as f:
+                    shutil.copyfileobj(source,f,2**20)
+                os.rename(tmpPath,filePath)
+            except Exception:
+                if os.path.exists(tmpPath):
+                    os.remove(tmpPath)
+                raise
+            extracted.append(filePath)
+
+_artifactFileRegexes     = OrderedDict() # tagPrefix -> regex, least recently used first
+_artifactFileRegexesLock = threading.Lock()
+maxArtifactFileRegexes   = 1024
+
+def getArtifactFileRegex(tagPrefix):
+    '''
+    Returns compiled regex matching the names of the files written by
+    CompMan for tag prefix tagPrefix (config CSV, complete marker, build
+    stamp, result and output files), not lock or temporary files.
+    The maxArtifactFileRegexes most recently used are kept compiled.
+    '''
+    with _artifactFileRegexesLock:
+        regex = _artifactFileRegexes.pop(tagPrefix,None)
+        if regex is not None:
+            _artifactFileRegexes[tagPrefix] = regex
+            return regex
+    regex = re.compile(r'^compman_(?!lock\.)[a-z]+\.' + re.escape(tagPrefix) + r'(\.(?!.*\.tmp\d)[^/]*)?$')
+    with _artifactFileRegexesLock:
+        _artifactFileRegexes[tagPrefix] = regex
+        while len(_artifactFileRegexes) > maxArtifactFileRegexes:
+            _artifactFileRegexes.popitem(last=False)
+    return regex
@@ -0,0 +1,320 @@
+'''
+CompMan benchmarks.
+
+Times the core CompMan operations on synthetic dependency graphs of
+configurable depth, fan-out, sharing and config size, and writes the
+results as JSON so that releases can be compared.
+
+Run as a script:
+    python compman_bench.py
+    python compman_bench.py --depth 4 6 --fanout 3 --sharing 0 0.9 --output new.json
+    python compman_bench.py --baseline old.json   (exit status 1 on regression)
+'''
+
+import sys
+import json
+import time
+import timeit
+import shutil
+import platform
+import argparse
+import itertools
+import tempfile
+
+from compman import *
+
+# --------------------
+class _BenchMan(CompMan):
+    '''
+    Minimal CompMan child class used by the benchmarks.
+    '''
+    def __init__(self,cmMetaParam='bench',nConfig=10):
+        CompMan.__init__(self,'bench','compman_bench_BenchMan',cmMetaParam)
+        for i in range(nConfig):
+            self.setConfig('field{}'.format(i),i)
+        self.setExConfig('exfield',0)
+
+class _ConfigFirstBenchMan(CMConfigFirstMixin,_BenchMan):
+    '''
+    _BenchMan with the attribute lookup of earlier CompMan versions.
+    '''
+    pass
+
+class _GraphMan(CompMan):
+    '''
+    Node of a synthetic dependency graph, see buildSyntheticGraph().
+    Node (level,index) depends on fanout nodes of level-1, and has
+    nConfig plain config values plus one extra config value.
+    '''
+    def __init__(self,level,index,graph,cmBasePath=None):
+        CompMan.__init__(self,'graph','compman_bench_GraphMan','synthetic',cmBasePath=cmBasePath)
+        self.cmHashMode = graph['hashMode']
+        self.graph = graph
+        self.setConfig('level',level)
+        self.setConfig('index',index)
+        self.configure()
+
+    def configure_synthetic(self):
+        graph = self.graph
+        for i in range(graph['nConfig']):
+            self.cmConfigDict['field{}'.format(i)] = 'value{0}_{1}'.format(i,self.index % 7)
+        if self.level > 0:
+            width = _getLevelWidth(graph,self.level-1)
+            for k in range(graph['fanout']):
+                depIndex = (self.index * graph['fanout'] + k) % width
+                self.cmConfigDict['dep{}'.format(k)] = _getGraphNode(graph,self.level-1,depIndex,self.cmBasePath)
+        self.cmExConfigDict['exfield'] = 'extra'
+
+# --------------------
+def buildSyntheticGraph(depth=4,fanout=3,sharing=0.5,nConfig=10,hashMode='legacy',basePath=None):
+    '''
+    Builds a synthetic dependency graph of _GraphMan instances and
+    returns (root,nodes), nodes being the list of all distinct nodes.
+
+    depth    - number of dependency levels below the root
+    fanout   - number of dependencies of each node above the leaves
+    sharing  - 0: tree, every node has its own dependencies; towards 1:
+               level l has only about fanout**(depth-l) * (1-sharing)
+               distinct nodes, shared by several dependents
+    nConfig  - number of plain config values of each node
+    hashMode - cmHashMode of the nodes
+    '''
+    graph = {'depth':depth,'fanout':fanout,'sharing':sharing,'nConfig':nConfig,
+             'hashMode':hashMode,'nodes':{}}
+    root  = _getGraphNode(graph,depth,0,basePath)
+    nodes = list(graph['nodes'].values())
+    return (root,nodes)
+
+def _getLevelWidth(graph,level):
+    '''
+    Internal function
+    Number of distinct nodes of level.
+    '''
+    return max(1,int(graph['fanout'] ** (graph['depth'] - level) * (1.0 - graph['sharing'])))
+
+def _getGraphNode(graph,level,index,basePath):
+    '''
+    Internal function
+    '''
+    key = (level,index)
+    if key not in graph['nodes']:
+        graph['nodes'][key] = _GraphMan(level,index,graph,basePath)
+    return graph['nodes'][key]
+
+def _clearHashTags(nodes):
+    '''
+    Internal function
+    '''
+    for node in nodes:
+        node.cmHashTagWithExtraConfig    = None
+        node.cmHashTagWithoutExtraConfig = None
+
+# --------------------
+def benchAttributeAccess(number=1000000,repeat=3):
+    '''
+    Times attribute reads on CompMan instances with the default
+    (fallback-only) attribute lookup and with CMConfigFirstMixin.
+    Returns OrderedDict of name -> best time per access in nanoseconds,
+    excluding the timing loop overhead.
+    '''
+    fastMan        = _BenchMan()
+    configFirstMan = _ConfigFirstBenchMan()
+    fastMan.plainAttr        = 1
+    configFirstMan.plainAttr = 1
+    configDict = fastMan.cmConfigDict
+    cases = OrderedDict((
+        ('baseline',               lambda: None),
+        ('dict.lookup',            lambda: configDict['field5']),
+        ('fast.config',            lambda: fastMan.field5),
+        ('fast.exconfig',          lambda: fastMan.exfield),
+        ('fast.attribute',         lambda: fastMan.plainAttr),
+        ('fast.core',              lambda: fastMan.cmSep),
+        ('fast.method',            lambda: fastMan.getSep),
+        ('configfirst.config',     lambda: configFirstMan.field5),
+        ('configfirst.exconfig',   lambda: configFirstMan.exfield),
+        ('configfirst.attribute',  lambda: configFirstMan.plainAttr),
+        ('configfirst.core',       lambda: configFirstMan.cmSep),
+        ('configfirst.method',     lambda: configFirstMan.getSep),
+        ))
+    results = OrderedDict()
+    for (name,func) in cases.items():
+        best = min(timeit.Timer(func).repeat(repeat=repeat,number=number))
+        results[name] = 1e9 * best / number
+    # remove the cost of calling the lambda itself
+    baseline = results.pop('baseline')
+    for name in results:
+        results[name] = max(results[name] - baseline,0.0)
+    return results
+
+def benchGraph(depth=4,fanout=3,sharing=0.5,nConfig=10,hashMode='legacy',repeat=3):
+    '''
+    Times the core operations on a graph from buildSyntheticGraph().
+    Returns OrderedDict of operation -> best time in seconds over repeat
+    runs, for the whole graph unless the name ends with '.perCall':
+      construct          - construction and configure() of all nodes
+                           (configure() caches the hash tags)
+      hashTag.cold       - root.getHashTag(True) with no cached tags
+      hashTag.warm.perCall
+                         - root.getHashTag(True) with cached tags, per call
+      cacheHashTags      - batched hashing of all nodes, no cached tags
+      str                - str(root)
+      getOutputPath      - getOutputPath() of every node
+      saveConfigCSVFile  - saveConfigCSVFile() of every node, in a
+                           temporary directory
+    plus 'nodes', the number of distinct nodes.
+    '''
+    results = OrderedDict()
+    basePath = tempfile.mkdtemp(prefix='compman_bench_')
+    try:
+        buildArgs = (depth,fanout,sharing,nConfig,hashMode,basePath)
+        results['construct'] = _bestTime(lambda: buildSyntheticGraph(*buildArgs),repeat)
+        (root,nodes) = buildSyntheticGraph(*buildArgs)
+        results['nodes'] = len(nodes)
+        results['hashTag.cold'] = _bestTime(lambda: root.getHashTag(True),repeat,
+                                            setup=lambda: _clearHashTags(nodes))
+        number = 100000
+        results['hashTag.warm.perCall'] = min(timeit.Timer(lambda: root.getHashTag(True)).repeat(
+                                              repeat=repeat,number=number)) / number
+        results['cacheHashTags'] = _bestTime(lambda: cacheHashTags(nodes),repeat,
+                                             setup=lambda: _clearHashTags(nodes))
+        results['str'] = _bestTime(lambda: str(root),repeat)
+        results['getOutputPath'] = _bestTime(lambda: [node.getOutputPath() for node in nodes],repeat)
+        def saveAll():
+            for node in nodes:
+                node.saveConfigCSVFile(forceRebuild=True)
+        results['saveConfigCSVFile'] = _bestTime(saveAll,repeat)
+    finally:
+        shutil.rmtree(basePath,ignore_errors=True)
+    return results
+
+def _bestTime(func,repeat,setup=None):
+    '''
+    Internal function
+    Best wall time in seconds of func() over repeat runs, setup() (not
+    timed) running before each.
+    '''
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        startTime = time.time()
+        func()
+        duration = time.time() - startTime
+        if best is None or duration < best:
+            best = duration
+    return best
+
+# --------------------
+def runBenchmarks(depths=(4,),fanouts=(3,),sharings=(0.5,),nConfigs=(10,),hashModes=('legacy','merkle'),
+                  repeat=3,attributeNumber=1000000):
+    '''
+    Runs benchGraph() for every combination of the parameter lists and
+    benchAttributeAccess() (skipped if attributeNumber is 0).
+    Returns OrderedDict ready for JSON output:
+      'environment' - Python, NumPy and platform versions
+      'graphs'      - list of {'params':..., 'results':...}
+      'attributes'  - benchAttributeAccess() results in nanoseconds
+    '''
+    report = OrderedDict()
+    report['environment'] = OrderedDict((
+        ('python',platform.python_version()),
+        ('implementation',platform.python_implementation()),
+        ('numpy',None if numpy is None else numpy.__version__),
+        ('platform',platform.platform()),
+        ('time',time.strftime('%Y-%m-%d %H:%M:%S')),
+        ))
+    report['graphs'] = []
+    for (depth,fanout,sharing,nConfig,hashMode) in itertools.product(depths,fanouts,sharings,nConfigs,hashModes):
+        params = OrderedDict((('depth',depth),('fanout',fanout),('sharing',sharing),
+                              ('nConfig',nConfig),('hashMode',hashMode)))
+        report['graphs'].append(OrderedDict((('params',params),
+                                             ('results',benchGraph(repeat=repeat,**params)))))
+    if attributeNumber:
+        report['attributes'] = benchAttributeAccess(number=attributeNumber,repeat=repeat)
+    return report
+
+def compareReports(baseline,report,threshold=1.25,minTime=1e-4):
+    '''
+    Compares report to baseline (both from runBenchmarks(), eg: loaded
+    from JSON). Returns list of (name,baselineTime,time) of the timings
+    more than threshold times slower than in baseline. Timings below
+    minTime seconds in both are ignored as noise.
+    '''
+    regressions = []
+    baselineGraphs = dict((_getParamsKey(graph['params']),graph['results']) for graph in baseline.get('graphs',[]))
+    for graph in report.get('graphs',[]):
+        key = _getParamsKey(graph['params'])
+        if key not in baselineGraphs:
+            continue
+        for (name,value) in graph['results'].items():
+            oldValue = baselineGraphs[key].get(name)
+            if name == 'nodes' or oldValue is None:
+                continue
+            floor = minTime / 1e4 if name.endswith('.perCall') else minTime
+            if value > threshold * max(oldValue,floor):
+                regressions.append(('{0} {1}'.format(key,name),oldValue,value))
+    baselineAttributes = baseline.get('attributes',{})
+    for (name,value) in report.get('attributes',{}).items():
+        oldValue = baselineAttributes.get(name)
+        # nanoseconds, ignore differences below 5 ns
+        if oldValue is not None and value > threshold * oldValue and value - oldValue > 5.0:
+            regressions.append(('attribute {}'.format(name),oldValue,value))
+    return regressions
+
+def _getParamsKey(params):
+    '''
+    Internal function
+    '''
+    return ','.join('{0}={1}'.format(name,params[name]) for name in sorted(params))
+
+def formatReport(report):
+    '''
+    Returns report from runBenchmarks() as a printable table.
+    '''
+    lines = []
+    for graph in report['graphs']:
+        lines.append(' '.join('{0}={1}'.format(name,value) for (name,value) in graph['params'].items()))
+        for (name,value) in graph['results'].items():
+            if name == 'nodes':
+                lines.append('    {0:<24} {1:>12d}'.format(name,value))
+            else:
+                lines.append('    {0:<24} {1:12.6g} s'.format(name,value))
+    for (name,nanosec) in report.get('attributes',{}).items():
+        lines.append('{0:<28} {1:8.1f} ns'.format('attribute ' + name,nanosec))
+    return '\n'.join(lines)
+
+# --------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CompMan benchmarks on synthetic dependency graphs.')
+    parser.add_argument('--depth',type=int,nargs='+',default=[4])
+    parser.add_argument('--fanout',type=int,nargs='+',default=[3])
+    parser.add_argument('--sharing',type=float,nargs='+',default=[0.5])
+    parser.add_argument('--config-size',type=int,nargs='+',default=[10])
+    parser.add_argument('--hash-mode',nargs='+',default=['legacy','merkle'])
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--attribute-number',type=int,default=1000000,
+                        help='attribute reads per timing, 0 to skip')
+    parser.add_argument('--output',help='write results to this JSON file')
+    parser.add_argument('--baseline',help='JSON file of earlier results to compare with')
+    parser.add_argument('--threshold',type=float,default=1.25,
+                        help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+    report = runBenchmarks(args.depth,args.fanout,args.sharing,args.config_size,args.hash_mode,
+                           args.repeat,args.attribute_number)
+    print(formatReport(report))
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(report,f,indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareReports(baseline,report,args.threshold)
+        for (name,oldValue,value) in regressions:
+            print('REGRESSION {0}: {1:.6g} -> {2:.6g}'.format(name,oldValue,value))
+        if regressions:
+            return 1
+    return 0
+
+# --------------------
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,369 @@
+'''
+CompMan result cache.
+
+Two-tier cache of CompMan outputs used by CompMan.getOutput() for
+child classes that implement computeOutput():
+  - memory tier: results kept in this process
+  - disk tier: pickle file in the output directory of each instance
+each with its own byte budget and eviction policy.
+'''
+
+import io
+import os
+import numbers
+import threading
+from collections import OrderedDict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from compman import *
+from compman_store import isMapped,getMappedFile,loadArray,loadBuffer,MappedBuffer
+
+# --------------------
+class ResultCache(object):
+    '''
+    Result cache keyed by (cmBasePath, getTagPrefix(True)).
+
+    memoryBudget
+      - maximum total size in bytes of the results kept in memory, None
+      for no limit, 0 to disable the memory tier
+    diskBudget
+      - maximum total size in bytes of the result files written by (or
+      found by) this cache, None for no limit, 0 to disable the disk tier
+      - result files are only written for instances with a cmBasePath
+    policy, diskPolicy
+      - eviction policy of the memory / disk tier:
+        'lru' - least recently used first
+        'lfu' - least frequently used first (ties: least recently used)
+      - diskPolicy defaults to policy
+    computeLock
+      - True (default): results that go to the disk tier are computed
+      while holding the compute lock of the instance, so that concurrent
+      processes sharing cmBasePath compute each result only once: the
+      others wait for the lock and then load the result file
+      - False: compute without locking
+    lockOptions
+      - dict of keyword arguments for CompMan.getComputeLock(), or None
+      for the defaults
+
+    Evicting a result from the disk tier deletes its result file along
+    with the complete marker and build stamp of the instance (see
+    CompMan.markOutputComplete()), so its output is no longer reported
+    complete.
+
+    Result sizes are taken from .nbytes (eg: NumPy arrays) or len() of
+    strings, otherwise from the size of the pickled result. Memory-mapped
+    results (see compman_store) only count the size of their pickled
+    file reference, and are stored in result files as such.
+    '''
+    def __init__(self,memoryBudget=2**30,diskBudget=None,policy='lru',diskPolicy=None,computeLock=True,
+                 lockOptions=None):
+        if diskPolicy is None:
+            diskPolicy = policy
+        for pol in (policy,diskPolicy):
+            if pol not in ('lru','lfu'):
+                raise ValueError('Invalid eviction policy: {}'.format(pol))
+        self.memoryBudget = memoryBudget
+        self.diskBudget   = diskBudget
+        self.lockOptions  = (dict(lockOptions) if lockOptions is not None else {}) if computeLock else None
+        self.memoryTier   = _CacheTier(policy)
+        self.diskTier     = _CacheTier(diskPolicy)
+        self.lock         = threading.RLock()
+        self.stats        = OrderedDict((('memoryHits',0),('diskHits',0),('misses',0),
+                                         ('memoryEvictions',0),('diskEvictions',0)))
+
+    # --------------------
+    def getOutput(self,man):
+        '''
+        Returns the output of CompMan instance man: from memory, else
+        from its result file, else from man.computeOutput(), storing it
+        in both tiers.
+        '''
+        (found,value) = self.lookup(man)
+        if found:
+            return value
+        if self.lockOptions is None or self.diskBudget == 0 or man.getBasePath() is None:
+            return self._fetchOrCompute(man)
+        with man.getComputeLock(**self.lockOptions):
+            # may have been computed by another process while waiting
+            (found,value) = self.lookup(man)
+            if not found:
+                value = self._fetchOrCompute(man)
+        return value
+
+    def _fetchOrCompute(self,man):
+        '''
+        Internal function
+        Fetches the output of man from its artifact store if it has one
+        (see CompMan.cmArtifactStore), else (or if the artifact cannot be
+        fetched, see compman_artifact.fetchOutput()) computes and stores
+        it, and publishes it to the artifact store.
+        '''
+        artifactStore = man.getArtifactStore() if self.diskBudget != 0 and man.getBasePath() is not None else None
+        if artifactStore is not None:
+            from compman_artifact import fetchOutput,publishOutput
+            if fetchOutput(man,artifactStore):
+                (found,value) = self.lookup(man)
+                if found:
+                    return value
+        value = man.computeOutput()
+        self.store(man,value)
+        if artifactStore is not None:
+            publishOutput(man,artifactStore)
+        return value
+
+    def lookup(self,man):
+        '''
+        Returns (True,result) if the result of man is cached, otherwise
+        (False,None). Results found on disk are added to the memory tier.
+        '''
+        key = self.getKey(man)
+        with self.lock:
+            if key in self.memoryTier:
+                self.stats['memoryHits'] += 1
+                return (True,self.memoryTier.touch(key))
+        if self.diskBudget != 0 and man.getBasePath() is not None:
+            filePath = self.getResultFilePath(man)
+            try:
+                data = man.readOutputFile(filePath)
+            except (IOError,OSError):
+                data = None
+            if data is not None:
+                value = _loadResult(man,data)
+                with self.lock:
+                    self.stats['diskHits'] += 1
+                    if key in self.diskTier:
+                        self.diskTier.touch(key)
+                    else:
+                        self._addToDisk(key,man,filePath,len(data))
+                    self._addToMemory(key,value,_getResultSize(value,data))
+                return (True,value)
+        with self.lock:
+            self.stats['misses'] += 1
+        return (False,None)
+
+    def store(self,man,value):
+        '''
+        Stores result value of CompMan instance man in both tiers. The
+        result file is written atomically, then man.markOutputComplete()
+        is called.
+        '''
+        key  = self.getKey(man)
+        data = None
+        if self.diskBudget != 0 and man.getBasePath() is not None:
+            data = _dumpResult(man,value)
+            filePath = self.getResultFilePath(man)
+            man.makeOutputPath()
+            tmpPath = '{0}.tmp{1}'.format(filePath,os.getpid())
+            with open(tmpPath,'wb') as f:
+                f.write(data)
+            os.rename(tmpPath,filePath)
+            man.markOutputComplete()
+            with self.lock:
+                self._addToDisk(key,man,filePath,len(data))
+        with self.lock:
+            self._addToMemory(key,value,_getResultSize(value,data))
+
+    def put(self,man,value):
+        '''
+        Adds result value of CompMan instance man to the memory tier
+        only, eg: a result computed in another process. Does nothing if
+        a result for man is already in memory.
+        '''
+        key = self.getKey(man)
+        with self.lock:
+            if key not in self.memoryTier:
+                self._addToMemory(key,value,_getResultSize(value))
+
+    def discard(self,man,deleteFile=False):
+        '''
+        Removes the result of man from the memory tier, and deletes its
+        result file (with its complete marker and build stamp) if
+        deleteFile is True.
+        '''
+        key = self.getKey(man)
+        with self.lock:
+            self.memoryTier.remove(key)
+            if deleteFile:
+                self.diskTier.remove(key)
+        if deleteFile and man.getBasePath() is not None:
+            _removeResultFiles(key,self._getResultFiles(man))
+
+    def clear(self):
+        '''
+        Empties the memory tier. Result files are kept.
+        '''
+        with self.lock:
+            self.memoryTier = _CacheTier(self.memoryTier.policy)
+
+    # --------------------
+    def getKey(self,man):
+        return (man.getBasePath(),man.getTagPrefix(True))
+
+    def getResultFilePath(self,man):
+        fileName = 'compman_result.{}.pkl'.format(man.getTagPrefix(True))
+        return os.path.join(man.getOutputPath(),fileName)
+
+    def getMemoryUsage(self):
+        return self.memoryTier.totalSize
+
+    def getDiskUsage(self):
+        return self.diskTier.totalSize
+
+    def _addToMemory(self,key,value,size):
+        if self.memoryBudget == 0 or (self.memoryBudget is not None and size > self.memoryBudget):
+            return
+        self.memoryTier.add(key,value,size)
+        while self.memoryBudget is not None and self.memoryTier.totalSize > self.memoryBudget:
+            self.memoryTier.popVictim()
+            self.stats['memoryEvictions'] += 1
+
+    def _addToDisk(self,key,man,filePath,size):
+        self.diskTier.add(key,self._getResultFiles(man,filePath),size)
+        while self.diskBudget is not None and self.diskTier.totalSize > self.diskBudget:
+            (victimKey,victimFiles) = self.diskTier.popVictim()
+            _removeResultFiles(victimKey,victimFiles)
+            self.stats['diskEvictions'] += 1
+
+    def _getResultFiles(self,man,filePath=None):
+        '''
+        Internal function
+        Returns (result file,complete marker,build stamp) paths of man.
+        '''
+        if filePath is None:
+            filePath = self.getResultFilePath(man)
+        return (filePath,man.getCompleteFilePath(),man.getStampFilePath())
+
+# --------------------
+class _CacheTier(object):
+    '''
+    Internal class
+    Sized entries in least recently used first order, with use counts
+    for LFU eviction.
+    '''
+    def __init__(self,policy):
+        self.policy    = policy
+        self.entries   = OrderedDict() # key -> (value,size)
+        self.counts    = {}
+        self.totalSize = 0
+
+    def __contains__(self,key):
+        return key in self.entries
+
+    def add(self,key,value,size):
+        self.remove(key)
+        self.entries[key] = (value,size)
+        self.counts[key]  = 1
+        self.totalSize   += size
+
+    def touch(self,key):
+        (value,size) = self.entries.pop(key)
+        self.entries[key] = (value,size)
+        self.counts[key] += 1
+        return value
+
+    def remove(self,key):
+        if key in self.entries:
+            (value,size) = self.entries.pop(key)
+            del self.counts[key]
+            self.totalSize -= size
+
+    def popVictim(self):
+        '''
+        Removes and returns (key,value) of the entry to evict.
+        '''
+        if self.policy == 'lfu':
+            victimKey = min(self.entries,key=self.counts.__getitem__) # first minimum = least recent
+        else:
+            victimKey = next(iter(self.entries))
+        value = self.entries[victimKey][0]
+        self.remove(victimKey)
+        return (victimKey,value)
+
+# --------------------
+def _dumpResult(man,value):
+    '''
+    Internal function
+    Pickles result value of CompMan instance man for its result file.
+    Memory-mapped outputs in man.getOutputPath() (the result itself, or
+    items of a list, tuple or dict result) are pickled as references to
+    their file name only, so the result file stays valid when the output
+    directory is moved or fetched from an artifact store (see
+    compman_artifact).
+    '''
+    items = value.values() if isinstance(value,dict) else value if isinstance(value,(list,tuple)) else ()
+    if not isMapped(value) and not any(isMapped(item) for item in items):
+        return pickle.dumps(value,pickle.HIGHEST_PROTOCOL)
+    outputPath = os.path.abspath(man.getOutputPath())
+    def persistentId(obj):
+        filePath = getMappedFile(obj)
+        if filePath is None or os.path.dirname(filePath) != outputPath:
+            return None
+        return ('buffer' if isinstance(obj,MappedBuffer) else 'array',os.path.basename(filePath))
+    stream  = io.BytesIO()
+    pickler = pickle.Pickler(stream,pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistentId
+    pickler.dump(value)
+    return stream.getvalue()
+
+def _loadResult(man,data):
+    '''
+    Internal function
+    Unpickles result file data of CompMan instance man, see
+    _dumpResult().
+    '''
+    def persistentLoad(pid):
+        (kind,fileName) = pid
+        filePath = os.path.join(man.getOutputPath(),fileName)
+        return loadBuffer(filePath) if kind == 'buffer' else loadArray(filePath)
+    unpickler = pickle.Unpickler(io.BytesIO(data))
+    unpickler.persistent_load = persistentLoad
+    return unpickler.load()
+
+def _getResultSize(value,data=None):
+    '''
+    Internal function
+    Estimated size in bytes of result value, data is the pickled value
+    if available.
+    '''
+    if isMapped(value):
+        # memory-mapped output, takes no memory of its own
+        return len(pickle.dumps(value,pickle.HIGHEST_PROTOCOL)) if data is None else len(data)
+    nbytes = getattr(value,'nbytes',None)
+    if isinstance(nbytes,numbers.Integral):
+        return nbytes
+    if isinstance(value,(bytes,bytearray)):
+        return len(value)
+    if data is None:
+        data = pickle.dumps(value,pickle.HIGHEST_PROTOCOL)
+    return len(data)
+
+def _removeResultFiles(key,resultFiles):
+    '''
+    Internal function
+    Deletes the files of ResultCache._getResultFiles() of the result
+    with key, marker first so the output is never seen complete without
+    its result file, and lowers its status in the output catalog
+    attached for its base path, if any.
+    '''
+    (filePath,completePath,stampPath) = resultFiles
+    _removeFile(completePath)
+    _removeFile(stampPath)
+    _removeFile(filePath)
+    (basePath,tagPrefix) = key
+    catalog = outputCatalogs.get(os.path.normpath(basePath)) if basePath is not None else None
+    if catalog is not None:
+        catalog.recordIncomplete(os.path.dirname(completePath),tagPrefix)
+
+def _removeFile(filePath):
+    '''
+    Internal function
+    '''
+    try:
+        os.remove(filePath)
+    except OSError:
+        pass
+
+defaultResultCache = ResultCache()
@@ -0,0 +1,544 @@
+'''
+CompMan output and configuration catalogs.
+
+Index of the output directories under a cmBasePath, so that existence
+and completion queries for many CompMan instances can be answered
+without touching the file system for each one, and index of the config
+CSV files saved in them, so that outputs can be found by configuration.
+'''
+
+import os
+import re
+import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+
+from compman import *
+
+# --------------------
+class OutputCatalog(object):
+    '''
+    Catalog of the output directories under basePath:
+        basePath/cmDesc/<tag prefix WITHOUT extra config>/
+    built by a single scan of basePath and stored in an SQLite index
+    file (indexPath, defaults to basePath/compman_catalog.sqlite; put
+    it on a local disk if basePath is on a slow network file system).
+
+    For each output directory the catalog stores its hash tag and, for
+    each tag prefix WITH extra config found in it, its output status
+    (see CompMan.getOutputStatus()):
+        'created'    - output directory exists
+        'configured' - compman_config.<prefix>.csv exists
+        'complete'   - compman_complete.<prefix> exists
+
+    Once attached with attach() (or opened with openOutputCatalog()),
+    the catalog is kept up to date by CompMan.makeOutputPath(),
+    CompMan.saveConfigCSVFile() and CompMan.markOutputComplete() of
+    every CompMan instance with the same cmBasePath, and answers
+    CompMan.getOutputStatus() and CompMan.outputExists() from memory.
+    Changes made by other processes are picked up by reload() or scan().
+    '''
+    def __init__(self,basePath,indexPath=None):
+        self.basePath = basePath
+        if indexPath is None:
+            if not os.path.isdir(basePath):
+                os.makedirs(basePath)
+            indexPath = os.path.join(basePath,'compman_catalog.sqlite')
+        self.indexPath  = indexPath
+        self.lock       = threading.RLock()
+        self.connection = sqlite3.connect(indexPath,check_same_thread=False)
+        self.connection.text_factory = str
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS outputdirs ('
+                                    'relpath TEXT PRIMARY KEY, hashtag TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS outputs ('
+                                    'relpath TEXT, prefix TEXT, hashtag TEXT, status INTEGER, '
+                                    'PRIMARY KEY (relpath,prefix))')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS outputdirs_hashtag ON outputdirs (hashtag)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS outputs_hashtag ON outputs (hashtag)')
+        self.reload()
+
+    def reload(self):
+        '''
+        Reloads the in-memory copy of the catalog from the index file.
+        '''
+        with self.lock:
+            self.dirs    = dict(self.connection.execute('SELECT relpath,hashtag FROM outputdirs'))
+            self.outputs = dict(((relPath,prefix),status) for (relPath,prefix,status) in
+                                self.connection.execute('SELECT relpath,prefix,status FROM outputs'))
+
+    def attach(self):
+        '''
+        Makes CompMan instances with cmBasePath equal to self.basePath
+        use and update this catalog.
+        '''
+        outputCatalogs[os.path.normpath(self.basePath)] = self
+
+    def detach(self):
+        key = os.path.normpath(self.basePath)
+        if outputCatalogs.get(key) is self:
+            del outputCatalogs[key]
+
+    def close(self):
+        self.detach()
+        self.connection.close()
+
+    # --------------------
+    def scan(self,numThreads=8):
+        '''
+        Rebuilds the catalog from a scan of self.basePath. Directory
+        listings are done by numThreads threads in parallel.
+        '''
+        pool = ThreadPool(numThreads)
+        try:
+            relPaths  = listOutputDirs(self.basePath,pool)
+            fileLists = pool.map(lambda relPath: _listDir(os.path.join(self.basePath,relPath)),relPaths)
+        finally:
+            pool.close()
+        dirs    = {}
+        outputs = {}
+        for (relPath,fileNames) in zip(relPaths,fileLists):
+            dirs[relPath] = _parseHashTag(os.path.basename(relPath))
+            for fileName in fileNames:
+                match = statusFileRegex.match(fileName)
+                if match is None:
+                    continue
+                level  = 3 if match.group(1) == 'complete' else 2
+                prefix = match.group(2)
+                outputs[(relPath,prefix)] = max(level,outputs.get((relPath,prefix),0))
+        with self.lock:
+            with self.connection:
+                self.connection.execute('DELETE FROM outputdirs')
+                self.connection.execute('DELETE FROM outputs')
+                self.connection.executemany('INSERT INTO outputdirs VALUES (?,?)',dirs.items())
+                self.connection.executemany('INSERT INTO outputs VALUES (?,?,?,?)',
+                                            [(relPath,prefix,_parseHashTag(prefix),status)
+                                             for ((relPath,prefix),status) in outputs.items()])
+            self.dirs    = dirs
+            self.outputs = outputs
+
+    # --------------------
+    def getStatus(self,man):
+        '''
+        Returns output status of CompMan instance man, one of
+        outputStatusLevels.
+        '''
+        relPath = os.path.join(man.getDesc(),man.getTagPrefix(False))
+        if relPath not in self.dirs:
+            return 'missing'
+        return outputStatusLevels[self.outputs.get((relPath,man.getTagPrefix(True)),1)]
+
+    def getStatusMany(self,managers):
+        '''
+        Returns list with the output status of each CompMan instance in
+        managers, see getStatus().
+        '''
+        return [self.getStatus(man) for man in managers]
+
+    def existsMany(self,managers,minStatus='created'):
+        '''
+        Returns list of booleans, True for each CompMan instance in
+        managers with output status minStatus or later in
+        outputStatusLevels.
+        '''
+        minLevel = outputStatusLevels.index(minStatus)
+        return [outputStatusLevels.index(status) >= minLevel for status in self.getStatusMany(managers)]
+
+    def findByHashTag(self,hashTag):
+        '''
+        Returns sorted list of the output directory paths with hash tag
+        hashTag, with or without extra config.
+        '''
+        with self.lock:
+            relPaths = set(relPath for (relPath,) in
+                           self.connection.execute('SELECT relpath FROM outputdirs WHERE hashtag=?',(hashTag,)))
+            relPaths.update(relPath for (relPath,) in
+                            self.connection.execute('SELECT relpath FROM outputs WHERE hashtag=?',(hashTag,)))
+        return sorted(os.path.join(self.basePath,relPath) for relPath in relPaths)
+
+    def getOutputDirs(self):
+        '''
+        Returns sorted list of all output directory paths in the catalog.
+        '''
+        return sorted(os.path.join(self.basePath,relPath) for relPath in self.dirs)
+
+    # --------------------
+    def recordStatus(self,man,status):
+        '''
+        Records output status of CompMan instance man. Never lowers a
+        status already recorded, use recordIncomplete() or
+        removeOutputDir() for that.
+        '''
+        relPath = os.path.join(man.getDesc(),man.getTagPrefix(False))
+        prefix  = man.getTagPrefix(True)
+        level   = outputStatusLevels.index(status)
+        with self.lock:
+            if relPath in self.dirs and self.outputs.get((relPath,prefix),1) >= level:
+                return
+            with self.connection:
+                if relPath not in self.dirs:
+                    self.connection.execute('INSERT OR REPLACE INTO outputdirs VALUES (?,?)',
+                                            (relPath,man.getHashTag(False)))
+                    self.dirs[relPath] = man.getHashTag(False)
+                if level >= 2:
+                    self.connection.execute('INSERT OR REPLACE INTO outputs VALUES (?,?,?,?)',
+                                            (relPath,prefix,man.getHashTag(True),level))
+                    self.outputs[(relPath,prefix)] = level
+
+    def recordIncomplete(self,outputPath,prefix):
+        '''
+        Lowers the output status of tag prefix prefix (WITH extra
+        config) in output directory outputPath from 'complete' to
+        'configured', eg: once its result file was evicted (see
+        compman_cache). Does not touch the file system.
+        '''
+        relPath = os.path.relpath(outputPath,self.basePath)
+        with self.lock:
+            if self.outputs.get((relPath,prefix)) != 3:
+                return
+            with self.connection:
+                self.connection.execute('UPDATE outputs SET status=2 WHERE relpath=? AND prefix=?',(relPath,prefix))
+            self.outputs[(relPath,prefix)] = 2
+
+    def removeOutputDir(self,outputPath):
+        '''
+        Removes output directory outputPath (eg: from
+        CompMan.getOutputPath()) and all its outputs from the catalog.
+        Does not touch the file system.
+        '''
+        relPath = os.path.relpath(outputPath,self.basePath)
+        with self.lock:
+            with self.connection:
+                self.connection.execute('DELETE FROM outputdirs WHERE relpath=?',(relPath,))
+                self.connection.execute('DELETE FROM outputs WHERE relpath=?',(relPath,))
+            self.dirs.pop(relPath,None)
+            for key in [key for key in self.outputs if key[0] == relPath]:
+                del self.outputs[key]
+
+# --------------------
+class ConfigCatalog(object):
+    '''
+    Catalog of the config CSV files (compman_config.<prefix>.csv, see
+    CompMan.saveConfigCSVFile()) in the output directories under
+    basePath, stored in an SQLite index file (indexPath, defaults to
+    basePath/compman_catalog.sqlite, shared with OutputCatalog).
+
+    ingest() adds new and changed files and drops deleted ones, so it is
+    cheap to call again. Each file is parsed (see parseConfigString())
+    into:
+      - its core fields: class name, cmDesc, cmCodeTag, cmMetaParam,
+      tag prefix and hash tag
+      - its config values, with names of values of dependencies
+      prefixed by the name of the dependency, eg: 'templateMan1.field2'
+      (the value of a dependency itself is its hash tag)
+      - its dependencies, with their core fields and hash tag
+    which can then be queried with findConfigFiles() and
+    findOutputPaths(). Values are compared as the strings written in
+    the config CSV files.
+    '''
+    def __init__(self,basePath,indexPath=None):
+        self.basePath = basePath
+        if indexPath is None:
+            if not os.path.isdir(basePath):
+                os.makedirs(basePath)
+            indexPath = os.path.join(basePath,'compman_catalog.sqlite')
+        self.indexPath  = indexPath
+        self.lock       = threading.RLock()
+        self.connection = sqlite3.connect(indexPath,check_same_thread=False)
+        self.connection.text_factory = str
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS configfiles ('
+                                    'id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER, '
+                                    'prefix TEXT, hashtag TEXT, classname TEXT, '
+                                    'desc TEXT, codetag TEXT, metaparam TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS configvalues ('
+                                    'fileid INTEGER, name TEXT, value TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS configdeps ('
+                                    'fileid INTEGER, name TEXT, classname TEXT, '
+                                    'desc TEXT, codetag TEXT, metaparam TEXT, hashtag TEXT)')
+            for (table,columns) in (('configfiles','hashtag'),('configfiles','desc'),
+                                    ('configfiles','codetag'),('configfiles','metaparam'),
+                                    ('configvalues','name,value'),('configvalues','fileid'),
+                                    ('configdeps','hashtag'),('configdeps','fileid')):
+                self.connection.execute('CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({2})'.format(
+                                        table,columns.replace(',','_'),columns))
+
+    def close(self):
+        self.connection.close()
+
+    # --------------------
+    def ingest(self,filePaths=None,numThreads=8):
+        '''
+        Adds config CSV files to the catalog: filePaths (list of paths),
+        or by default every config CSV file found under self.basePath, in
+        which case files that no longer exist are dropped. Files already
+        in the catalog with unchanged modification time and size are
+        skipped. Listing and parsing are done by numThreads threads in
+        parallel, the catalog is updated in one transaction.
+        Returns number of files added or updated.
+        '''
+        pool = ThreadPool(numThreads)
+        try:
+            fullScan = filePaths is None
+            if fullScan:
+                filePaths = self._findConfigFiles(pool)
+            filePaths = [os.path.abspath(filePath) for filePath in filePaths]
+            stats = pool.map(_getFileStat,filePaths)
+            with self.lock:
+                known = dict((path,(mtime,size)) for (path,mtime,size) in
+                             self.connection.execute('SELECT path,mtime,size FROM configfiles'))
+            changed = [(filePath,stat) for (filePath,stat) in zip(filePaths,stats)
+                       if stat is not None and known.get(filePath) != stat]
+            parsed = pool.map(_parseConfigFile,[filePath for (filePath,stat) in changed])
+        finally:
+            pool.close()
+        if fullScan:
+            removed = set(known).difference(filePaths)
+        else:
+            removed = set(filePath for (filePath,stat) in zip(filePaths,stats) if stat is None and filePath in known)
+        with self.lock:
+            with self.connection:
+                for filePath in removed:
+                    self._removeFile(filePath)
+                for ((filePath,(mtime,size)),(values,deps)) in zip(changed,parsed):
+                    self._removeFile(filePath)
+                    prefix = configFileRegex.match(os.path.basename(filePath)).group(1)
+                    (className,fields) = deps['']
+                    cursor = self.connection.execute('INSERT INTO configfiles VALUES (NULL,?,?,?,?,?,?,?,?,?)',
+                                                     (filePath,mtime,size,prefix,_parseHashTag(prefix),className,
+                                                      fields.get('cmDesc'),fields.get('cmCodeTag'),
+                                                      fields.get('cmMetaParam')))
+                    fileId = cursor.lastrowid
+                    self.connection.executemany('INSERT INTO configvalues VALUES (?,?,?)',
+                                                [(fileId,name,value) for (name,value) in values])
+                    self.connection.executemany('INSERT INTO configdeps VALUES (?,?,?,?,?,?,?)',
+                                                [(fileId,name,className,fields.get('cmDesc'),fields.get('cmCodeTag'),
+                                                  fields.get('cmMetaParam'),fields.get('cmHashTag'))
+                                                 for (name,(className,fields)) in deps.items() if name])
+        return len(changed)
+
+    def _findConfigFiles(self,pool):
+        relPaths  = listOutputDirs(self.basePath,pool)
+        fileLists = pool.map(lambda relPath: _listDir(os.path.join(self.basePath,relPath)),relPaths)
+        return [os.path.join(self.basePath,relPath,fileName)
+                for (relPath,fileNames) in zip(relPaths,fileLists)
+                for fileName in fileNames if configFileRegex.match(fileName)]
+
+    def _removeFile(self,filePath):
+        for (fileId,) in self.connection.execute('SELECT id FROM configfiles WHERE path=?',(filePath,)).fetchall():
+            self.connection.execute('DELETE FROM configvalues WHERE fileid=?',(fileId,))
+            self.connection.execute('DELETE FROM configdeps WHERE fileid=?',(fileId,))
+            self.connection.execute('DELETE FROM configfiles WHERE id=?',(fileId,))
+
+    # --------------------
+    def findConfigFiles(self,fields=None,desc=None,codeTag=None,metaParam=None,className=None,
+                        hashTag=None,depHashTag=None):
+        '''
+        Returns sorted list of the paths of the config CSV files that
+        match all of the criteria given:
+          fields     - dict of config value name -> value, names of values
+                       of dependencies as 'depName.name', eg:
+                       {'field2':200,'templateMan1.cmMetaParam':'p1'}
+          desc, codeTag, metaParam, className, hashTag
+                     - core fields of the instance that saved the file
+                     (hashTag WITH extra config)
+          depHashTag - hash tag of one of its dependencies (at any depth)
+        '''
+        conditions = []
+        params     = []
+        for (column,value) in (('desc',desc),('codetag',codeTag),('metaparam',metaParam),
+                               ('classname',className),('hashtag',hashTag)):
+            if value is not None:
+                conditions.append('{}=?'.format(column))
+                params.append(str(value))
+        if depHashTag is not None:
+            conditions.append('id IN (SELECT fileid FROM configdeps WHERE hashtag=?)')
+            params.append(str(depHashTag))
+        for (name,value) in (fields or {}).items():
+            conditions.append('id IN (SELECT fileid FROM configvalues WHERE name=? AND value=?)')
+            params.extend((name,str(value)))
+        sql = 'SELECT path FROM configfiles'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        with self.lock:
+            return sorted(path for (path,) in self.connection.execute(sql,params))
+
+    def findOutputPaths(self,*args,**kwargs):
+        '''
+        Same as findConfigFiles(), but returns sorted list of the output
+        directories (see CompMan.getOutputPath()) of the matching files.
+        '''
+        return sorted(set(os.path.dirname(path) for path in self.findConfigFiles(*args,**kwargs)))
+
+    def getConfig(self,filePath):
+        '''
+        Returns OrderedDict of config value name -> value string of
+        config CSV file filePath, as stored in the catalog.
+        '''
+        with self.lock:
+            return OrderedDict(self.connection.execute(
+                'SELECT name,value FROM configvalues WHERE fileid=(SELECT id FROM configfiles WHERE path=?) '
+                'ORDER BY rowid',(os.path.abspath(filePath),)))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM configfiles').fetchone()[0]
+
+# --------------------
+# names of the config CSV and complete marker files CompMan writes in
+# output directories (group 1: 'config' or 'complete', group 2: tag
+# prefix), not of their temporary files (<name>.tmp<pid>[.<thread>]),
+# and of the config CSV files only (group 1: tag prefix):
+statusFileRegex = re.compile(r'^compman_(config|complete)\.(?!.*\.tmp\d+(?:\.\d+)?$)(.+?)(?:\.csv)?$')
+configFileRegex = re.compile(r'^compman_config\.(.+)\.csv$')
+_hashTagRegex   = re.compile(r'([0-9A-Za-z]+)$')
+_headerRegex    = re.compile(r'^<(\w+)>$')
+
+def _parseHashTag(tagPrefix):
+    '''
+    Internal function
+    Returns the hash tag at the end of tagPrefix (see
+    CompMan.getTagPrefix()), or None.
+    '''
+    match = _hashTagRegex.search(tagPrefix)
+    return None if match is None else match.group(1)
+
+def _listDir(path):
+    '''
+    Internal function
+    '''
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+def listOutputDirs(basePath,pool):
+    '''
+    Returns list of the paths relative to basePath of the directories
+    two levels below it, ie: the possible output directories
+    basePath/cmDesc/<tag prefix>. They are not checked to hold CompMan
+    files (see statusFileRegex). Listed in parallel with pool (eg: a
+    ThreadPool).
+    '''
+    def listDescDir(descName):
+        descPath = os.path.join(basePath,descName)
+        return [os.path.join(descName,name) for name in _listDir(descPath)
+                if os.path.isdir(os.path.join(descPath,name))]
+    descNames = [name for name in _listDir(basePath) if os.path.isdir(os.path.join(basePath,name))]
+    return [relPath for relPathList in pool.map(listDescDir,descNames) for relPath in relPathList]
+
+def _getFileStat(filePath):
+    '''
+    Internal function
+    Returns (mtime,size) of filePath, or None if missing.
+    '''
+    try:
+        stat = os.stat(filePath)
+    except OSError:
+        return None
+    return (stat.st_mtime,stat.st_size)
+
+def _parseConfigFile(filePath):
+    '''
+    Internal function
+    '''
+    with open(filePath,'rb') as f:
+        string = f.read().decode('utf-8','replace')
+    return parseConfigString(string)
+
+# --------------------
+def parseConfigString(string):
+    '''
+    Parses a config string (see CompMan.generateHashString(), the
+    contents of config CSV files). Returns (values,deps):
+      values - list of (name,value string) in file order, names of
+      values of dependencies prefixed by the dependency name, eg:
+      'templateMan1.field2', the value of a dependency being its hash
+      tag (or its header '<ClassName>' if it has none)
+      deps - OrderedDict of dependency name -> (class name, dict of its
+      core fields cmDesc, cmCodeTag, cmMetaParam, cmSep, cmHashTag),
+      with name '' for the instance itself
+
+    Dependency blocks (nested in 'legacy' cmHashMode) are tracked with a
+    stack of the enclosing class names. NOTE: a dependency of the same
+    class as an enclosing instance cannot be told apart from it, rows
+    following such a block are attributed to the dependency. Lines that
+    do not belong to any enclosing class are continuation lines of
+    multi-line values.
+    '''
+    lines = string.split('\n')
+    match = _headerRegex.match(lines[0])
+    if match is None:
+        raise ValueError('Not a CompMan config string: {!r}'.format(lines[0][:100]))
+    stack  = [(match.group(1),'')] # (class name, dependency name)
+    deps   = OrderedDict([('',(match.group(1),{}))])
+    values = []
+    headerRows = {} # dependency name -> index of its row in values
+    for (lineNum,line) in enumerate(lines[1:],1):
+        for depth in range(len(stack)-1,-1,-1):
+            if line.startswith(stack[depth][0] + ','):
+                break
+        else:
+            depth = None
+        if depth is None or ',' not in line[len(stack[depth][0])+1:]:
+            if values:
+                values[-1] = (values[-1][0],values[-1][1] + '\n' + line)
+            continue
+        del stack[depth+1:]
+        (className,prefix) = stack[-1]
+        (name,value) = line[len(className)+1:].split(',',1)
+        fullName = prefix + '.' + name if prefix else name
+        match = _headerRegex.match(value)
+        if (match is not None and lineNum + 1 < len(lines) and
+            lines[lineNum+1].startswith(match.group(1) + ',')):
+            stack.append((match.group(1),fullName))
+            deps[fullName] = (match.group(1),{})
+            headerRows[fullName] = len(values)
+        elif name in ('cmDesc','cmCodeTag','cmMetaParam','cmSep','cmHashTag'):
+            deps[prefix][1][name] = value
+        values.append((fullName,value))
+    for (depName,index) in headerRows.items():
+        hashTag = deps[depName][1].get('cmHashTag')
+        if hashTag is not None:
+            values[index] = (depName,hashTag)
+    return (values,deps)
+
+# --------------------
+def openOutputCatalog(basePath,indexPath=None,rescan=False):
+    '''
+    Opens (creating if needed) and attaches the output catalog of
+    basePath. Scans basePath if rescan is True or the index is empty.
+    Returns the OutputCatalog.
+    '''
+    catalog = OutputCatalog(basePath,indexPath)
+    if rescan or not catalog.dirs:
+        catalog.scan()
+    catalog.attach()
+    return catalog
+
+def getOutputStatusMany(managers):
+    '''
+    Returns list with the output status of each CompMan instance in
+    managers, answered in bulk by the attached output catalogs where
+    possible and from the file system otherwise.
+    '''
+    return [man.getOutputStatus() for man in managers]
+
+def outputsExist(managers,minStatus='created'):
+    '''
+    Bulk version of CompMan.outputExists(), returns list of booleans.
+    '''
+    minLevel = outputStatusLevels.index(minStatus)
+    return [outputStatusLevels.index(status) >= minLevel for status in getOutputStatusMany(managers)]
+
+def openConfigCatalog(basePath,indexPath=None,ingest=True):
+    '''
+    Opens (creating if needed) the config catalog of basePath and, if
+    ingest is True, brings it up to date with ingest().
+    Returns the ConfigCatalog.
+    '''
+    catalog = ConfigCatalog(basePath,indexPath)
+    if ingest:
+        catalog.ingest()
+    return catalog
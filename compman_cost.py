@@ -0,0 +1,369 @@
+'''
+CompMan cost model and planning.
+
+Records the wall time, peak memory and output size of every node
+computed by DAGExecutor(costHistory=...) in a history file kept with
+the outputs (basePath/compman_costs.sqlite), and estimates from it the
+cost of nodes per (cmCodeTag, cmMetaParam). planGraph() uses those
+estimates to give a dry-run plan of a dependency graph before running
+it: which nodes must be computed, estimated total cost, critical path
+and makespan. DAGExecutor uses the same estimates to start nodes
+critical path first (upward rank) and within a memory limit.
+'''
+
+import os
+import sys
+import time
+import heapq
+import sqlite3
+import threading
+from collections import OrderedDict
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from compman import *
+
+# --------------------
+class CostHistory(object):
+    '''
+    History of the costs of computed nodes, in SQLite file historyPath
+    (defaults to basePath/compman_costs.sqlite). Estimates for a
+    CompMan instance are averaged over the last window runs with the
+    same (cmCodeTag, cmMetaParam), else with the same cmCodeTag, else
+    the defaults (defaultTime seconds, no memory, no output).
+    Picklable (by path), so it can be passed to process pools.
+    '''
+    def __init__(self,basePath,historyPath=None,window=20,defaultTime=1.0):
+        if historyPath is None:
+            if not os.path.isdir(basePath):
+                os.makedirs(basePath)
+            historyPath = os.path.join(basePath,'compman_costs.sqlite')
+        self.basePath    = basePath
+        self.historyPath = historyPath
+        self.window      = window
+        self.defaultTime = defaultTime
+        self.local       = threading.local()
+        self.stats       = None # (codeTag,metaParam) or codeTag -> estimate, see getEstimate()
+        with self.getConnection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS runs ('
+                               'codetag TEXT, metaparam TEXT, classname TEXT, tagprefix TEXT, '
+                               'walltime REAL, peakmemory INTEGER, outputsize INTEGER, time REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS runs_key ON runs (codetag,metaparam)')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['local']
+        state['stats'] = None
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def getConnection(self):
+        '''
+        Returns the SQLite connection of the calling thread.
+        '''
+        connection = getattr(self.local,'connection',None)
+        if connection is None:
+            connection = sqlite3.connect(self.historyPath,timeout=60)
+            connection.text_factory = str
+            self.local.connection = connection
+        return connection
+
+    # --------------------
+    def record(self,man,wallTime,peakMemory=0,outputSize=0):
+        '''
+        Records a run of CompMan instance man: wallTime in seconds,
+        peakMemory and outputSize in bytes.
+        '''
+        with self.getConnection() as connection:
+            connection.execute('INSERT INTO runs VALUES (?,?,?,?,?,?,?,?)',
+                               (man.getCodeTag(),man.getMetaParam(),type(man).__name__,man.getTagPrefix(True),
+                                wallTime,peakMemory,outputSize,time.time()))
+        self.stats = None
+
+    def reload(self):
+        '''
+        Reloads the estimates, eg: to see runs recorded by other
+        processes since the first estimate.
+        '''
+        rows = self.getConnection().execute('SELECT codetag,metaparam,walltime,peakmemory,outputsize FROM runs '
+                                            'ORDER BY rowid DESC').fetchall()
+        runs = {}
+        for (codeTag,metaParam,wallTime,peakMemory,outputSize) in rows: # latest first
+            for key in ((codeTag,metaParam),codeTag):
+                keyRuns = runs.setdefault(key,[])
+                if len(keyRuns) < self.window:
+                    keyRuns.append((wallTime,peakMemory,outputSize))
+        stats = {}
+        for (key,keyRuns) in runs.items():
+            n = len(keyRuns)
+            stats[key] = (sum(run[0] for run in keyRuns) / n,
+                          max(run[1] for run in keyRuns),
+                          sum(run[2] for run in keyRuns) // n,
+                          n)
+        self.stats = stats
+
+    def getEstimate(self,man):
+        '''
+        Returns (wall time in seconds, peak memory in bytes, output size
+        in bytes, number of runs it is based on) estimated for CompMan
+        instance man. Peak memory is the largest recorded, the others
+        are averages.
+        '''
+        if self.stats is None:
+            self.reload()
+        estimate = self.stats.get((man.getCodeTag(),man.getMetaParam()))
+        if estimate is None:
+            estimate = self.stats.get(man.getCodeTag())
+        if estimate is None:
+            estimate = (self.defaultTime,0,0,0)
+        return estimate
+
+    def getEstimates(self,nodes):
+        '''
+        Returns dict tagPrefix -> getEstimate() for OrderedDict nodes
+        tagPrefix -> CompMan instance (see getDependencyGraph()).
+        '''
+        return dict((tagPrefix,self.getEstimate(man)) for (tagPrefix,man) in nodes.items())
+
+# --------------------
+def measureCall(function,*args,**kwargs):
+    '''
+    Returns (result,wall time in seconds,peak memory in bytes) of
+    function(*args,**kwargs). Peak memory is the largest increase of
+    the resident set size of the process during the call, sampled by a
+    thread every 50 ms (process wide: includes other threads).
+    '''
+    sampler = _MemorySampler()
+    sampler.start()
+    startTime = time.time()
+    try:
+        result = function(*args,**kwargs)
+    finally:
+        wallTime = time.time() - startTime
+        peakMemory = sampler.stop()
+    return (result,wallTime,peakMemory)
+
+def getOutputSize(man):
+    '''
+    Returns the total size in bytes of the output files of CompMan
+    instance man (see CompMan.getArtifactFiles()), 0 if it has no base
+    path.
+    '''
+    if man.getBasePath() is None:
+        return 0
+    size = 0
+    for filePath in man.getArtifactFiles():
+        try:
+            size += os.path.getsize(filePath)
+        except OSError:
+            pass
+    return size
+
+def getUpwardRanks(nodes,deps,times):
+    '''
+    Returns dict tagPrefix -> upward rank of the nodes of a dependency
+    graph (nodes and deps from getDependencyGraph()): its time plus the
+    largest upward rank of its dependents, ie: the length of the longest
+    chain of work that cannot start before it is done. Running the
+    ready node with the highest rank first follows the critical path.
+    times is dict tagPrefix -> estimated time.
+    '''
+    ranks = {}
+    dependentRanks = dict((tagPrefix,0.0) for tagPrefix in nodes)
+    for tagPrefix in reversed(list(nodes)): # dependents before dependencies
+        ranks[tagPrefix] = times[tagPrefix] + dependentRanks[tagPrefix]
+        for depTag in deps[tagPrefix]:
+            dependentRanks[depTag] = max(dependentRanks[depTag],ranks[tagPrefix])
+    return ranks
+
+# --------------------
+def planGraph(roots,costHistory,numWorkers=None,memoryLimit=None,checkFresh=False):
+    '''
+    Dry-run plan of computing roots (CompMan instance or list of them):
+    walks their dependency graph, checks which outputs already exist
+    (complete, or fresh if checkFresh, see compman_stamp) and estimates
+    the cost of the nodes to compute with costHistory (CostHistory).
+    Nodes to compute are the roots and the dependencies of nodes to
+    compute, unless their output exists.
+    Returns OrderedDict:
+        nodes            - OrderedDict tagPrefix -> OrderedDict of
+                           exists, run, time, memory, outputSize, runs
+                           (number of runs of the estimate), rank
+        numNodes, numToRun
+        totalTime        - estimated sum of the times of nodes to run
+        totalOutputSize  - estimated bytes written by nodes to run
+        peakMemory       - largest estimated memory of a node to run
+        criticalPath     - tag prefixes of the longest chain of nodes to
+                           run, dependencies first
+        criticalPathTime - estimated time of that chain
+        makespan         - estimated elapsed time with numWorkers
+                           workers (default: number of CPUs) and
+                           memoryLimit bytes, see DAGExecutor
+    '''
+    if isinstance(roots,CompMan):
+        roots = [roots]
+    if numWorkers is None:
+        import multiprocessing
+        numWorkers = multiprocessing.cpu_count()
+    (nodes,deps) = getDependencyGraph(roots)
+    if checkFresh:
+        from compman_stamp import checkFreshness
+        freshness = checkFreshness(roots)
+        exists = dict((tagPrefix,freshness[tagPrefix] is None and nodes[tagPrefix].getBasePath() is not None)
+                      for tagPrefix in nodes)
+    else:
+        exists = dict((tagPrefix,man.getBasePath() is not None and man.outputExists('complete'))
+                      for (tagPrefix,man) in nodes.items())
+    toRun = set()
+    needed = set(root.getTagPrefix(True) for root in roots)
+    for tagPrefix in reversed(list(nodes)): # dependents before dependencies
+        if tagPrefix in needed and not exists[tagPrefix]:
+            toRun.add(tagPrefix)
+            needed.update(deps[tagPrefix])
+    estimates = costHistory.getEstimates(nodes)
+    times     = dict((tagPrefix,estimates[tagPrefix][0] if tagPrefix in toRun else 0.0) for tagPrefix in nodes)
+    ranks     = getUpwardRanks(nodes,deps,times)
+    planNodes = OrderedDict()
+    for tagPrefix in nodes:
+        (wallTime,memory,outputSize,numRuns) = estimates[tagPrefix]
+        planNodes[tagPrefix] = OrderedDict((('exists',exists[tagPrefix]),('run',tagPrefix in toRun),
+                                            ('time',wallTime),('memory',memory),('outputSize',outputSize),
+                                            ('runs',numRuns),('rank',ranks[tagPrefix])))
+    # critical path: longest chain of nodes to run
+    pathTimes = {}
+    previous  = {}
+    for tagPrefix in nodes: # dependencies first
+        best = None
+        for depTag in deps[tagPrefix]:
+            if best is None or pathTimes[depTag] > pathTimes[best]:
+                best = depTag
+        pathTimes[tagPrefix] = times[tagPrefix] + (0.0 if best is None else pathTimes[best])
+        previous[tagPrefix]  = best
+    path = []
+    tagPrefix = max(pathTimes,key=pathTimes.get) if pathTimes else None
+    criticalPathTime = pathTimes[tagPrefix] if tagPrefix is not None else 0.0
+    while tagPrefix is not None:
+        if tagPrefix in toRun:
+            path.append(tagPrefix)
+        tagPrefix = previous[tagPrefix]
+    plan = OrderedDict()
+    plan['nodes']            = planNodes
+    plan['numNodes']         = len(nodes)
+    plan['numToRun']         = len(toRun)
+    plan['totalTime']        = sum(times.values())
+    plan['totalOutputSize']  = sum(estimates[tagPrefix][2] for tagPrefix in toRun)
+    plan['peakMemory']       = max([estimates[tagPrefix][1] for tagPrefix in toRun] or [0])
+    plan['criticalPath']     = path[::-1]
+    plan['criticalPathTime'] = criticalPathTime
+    plan['makespan']         = _simulate(nodes,deps,toRun,times,ranks,
+                                         dict((tagPrefix,estimates[tagPrefix][1]) for tagPrefix in nodes),
+                                         numWorkers,memoryLimit)
+    return plan
+
+def formatPlan(plan,n=20):
+    '''
+    Returns planGraph() plan as a printable string, listing the n most
+    expensive nodes to run.
+    '''
+    lines = ['{0:<18} {1}'.format(name,value) for (name,value) in plan.items()
+             if name not in ('nodes','criticalPath')]
+    toRun = sorted(((tagPrefix,node) for (tagPrefix,node) in plan['nodes'].items() if node['run']),
+                   key=lambda item: -item[1]['time'])
+    lines.append('most expensive nodes to run:')
+    for (tagPrefix,node) in toRun[:n]:
+        lines.append('  {0:10.3f} s {1:>12} B {2:4d} runs  {3}'.format(node['time'],node['memory'],
+                                                                        node['runs'],tagPrefix))
+    lines.append('critical path:')
+    lines.extend('  ' + tagPrefix for tagPrefix in plan['criticalPath'])
+    return '\n'.join(lines)
+
+# --------------------
+def _simulate(nodes,deps,toRun,times,ranks,memories,numWorkers,memoryLimit):
+    '''
+    Internal function
+    Estimated makespan of running the nodes in toRun with numWorkers
+    workers and memoryLimit, highest upward rank first, as DAGExecutor
+    does.
+    '''
+    dependents = dict((tagPrefix,[]) for tagPrefix in toRun)
+    numWaiting = {}
+    for tagPrefix in toRun:
+        depTags = [depTag for depTag in deps[tagPrefix] if depTag in toRun]
+        numWaiting[tagPrefix] = len(depTags)
+        for depTag in depTags:
+            dependents[depTag].append(tagPrefix)
+    ready   = [tagPrefix for tagPrefix in toRun if numWaiting[tagPrefix] == 0]
+    running = [] # heap of (end time,tagPrefix)
+    now     = 0.0
+    memory  = 0
+    while ready or running:
+        ready.sort(key=lambda tagPrefix: -ranks[tagPrefix])
+        for tagPrefix in list(ready):
+            if len(running) >= numWorkers:
+                break
+            if memoryLimit is not None and running and memory + memories[tagPrefix] > memoryLimit:
+                continue
+            ready.remove(tagPrefix)
+            memory += memories[tagPrefix]
+            heapq.heappush(running,(now + times[tagPrefix],tagPrefix))
+        (now,tagPrefix) = heapq.heappop(running)
+        memory -= memories[tagPrefix]
+        for dependent in dependents[tagPrefix]:
+            numWaiting[dependent] -= 1
+            if numWaiting[dependent] == 0:
+                ready.append(dependent)
+    return now
+
+class _MemorySampler(object):
+    '''
+    Internal class
+    Samples the resident set size of the process in a thread, see
+    measureCall().
+    '''
+    interval = 0.05
+
+    def __init__(self):
+        self.startRSS = _getRSS()
+        self.peakRSS  = self.startRSS
+        self.stopped  = threading.Event()
+        self.thread   = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.peakRSS = max(self.peakRSS,_getRSS())
+        return max(0,self.peakRSS - self.startRSS)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peakRSS = max(self.peakRSS,_getRSS())
+
+def _getRSS():
+    '''
+    Internal function
+    Current resident set size in bytes, from /proc on Linux, else the
+    peak so far from getrusage(), else 0.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _pageSize
+    except (IOError,OSError,ValueError,IndexError):
+        pass
+    if resource is not None:
+        maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxRSS if sys.platform == 'darwin' else maxRSS * 1024
+    return 0
+
+try:
+    _pageSize = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError,ValueError,OSError):
+    _pageSize = 4096
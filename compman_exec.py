@@ -0,0 +1,368 @@
+'''
+CompMan parallel DAG executor.
+
+Runs getOutput() of every node in the dependency graph of one or more
+CompMan instances on a thread or process pool, starting each node as
+soon as all of its dependencies are done.
+'''
+
+import sys
+import time
+import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from compman import *
+
+# --------------------
+class NodeResult(object):
+    '''
+    Outcome of one node run by DAGExecutor.
+
+    status
+      - 'done'    - getOutput() returned, value holds the result
+      - 'failed'  - getOutput() raised, error and traceback hold the details
+      - 'skipped' - not run because a dependency failed or was skipped
+      - 'fresh'   - not run because its output is up to date (see
+      DAGExecutor skipFresh), value is None
+    '''
+    def __init__(self,tagPrefix,man):
+        self.tagPrefix = tagPrefix
+        self.man       = man
+        self.status    = None
+        self.value     = None
+        self.error     = None
+        self.traceback = None
+        self.startTime = None
+        self.endTime   = None
+
+    def getDuration(self):
+        if self.startTime is None or self.endTime is None:
+            return None
+        return self.endTime - self.startTime
+
+    def __repr__(self):
+        return '<NodeResult {0} {1}>'.format(self.tagPrefix,self.status)
+
+class DAGExecutionError(Exception):
+    def __init__(self,failedResults):
+        self.failedResults = failedResults
+        msg = '{0} node(s) failed: {1}'.format(len(failedResults),
+                                                ', '.join(result.tagPrefix for result in failedResults))
+        Exception.__init__(self,msg)
+
+# --------------------
+class DAGExecutor(object):
+    '''
+    Parallel executor for the dependency graph of CompMan instances
+    (see getDependencyGraph()). Nodes are deduplicated by
+    getTagPrefix(True) and run with getOutput() once all of their
+    dependencies are done.
+
+    numWorkers
+      - pool size, defaults to the number of CPUs
+    useProcesses
+      - False (default): thread pool, fine when getOutput() releases
+      the GIL (I/O, NumPy, ...)
+      - True: process pool, CompMan instances and results must be
+      picklable. Memory-mapped outputs (see CompMan.saveArrayOutput())
+      are passed as file references and mapped by each worker, not
+      copied
+    keepResults
+      - True (default): NodeResult.value is kept for every node
+      - False: only kept for the roots, other values are dropped once
+      all of their dependents are done
+    skipFresh
+      - False (default): every node is run
+      - True: the build stamps of the graph are checked first (see
+      compman_stamp.checkFreshness()) and fresh nodes are not run, so
+      only the nodes affected by a change (or not completed before a
+      crash) are. Stale nodes that implement computeOutput() have their
+      result file deleted first, so they are recomputed. Dependents
+      of fresh nodes get their outputs from the result files
+    stamp
+      - False (default): build stamps are only written by
+      markOutputComplete()
+      - True: a build stamp is also written for nodes with a base path
+      whose getOutput() did not write a new one (ie: child classes that
+      override getOutput() without calling markOutputComplete())
+    costHistory
+      - None (default): ready nodes are started in topological order
+      - compman_cost.CostHistory: the wall time, peak memory and output
+      size of the nodes that are computed (not loaded) are recorded in
+      it, and ready nodes are started highest upward rank first (see
+      compman_cost.getUpwardRanks()), ie: critical path first, from the
+      estimated times
+    memoryLimit
+      - None (default): no limit
+      - bytes: a ready node is not started while the estimated peak
+      memory (see costHistory) of the running nodes plus its own would
+      exceed memoryLimit, unless nothing is running
+    prefetcher
+      - None (default): nodes read the outputs of their dependencies
+      when they need them
+      - compman_prefetch.Prefetcher (thread pool only): active in the
+      pool threads while they run the nodes of the graph (see
+      CompMan.getPrefetcher()). The output files of
+      nodes whose output is complete (fresh with skipFresh) are
+      prefetched when the graph is known, and those of nodes that
+      override getOutput() as soon as they are done, so that their
+      dependents read them from memory (see CompMan.readOutputFile()).
+      Prefetched data is dropped once all dependents are done
+
+    At most numWorkers nodes are handed to the pool at a time, so the
+    start order above is the order in which the nodes run.
+
+    Results are passed to dependents through the result cache (see
+    CompMan.getResultCache()): before a node runs, the outputs of its
+    dependencies are put in the memory tier of its dependencies' result
+    caches (in the worker process, for a process pool). So dependency
+    getOutput() calls inside child classes that implement
+    computeOutput() do not recompute or reload anything. Child classes
+    that override getOutput() instead compute their dependencies the
+    way they always did.
+    '''
+    def __init__(self,numWorkers=None,useProcesses=False,keepResults=True,skipFresh=False,stamp=False,
+                 costHistory=None,memoryLimit=None,prefetcher=None):
+        if prefetcher is not None and useProcesses:
+            raise ValueError('prefetcher needs a thread pool')
+        if numWorkers is None:
+            numWorkers = multiprocessing.cpu_count()
+        self.numWorkers   = numWorkers
+        self.useProcesses = useProcesses
+        self.keepResults  = keepResults
+        self.skipFresh    = skipFresh
+        self.stamp        = stamp
+        self.costHistory  = costHistory
+        self.memoryLimit  = memoryLimit
+        self.prefetcher   = prefetcher
+
+    def run(self,roots,raiseOnFailure=False):
+        '''
+        Runs getOutput() of roots (CompMan instance or list of them) and
+        of all their dependencies.
+        Returns OrderedDict tagPrefix -> NodeResult in topological order.
+        If raiseOnFailure, raises DAGExecutionError if any node failed.
+        '''
+        if isinstance(roots,CompMan):
+            roots = [roots]
+        (nodes,deps) = getDependencyGraph(roots)
+        rootTags   = set(root.getTagPrefix(True) for root in roots)
+        results    = OrderedDict((tagPrefix,NodeResult(tagPrefix,man)) for (tagPrefix,man) in nodes.items())
+        dependents = dict((tagPrefix,[]) for tagPrefix in nodes)
+        for (tagPrefix,depTags) in deps.items():
+            for depTag in depTags:
+                dependents[depTag].append(tagPrefix)
+        numWaiting = dict((tagPrefix,len(depTags)) for (tagPrefix,depTags) in deps.items())
+        numUsers   = dict((tagPrefix,len(dependents[tagPrefix])) for tagPrefix in nodes)
+        ready      = [tagPrefix for tagPrefix in nodes if numWaiting[tagPrefix] == 0]
+        doneQueue  = queue.Queue()
+        running    = {} # tagPrefix -> AsyncResult
+        if self.skipFresh:
+            from compman_stamp import checkFreshness
+            freshness = checkFreshness(roots)
+        ranks    = {}
+        memories = {}
+        if self.costHistory is not None:
+            from compman_cost import getUpwardRanks
+            estimates = self.costHistory.getEstimates(nodes)
+            ranks     = getUpwardRanks(nodes,deps,dict((tagPrefix,estimate[0])
+                                                   for (tagPrefix,estimate) in estimates.items()))
+            memories  = dict((tagPrefix,estimate[1]) for (tagPrefix,estimate) in estimates.items())
+        runningMemory = 0
+        if self.prefetcher is not None:
+            exists = self._getExisting(nodes,freshness if self.skipFresh else None)
+            # outputs read by a dependent to run, or loaded by the node itself (see compman_cache)
+            self.prefetcher.prefetch([man for (tagPrefix,man) in nodes.items() if exists[tagPrefix] and
+                                      (any(not exists[depTag] for depTag in dependents[tagPrefix]) or
+                                       (not self.skipFresh and not man._overrides('getOutput')))])
+        pool = self._makePool()
+        try:
+            while ready or running:
+                while ready and len(running) < self.numWorkers:
+                    index = self._pickReady(ready,ranks,memories,runningMemory,len(running))
+                    if index is None:
+                        break
+                    tagPrefix = ready.pop(index)
+                    if self.skipFresh and freshness[tagPrefix] is None:
+                        results[tagPrefix].status = 'fresh'
+                        self._releaseDependents(tagPrefix,dependents,numWaiting,ready)
+                        continue
+                    depValues = [(results[depTag].man,results[depTag].value) for depTag in deps[tagPrefix]
+                                 if results[depTag].status == 'done']
+                    results[tagPrefix].startTime = time.time()
+                    runningMemory += memories.get(tagPrefix,0)
+                    running[tagPrefix] = pool.apply_async(_runNode,(tagPrefix,nodes[tagPrefix],depValues,
+                                                                    self.skipFresh,self.stamp,self.costHistory,
+                                                                    self.prefetcher),
+                                                          callback=doneQueue.put)
+                if not running:
+                    break
+                (tagPrefix,ok,payload) = _waitForNode(doneQueue,running)
+                del running[tagPrefix]
+                runningMemory -= memories.get(tagPrefix,0)
+                result = results[tagPrefix]
+                result.endTime = time.time()
+                if ok:
+                    result.status = 'done'
+                    result.value  = payload
+                    if self.prefetcher is not None and result.man._overrides('getOutput') and \
+                       any(not exists[depTag] for depTag in dependents[tagPrefix]):
+                        self.prefetcher.prefetch(result.man)
+                    self._releaseDependents(tagPrefix,dependents,numWaiting,ready)
+                else:
+                    result.status = 'failed'
+                    (result.error,result.traceback) = payload
+                    self._skipDependents(tagPrefix,results,dependents)
+                for depTag in deps[tagPrefix]:
+                    numUsers[depTag] -= 1
+                    if numUsers[depTag] == 0:
+                        if not self.keepResults and depTag not in rootTags:
+                            results[depTag].value = None
+                        if self.prefetcher is not None:
+                            self.prefetcher.discard(results[depTag].man)
+        finally:
+            pool.close()
+            pool.join()
+            if self.prefetcher is not None:
+                self.prefetcher.discard(list(nodes.values()))
+        if raiseOnFailure:
+            failed = getFailedResults(results)
+            if failed:
+                raise DAGExecutionError(failed)
+        return results
+
+    def _makePool(self):
+        if self.useProcesses:
+            return multiprocessing.Pool(self.numWorkers)
+        return ThreadPool(self.numWorkers)
+
+    def _pickReady(self,ready,ranks,memories,runningMemory,numRunning):
+        '''
+        Returns the index in ready of the next node to start: the one
+        with the highest rank that fits in self.memoryLimit (any if
+        nothing is running), or None if none fits.
+        '''
+        best = None
+        for (index,tagPrefix) in enumerate(ready):
+            if self.memoryLimit is not None and numRunning > 0 \
+               and runningMemory + memories.get(tagPrefix,0) > self.memoryLimit:
+                continue
+            if best is None or ranks.get(tagPrefix,0.0) > ranks.get(ready[best],0.0):
+                best = index
+        return best
+
+    def _getExisting(self,nodes,freshness):
+        '''
+        Returns dict tagPrefix -> True if the output of the node exists
+        before the run: complete, or fresh if freshness is given.
+        '''
+        return dict((tagPrefix,man.getBasePath() is not None and (freshness[tagPrefix] is None if freshness is not None
+                                                                   else man.outputExists('complete')))
+                    for (tagPrefix,man) in nodes.items())
+
+    def _releaseDependents(self,tagPrefix,dependents,numWaiting,ready):
+        for depTag in dependents[tagPrefix]:
+            numWaiting[depTag] -= 1
+            if numWaiting[depTag] == 0:
+                ready.append(depTag)
+
+    def _skipDependents(self,tagPrefix,results,dependents):
+        stack = list(dependents[tagPrefix])
+        while stack:
+            depTag = stack.pop()
+            if results[depTag].status is None:
+                results[depTag].status = 'skipped'
+                results[depTag].error  = 'dependency failed: {}'.format(tagPrefix)
+                stack.extend(dependents[depTag])
+
+# --------------------
+def _runNode(tagPrefix,man,depValues,rebuild=False,stamp=False,costHistory=None,prefetcher=None):
+    '''
+    Internal function
+    Runs in the pool. Never raises, returns (tagPrefix,ok,payload) with
+    payload the output if ok, else (error string, traceback string).
+    If rebuild, the cached result of man is discarded first. If stamp,
+    a build stamp is written if there is none after getOutput(), or if
+    rebuilding did not write a new one. If costHistory, the costs are
+    recorded in it, unless the output was already complete (and not
+    rebuilt). If prefetcher, it is active in the calling thread while
+    man runs.
+    '''
+    if prefetcher is not None:
+        prefetcher.activate()
+    try:
+        for (depMan,value) in depValues:
+            depMan.getResultCache().put(depMan,value)
+        stamp = stamp and man.getBasePath() is not None
+        if rebuild and not man._overrides('getOutput'):
+            man.getResultCache().discard(man,deleteFile=True)
+        if stamp:
+            from compman_stamp import readStamp
+            oldStamp = readStamp(man)
+        if costHistory is not None:
+            from compman_cost import measureCall,getOutputSize
+            computed = rebuild or man.getBasePath() is None or not man.outputExists('complete')
+            (value,wallTime,peakMemory) = measureCall(man.getOutput)
+            if computed:
+                costHistory.record(man,wallTime,peakMemory,getOutputSize(man))
+        else:
+            value = man.getOutput()
+        if stamp:
+            newStamp = readStamp(man)
+            if newStamp is None or (rebuild and oldStamp is not None and newStamp['buildId'] == oldStamp['buildId']):
+                man.writeBuildStamp()
+        return (tagPrefix,True,value)
+    except Exception:
+        (excType,excValue,excTraceback) = sys.exc_info()
+        return (tagPrefix,False,('{0}: {1}'.format(excType.__name__,excValue),
+                                 ''.join(traceback.format_exception(excType,excValue,excTraceback))))
+    finally:
+        if prefetcher is not None:
+            prefetcher.deactivate()
+
+def _waitForNode(doneQueue,running):
+    '''
+    Internal function
+    Returns (tagPrefix,ok,payload) of the next node to finish. Waits
+    with a timeout, so KeyboardInterrupt is not blocked, and checks for
+    tasks that failed without reaching _runNode() (eg: unpicklable
+    CompMan instance with a process pool), for which the pool does not
+    call the callback.
+    '''
+    while True:
+        try:
+            return doneQueue.get(True,0.5)
+        except queue.Empty:
+            pass
+        for (tagPrefix,asyncResult) in running.items():
+            if asyncResult.ready() and not asyncResult.successful():
+                try:
+                    asyncResult.get()
+                except Exception:
+                    (excType,excValue,excTraceback) = sys.exc_info()
+                    return (tagPrefix,False,('{0}: {1}'.format(excType.__name__,excValue),
+                                             ''.join(traceback.format_exception(excType,excValue,excTraceback))))
+
+def getFailedResults(results):
+    '''
+    Returns list of the NodeResults in results (from DAGExecutor.run())
+    with status 'failed'.
+    '''
+    return [result for result in results.values() if result.status == 'failed']
+
+def runGraph(roots,numWorkers=None,useProcesses=False,raiseOnFailure=True,skipFresh=False):
+    '''
+    Runs getOutput() of roots and all their dependencies in parallel,
+    see DAGExecutor. Returns list of the outputs of roots (None for
+    roots skipped as fresh with skipFresh).
+    '''
+    if isinstance(roots,CompMan):
+        roots = [roots]
+    results = DAGExecutor(numWorkers,useProcesses,skipFresh=skipFresh).run(roots,raiseOnFailure)
+    return [results[root.getTagPrefix(True)].value for root in roots]
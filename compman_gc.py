@@ -0,0 +1,274 @@
+'''
+CompMan output store garbage collection.
+
+Output directories (cmBasePath/cmDesc/<tag prefix>, see
+CompMan.getOutputPath()) are never deleted by CompMan, so they pile up
+as configurations change. OutputCollector marks the output directories
+reachable from a set of root CompMan instances (the current pipelines)
+and evicts unreachable ones, oldest or least recently used first, until
+the store fits a disk budget:
+    collector = OutputCollector(basePath,roots)
+    print(collector.formatReport(collector.collect(budget=100 * 2**30,dryRun=True)))
+'''
+
+import os
+import time
+import errno
+import shutil
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+
+from compman import *
+from compman_catalog import listOutputDirs,configFileRegex,statusFileRegex
+from compman_lock import ComputeLock,lockFileRegex
+
+gcPolicies = ('oldest','lru')
+
+# --------------------
+class OutputDirUsage(object):
+    '''
+    Disk usage of one output directory, see OutputCollector.scan().
+
+    size      - total size in bytes of the files in it
+    mtime     - latest modification time of the directory or its files
+    atime     - latest access time of its files (only as good as the
+    file system keeps it, eg: not updated with noatime)
+    isOutput  - True if it holds a compman_config.* or compman_complete.*
+    file, ie: it was written by CompMan
+    locked    - True if it holds a compute lock that is not stale (see
+    compman_lock.ComputeLock)
+    reachable - True if an output of a root or one of its dependencies
+    '''
+    def __init__(self,path,relPath,size,mtime,atime,configFiles,isOutput=True,locked=False):
+        self.path        = path
+        self.relPath     = relPath
+        self.size        = size
+        self.mtime       = mtime
+        self.atime       = atime
+        self.configFiles = configFiles
+        self.isOutput    = isOutput
+        self.locked      = locked
+        self.reachable   = False
+
+    def __repr__(self):
+        return '<OutputDirUsage {0} {1} bytes{2}>'.format(self.relPath,self.size,
+                                                          '' if self.reachable else ' unreachable')
+
+class OutputCollector(object):
+    '''
+    Garbage collector of the output directories under basePath.
+
+    roots
+      - CompMan instance or list of them: the output directories of
+      them and of all of their dependencies (see getDependencyGraph())
+      with the same cmBasePath are reachable and never evicted
+    policy
+      - 'oldest' (default): unreachable directories with the oldest
+      modification time are evicted first
+      - 'lru': least recently accessed first (see OutputDirUsage.atime)
+    minAge
+      - directories modified less than minAge seconds ago (default one
+      hour) are not evicted, so outputs being written by pipelines not
+      in roots are left alone
+    numThreads
+      - number of threads scanning sizes and deleting directories
+
+    Directories without a compman_config.* or compman_complete.* file
+    (not written by CompMan) and directories holding a compute lock that
+    is not stale are never evicted either.
+
+    Eviction removes evicted directories from the output catalog
+    attached for basePath, if any (see compman_catalog.OutputCatalog),
+    and from configCatalog (compman_catalog.ConfigCatalog) if given.
+    '''
+    def __init__(self,basePath,roots=(),policy='oldest',minAge=3600,numThreads=8,configCatalog=None):
+        if policy not in gcPolicies:
+            raise ValueError('Unknown policy {0!r}, use one of {1}'.format(policy,gcPolicies))
+        self.basePath      = basePath
+        self.policy        = policy
+        self.minAge        = minAge
+        self.numThreads    = numThreads
+        self.configCatalog = configCatalog
+        self.reachable     = set() # relPaths of reachable output directories
+        self.markReachable(roots)
+
+    def markReachable(self,roots):
+        '''
+        Marks the output directories of roots (CompMan instance or list
+        of them) and of all of their dependencies as reachable.
+        '''
+        (nodes,deps) = getDependencyGraph(roots)
+        basePath = os.path.normpath(self.basePath)
+        for man in nodes.values():
+            if man.getBasePath() is not None and os.path.normpath(man.getBasePath()) == basePath:
+                self.reachable.add(os.path.join(man.getDesc(),man.getTagPrefix(False)))
+
+    # --------------------
+    def scan(self):
+        '''
+        Returns list of OutputDirUsage of every output directory under
+        self.basePath. Directories are listed and their sizes summed by
+        self.numThreads threads in parallel.
+        '''
+        pool = ThreadPool(self.numThreads)
+        try:
+            relPaths = listOutputDirs(self.basePath,pool)
+            usages   = pool.map(self._getUsage,relPaths)
+        finally:
+            pool.close()
+        for usage in usages:
+            usage.reachable = usage.relPath in self.reachable
+        return usages
+
+    def collect(self,budget=None,dryRun=False):
+        '''
+        Evicts unreachable output directories until the total size of
+        the output store is at most budget bytes (all unreachable ones
+        if budget is None), in the order of self.policy. Reachable,
+        recent, locked and non-CompMan directories are never evicted, so
+        the budget may not be met. If dryRun, nothing is deleted, the
+        report says what would be. Directories that cannot be deleted
+        entirely are listed in the report's 'errors', and only the bytes
+        actually deleted count as freed.
+        Returns report OrderedDict, see formatReport().
+        '''
+        usages = self.scan()
+        total  = sum(usage.size for usage in usages)
+        sortKey = (lambda usage: usage.mtime) if self.policy == 'oldest' else (lambda usage: usage.atime)
+        minTime = time.time() - self.minAge
+        candidates = sorted((usage for usage in usages if not usage.reachable and usage.isOutput and
+                             not usage.locked and usage.mtime <= minTime),key=sortKey)
+        evicted   = []
+        remaining = total
+        for usage in candidates:
+            if budget is not None and remaining <= budget:
+                break
+            evicted.append(usage)
+            remaining -= usage.size
+        errors = []
+        if not dryRun and evicted:
+            (evicted,errors,freed) = self._evict(evicted)
+            remaining = total - freed
+        report = OrderedDict()
+        report['dryRun']           = dryRun
+        report['policy']           = self.policy
+        report['budget']           = budget
+        report['totalBytes']       = total
+        report['reachableBytes']   = sum(usage.size for usage in usages if usage.reachable)
+        report['unreachableBytes'] = total - report['reachableBytes']
+        report['numDirs']          = len(usages)
+        report['numUnreachable']   = sum(1 for usage in usages if not usage.reachable)
+        report['numLocked']        = sum(1 for usage in usages if usage.locked)
+        report['numNotOutput']     = sum(1 for usage in usages if not usage.isOutput)
+        report['evicted']          = evicted
+        report['errors']           = errors
+        report['freedBytes']       = total - remaining
+        report['remainingBytes']   = remaining
+        report['budgetMet']        = budget is None or remaining <= budget
+        return report
+
+    def formatReport(self,report,n=20):
+        '''
+        Returns collect() report as a printable string, listing the n
+        largest evicted directories.
+        '''
+        lines = ['{0:<18} {1}'.format(name,value) for (name,value) in report.items()
+                 if name not in ('evicted','errors')]
+        evicted = sorted(report['evicted'],key=lambda usage: -usage.size)
+        lines.append('{0} {1} directories:'.format('would evict' if report['dryRun'] else 'evicted',len(evicted)))
+        lines.extend('  {0:>14} {1}'.format(usage.size,usage.relPath) for usage in evicted[:n])
+        if len(evicted) > n:
+            lines.append('  ...')
+        if report['errors']:
+            lines.append('{0} errors:'.format(len(report['errors'])))
+            lines.extend('  {0}: {1}'.format(relPath,error) for (relPath,error) in report['errors'][:n])
+            if len(report['errors']) > n:
+                lines.append('  ...')
+        return '\n'.join(lines)
+
+    # --------------------
+    def _getUsage(self,relPath):
+        path  = os.path.join(self.basePath,relPath)
+        size  = 0
+        mtime = _getStat(path,'st_mtime')
+        atime = 0.0
+        configFiles = []
+        isOutput    = False
+        locked      = False
+        for (dirPath,dirNames,fileNames) in os.walk(path):
+            for fileName in fileNames:
+                filePath = os.path.join(dirPath,fileName)
+                try:
+                    stat = os.lstat(filePath)
+                except OSError:
+                    continue # deleted meanwhile
+                size += stat.st_size
+                mtime = max(mtime,stat.st_mtime)
+                atime = max(atime,stat.st_atime)
+                if configFileRegex.match(fileName):
+                    configFiles.append(filePath)
+                if dirPath == path and statusFileRegex.match(fileName):
+                    isOutput = True
+                if dirPath == path and lockFileRegex.match(fileName) and not ComputeLock(filePath).isStale():
+                    locked = True # also if deleted meanwhile: released just now
+        return OutputDirUsage(path,relPath,size,mtime,max(atime,mtime),configFiles,isOutput,locked)
+
+    def _evict(self,usages):
+        '''
+        Deletes the directories of usages. Returns (evicted,errors,freed):
+        the usages deleted entirely, list of (relPath,error message) and
+        the number of bytes actually deleted.
+        '''
+        pool = ThreadPool(self.numThreads)
+        try:
+            results = pool.map(self._removeDir,usages)
+        finally:
+            pool.close()
+        evicted = []
+        errors  = []
+        freed   = 0
+        for (usage,(sizeLeft,dirErrors)) in zip(usages,results):
+            freed += max(usage.size - sizeLeft,0)
+            if dirErrors:
+                errors.extend((usage.relPath,error) for error in dirErrors)
+            else:
+                evicted.append(usage)
+        catalog = outputCatalogs.get(os.path.normpath(self.basePath))
+        if catalog is not None:
+            for usage in usages: # partly deleted outputs are not valid any more either
+                catalog.removeOutputDir(usage.path)
+        if self.configCatalog is not None:
+            self.configCatalog.ingest([filePath for usage in usages for filePath in usage.configFiles])
+        return (evicted,errors,freed)
+
+    def _removeDir(self,usage):
+        '''
+        Deletes directory usage.path. Returns (sizeLeft,errors): total
+        size of the files that could not be deleted and list of error
+        messages.
+        '''
+        errors = []
+        def onError(function,path,excInfo):
+            if getattr(excInfo[1],'errno',None) != errno.ENOENT: # deleted meanwhile
+                errors.append('{0}: {1}'.format(path,excInfo[1]))
+        shutil.rmtree(usage.path,onerror=onError)
+        if not errors:
+            return (0,errors)
+        return (self._getUsage(usage.relPath).size,errors)
+
+# --------------------
+def _getStat(path,name):
+    '''
+    Internal function
+    '''
+    try:
+        return getattr(os.stat(path),name)
+    except OSError:
+        return 0.0
+
+def collectOutputs(basePath,roots,budget=None,policy='oldest',dryRun=False,**kwargs):
+    '''
+    Runs OutputCollector(basePath,roots,policy,...).collect(budget,dryRun)
+    and returns its report.
+    '''
+    return OutputCollector(basePath,roots,policy,**kwargs).collect(budget,dryRun)
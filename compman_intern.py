@@ -0,0 +1,161 @@
+'''
+CompMan instance interning.
+
+Registry of canonical CompMan instances, used on construction by
+classes with cmIntern set (see CompMan), so that identical managers are
+held in memory once (flyweight pattern).
+'''
+
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+from compman import *
+
+# --------------------
+class InternRegistry(object):
+    '''
+    Weak registry of canonical CompMan instances keyed by their
+    identity (see getInternKey()). Instances are only held weakly, so
+    they are dropped from the registry once nothing else refers to them.
+
+    stats
+      - 'interned'   - instances registered as canonical
+      - 'duplicates' - constructions that returned a canonical instance
+      - 'unhashable' - instances not interned because a config value is
+      unhashable (eg: NumPy array)
+      - 'bytesSaved' - estimated size of the duplicates that were
+      dropped, see getMemoryReport()
+    '''
+    def __init__(self):
+        self.instances = weakref.WeakValueDictionary() # intern key -> canonical instance
+        self.lock      = threading.RLock()
+        self.stats     = OrderedDict((('interned',0),('duplicates',0),('unhashable',0),('bytesSaved',0)))
+
+    def intern(self,man):
+        '''
+        Returns the canonical instance identical to CompMan instance
+        man, registering man as canonical if there is none.
+        '''
+        if 'cmInternKey' in man.__dict__ or not man.isConfigured():
+            return man
+        try:
+            key = getInternKey(man)
+            hash(key)
+        except TypeError:
+            with self.lock:
+                self.stats['unhashable'] += 1
+            return man
+        with self.lock:
+            canonical = self.instances.get(key)
+            if canonical is not None:
+                self.stats['duplicates'] += 1
+                self.stats['bytesSaved'] += _getInstanceSize(man)
+                return canonical
+            self.instances[key] = man
+            object.__setattr__(man,'cmInternKey',key)
+            self.stats['interned'] += 1
+        return man
+
+    def discard(self,man):
+        '''
+        Removes CompMan instance man from the registry, eg: because it
+        was changed. Called automatically by CompMan.
+        '''
+        key = man.__dict__.pop('cmInternKey',None)
+        if key is None:
+            return
+        with self.lock:
+            if self.instances.get(key) is man:
+                del self.instances[key]
+
+    def clear(self):
+        with self.lock:
+            for man in list(self.instances.values()):
+                man.__dict__.pop('cmInternKey',None)
+            self.instances.clear()
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __contains__(self,man):
+        key = man.__dict__.get('cmInternKey')
+        return key is not None and self.instances.get(key) is man
+
+    # --------------------
+    def getMemoryReport(self):
+        '''
+        Returns OrderedDict with the number of live canonical instances
+        (total and per class), the number of duplicate constructions
+        avoided and the estimated bytes saved by dropping them. Sizes
+        are shallow estimates from sys.getsizeof() of each instance, its
+        __dict__, its config dicts and their non-CompMan values.
+        '''
+        with self.lock:
+            instances = list(self.instances.values())
+            report = OrderedDict()
+            report['canonicalInstances'] = len(instances)
+            report['canonicalBytes']     = sum(_getInstanceSize(man) for man in instances)
+            report['duplicatesAvoided']  = self.stats['duplicates']
+            report['bytesSaved']         = self.stats['bytesSaved']
+            report['unhashable']         = self.stats['unhashable']
+        byClass = OrderedDict()
+        for man in instances:
+            className = type(man).__name__
+            byClass[className] = byClass.get(className,0) + 1
+        report['byClass'] = byClass
+        return report
+
+    def formatMemoryReport(self):
+        '''
+        Returns getMemoryReport() as a printable string.
+        '''
+        report = self.getMemoryReport()
+        lines = ['{0:<20} {1}'.format(name,value) for (name,value) in report.items() if name != 'byClass']
+        lines.extend('  {0:<18} {1}'.format(className,count) for (className,count) in report['byClass'].items())
+        return '\n'.join(lines)
+
+# --------------------
+def getInternKey(man):
+    '''
+    Returns the key identifying CompMan instance man for interning.
+    Raises TypeError if a config value is unhashable.
+    '''
+    return (type(man),man.cmDesc,man.cmCodeTag,man.cmMetaParam,man.cmSep,man.cmBasePath,
+            man.cmHashMode,man.cmHashAlg,man.cmDigestValues,
+            _getValueKey(list(man.cmConfigDict.items())),
+            _getValueKey(list(man.cmExConfigDict.items())))
+
+def _getValueKey(val):
+    '''
+    Internal function
+    Hashable key of config value val: CompMan instances by identity,
+    containers by content, other values by type and value.
+    '''
+    if isinstance(val,CompMan):
+        return ('CompMan',id(val))
+    if isinstance(val,(list,tuple)):
+        return (type(val),tuple(_getValueKey(item) for item in val))
+    if isinstance(val,OrderedDict):
+        return (type(val),tuple((key,_getValueKey(item)) for (key,item) in val.items()))
+    if isinstance(val,dict):
+        return (type(val),tuple(sorted((key,_getValueKey(item)) for (key,item) in val.items())))
+    if isinstance(val,(set,frozenset)):
+        return (type(val),frozenset(_getValueKey(item) for item in val))
+    hash(val) # raises TypeError if unhashable
+    return (type(val),val)
+
+def _getInstanceSize(man):
+    '''
+    Internal function
+    '''
+    size = sys.getsizeof(man) + sys.getsizeof(man.__dict__)
+    for configDict in (man.cmConfigDict,man.cmExConfigDict):
+        size += sys.getsizeof(configDict)
+        for val in configDict.values():
+            if not isinstance(val,CompMan):
+                size += sys.getsizeof(val)
+    return size
+
+defaultInternRegistry = InternRegistry()
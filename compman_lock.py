@@ -0,0 +1,254 @@
+'''
+CompMan single-flight computation locks.
+
+File locks in CompMan output directories, so that when several
+processes (possibly on different hosts sharing cmBasePath) need the
+same output, only one computes it while the others wait and then reuse
+the result.
+'''
+
+import os
+import re
+import time
+import errno
+import socket
+import threading
+import warnings
+import json
+
+from compman import *
+
+# names of the lock files of CompMan.getComputeLockPath()
+lockFileRegex = re.compile(r'^compman_lock\..+\.lock$')
+
+# --------------------
+class LockTimeoutError(Exception):
+    def __init__(self,lockPath,timeout):
+        msg = 'Could not acquire lock {0} within {1} seconds'.format(lockPath,timeout)
+        Exception.__init__(self,msg)
+
+class LockLostWarning(UserWarning):
+    pass
+
+# --------------------
+class ComputeLock(object):
+    '''
+    Exclusive lock implemented as a lock file created with O_EXCL,
+    which works across processes and hosts (including NFS v3+).
+
+    While held, a background thread refreshes the modification time of
+    the lock file every heartbeatInterval seconds (default
+    staleTimeout/4). A lock is stale, and is broken by the next process
+    waiting for it, when its holder is a dead process on the same host
+    or when its lock file has not been refreshed for staleTimeout
+    seconds (eg: holder crashed on another host).
+
+    The heartbeat checks that the lock file still holds this lock's
+    token. If it was broken or replaced by another process (eg: the
+    holder was suspended for more than staleTimeout seconds), the lock
+    is lost: the heartbeat stops refreshing it, isLost() returns True
+    and release() leaves the lock file alone and issues a
+    LockLostWarning.
+
+    Use as a context manager:
+        with ComputeLock(lockPath):
+            ...
+    '''
+    def __init__(self,lockPath,staleTimeout=300.0,heartbeatInterval=None,pollInterval=0.5,timeout=None):
+        if heartbeatInterval is None:
+            heartbeatInterval = staleTimeout / 4.0
+        self.lockPath          = lockPath
+        self.staleTimeout      = staleTimeout
+        self.heartbeatInterval = heartbeatInterval
+        self.pollInterval      = pollInterval
+        self.timeout           = timeout
+        self.token             = None
+        self.heartbeatStop     = None
+        self.heartbeatThread   = None
+        self.lostEvent         = None
+        self.lost              = False # True if release() found the lock broken by another process
+        self.waited            = False # True if acquire() had to wait for another holder
+
+    def acquire(self):
+        '''
+        Blocks until the lock is acquired. Raises LockTimeoutError if
+        self.timeout (seconds) is not None and has passed.
+        '''
+        startTime = time.time()
+        while not self.tryAcquire():
+            self.waited = True
+            if self.timeout is not None and time.time() - startTime > self.timeout:
+                raise LockTimeoutError(self.lockPath,self.timeout)
+            self.breakIfStale()
+            time.sleep(self.pollInterval)
+        return True
+
+    def tryAcquire(self):
+        '''
+        Acquires the lock if it is free, without waiting.
+        Returns True if the lock was acquired.
+        '''
+        token = json.dumps({'host':socket.gethostname(),'pid':os.getpid(),
+                            'thread':threading.current_thread().ident,'time':time.time()})
+        try:
+            fd = os.open(self.lockPath,os.O_CREAT | os.O_EXCL | os.O_WRONLY,0o644)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        try:
+            os.write(fd,token.encode('utf-8'))
+        finally:
+            os.close(fd)
+        self.token = token
+        self.lost  = False
+        self._startHeartbeat()
+        return True
+
+    def release(self):
+        if self.token is None:
+            return
+        self.heartbeatStop.set()
+        self.heartbeatThread.join() # so it never touches a lock file recreated by another holder
+        self.heartbeatThread = None
+        self.heartbeatStop   = None
+        self.lostEvent       = None
+        if _readFile(self.lockPath) == self.token:
+            _removeFile(self.lockPath)
+        else:
+            self.lost = True
+            warnings.warn('Lock {0} was broken by another process while held'.format(self.lockPath),
+                          LockLostWarning)
+        self.token = None
+
+    def isLost(self):
+        '''
+        True if the lock is held by self.acquire() but its lock file no
+        longer holds its token, ie: another process broke or replaced it.
+        '''
+        if self.token is None:
+            return False
+        return self.lostEvent.is_set() or _readFile(self.lockPath) != self.token
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self,excType,excValue,excTraceback):
+        self.release()
+
+    # --------------------
+    def isStale(self,token=None,mtime=None):
+        '''
+        True if the lock file exists and is stale (see class doc).
+        '''
+        if token is None:
+            token = _readFile(self.lockPath)
+            mtime = _getMTime(self.lockPath)
+        if token is None or mtime is None:
+            return False
+        if time.time() - mtime > self.staleTimeout:
+            return True
+        try:
+            holder = json.loads(token)
+        except ValueError:
+            return False # partially written, let it age
+        return holder.get('host') == socket.gethostname() and not _isProcessAlive(holder.get('pid'))
+
+    def breakIfStale(self):
+        '''
+        Removes the lock file if it is stale. The lock file is first
+        renamed to a unique name, and only deleted if it still has the
+        token and modification time found stale. Otherwise it is a
+        fresh lock taken by another process in the meantime, which is
+        put back; if a third process created the lock file meanwhile,
+        it is left under the unique name (never deleted), and its holder
+        finds it lost (see isLost()).
+        Returns True if a stale lock was removed.
+        '''
+        token = _readFile(self.lockPath)
+        mtime = _getMTime(self.lockPath)
+        if not self.isStale(token,mtime):
+            return False
+        stalePath = '{0}.stale.{1}.{2}'.format(self.lockPath,socket.gethostname(),os.getpid())
+        try:
+            os.rename(self.lockPath,stalePath)
+        except OSError:
+            return False # already broken by another waiter
+        if _readFile(stalePath) != token or _getMTime(stalePath) != mtime:
+            # took a fresh lock of another process, put it back unless replaced already
+            try:
+                os.link(stalePath,self.lockPath)
+            except OSError:
+                return False
+            _removeFile(stalePath)
+            return False
+        _removeFile(stalePath)
+        return True
+
+    def _startHeartbeat(self):
+        self.heartbeatStop = threading.Event()
+        self.lostEvent     = threading.Event()
+        self.heartbeatThread = threading.Thread(target=_heartbeat,
+                                                args=(self.lockPath,self.token,self.heartbeatInterval,
+                                                      self.heartbeatStop,self.lostEvent))
+        self.heartbeatThread.daemon = True
+        self.heartbeatThread.start()
+
+# --------------------
+def _heartbeat(lockPath,token,interval,stopEvent,lostEvent):
+    '''
+    Internal function
+    Refreshes lock file lockPath while it holds token, sets lostEvent
+    and stops once it does not.
+    '''
+    while not stopEvent.wait(interval):
+        if _readFile(lockPath) != token:
+            lostEvent.set()
+            return
+        try:
+            os.utime(lockPath,None)
+        except OSError:
+            lostEvent.set()
+            return
+
+def _readFile(filePath):
+    '''
+    Internal function
+    Returns contents of text file filePath, or None if missing.
+    '''
+    try:
+        with open(filePath,'rb') as f:
+            return f.read().decode('utf-8')
+    except (IOError,OSError):
+        return None
+
+def _getMTime(filePath):
+    '''
+    Internal function
+    '''
+    try:
+        return os.path.getmtime(filePath)
+    except OSError:
+        return None
+
+def _removeFile(filePath):
+    '''
+    Internal function
+    '''
+    try:
+        os.remove(filePath)
+    except OSError:
+        pass
+
+def _isProcessAlive(pid):
+    '''
+    Internal function
+    '''
+    if not pid:
+        return False
+    try:
+        os.kill(pid,0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
@@ -0,0 +1,293 @@
+'''
+CompMan output prefetching.
+
+Reads the output files of CompMan instances in background threads, so
+that a getOutput() reading the files of its dependencies does not wait
+on slow (eg: network) storage for each one in turn:
+    with Prefetcher(numThreads=4,memoryLimit=2**30) as prefetcher:
+        prefetcher.prefetchDependencies(man)
+        man.getOutput() # reads with self.readOutputFile(filePath)
+
+Files are read in the order they are prefetched, by at most numThreads
+threads, holding at most memoryLimit bytes of data that has not been
+consumed yet. CompMan.readOutputFile() hands over prefetched data (or
+waits for a file being read, or reads it itself if not started yet),
+and the result cache reads result files the same way. DAGExecutor
+(prefetcher=...) prefetches the outputs of the nodes of a graph as
+soon as they exist, for their dependents.
+
+Files are read by threads rather than asyncio, which Python 2 lacks;
+reading files releases the GIL, so threads overlap I/O with compute
+just as well.
+'''
+
+import os
+import threading
+from collections import OrderedDict,deque
+
+from compman import *
+
+# --------------------
+class Prefetcher(object):
+    '''
+    Background reader of files, see module doc.
+
+    numThreads
+      - number of files read at the same time
+    memoryLimit
+      - maximum bytes of prefetched data held (read or being read, not
+      consumed yet). Files larger than that are not prefetched
+    blockSize
+      - read size in bytes
+
+    stats
+      - 'prefetched' - files read in the background
+      - 'hits'       - reads served from prefetched data
+      - 'waits'      - reads that waited for a file being read
+      - 'misses'     - reads done directly (not prefetched, not started
+      yet, too large or failed)
+      - 'bytesRead'  - bytes read in the background
+    '''
+    def __init__(self,numThreads=4,memoryLimit=2**30,blockSize=2**22):
+        self.numThreads  = numThreads
+        self.memoryLimit = memoryLimit
+        self.blockSize   = blockSize
+        self.condition   = threading.Condition()
+        self.entries     = OrderedDict() # filePath -> _PrefetchEntry
+        self.queued      = deque()       # filePaths not started yet
+        self.memoryUsed  = 0
+        self.threads     = []
+        self.closed      = False
+        self.stats       = OrderedDict((('prefetched',0),('hits',0),('waits',0),('misses',0),('bytesRead',0)))
+
+    # --------------------
+    def prefetchFiles(self,filePaths):
+        '''
+        Queues files filePaths for reading. Files already queued, being
+        read or read are not queued again.
+        '''
+        with self.condition:
+            if self.closed:
+                raise ValueError('Prefetcher is closed')
+            for filePath in filePaths:
+                filePath = os.path.abspath(filePath)
+                if filePath not in self.entries:
+                    self.entries[filePath] = _PrefetchEntry()
+                    self.queued.append(filePath)
+            self.condition.notify_all()
+            while len(self.threads) < min(self.numThreads,len(self.queued)):
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def prefetch(self,managers):
+        '''
+        Queues the output files of CompMan instances managers (see
+        getOutputFilePaths()).
+        '''
+        if isinstance(managers,CompMan):
+            managers = [managers]
+        self.prefetchFiles([filePath for man in managers for filePath in getOutputFilePaths(man)])
+
+    def prefetchDependencies(self,man,recursive=False):
+        '''
+        Queues the output files of the dependencies of CompMan instance
+        man (of its whole dependency graph if recursive, dependencies
+        first).
+        '''
+        if recursive:
+            (nodes,deps) = getDependencyGraph(man)
+            managers = list(nodes.values())[:-1] # topological order, man last
+        else:
+            managers = man.getDependencies()
+        self.prefetch(managers)
+
+    def read(self,filePath):
+        '''
+        Returns the content (bytes) of file filePath: prefetched data,
+        released from the prefetcher, or read directly if it was not
+        prefetched.
+        '''
+        filePath = os.path.abspath(filePath)
+        with self.condition:
+            entry = self.entries.get(filePath)
+            if entry is not None and entry.state in ('queued','waiting'):
+                # not started yet: read it here rather than wait
+                entry.state = 'taken'
+                del self.entries[filePath]
+                self.condition.notify_all()
+                entry = None
+            if entry is not None and entry.state == 'reading':
+                self.stats['waits'] += 1
+                while entry.state == 'reading':
+                    self.condition.wait()
+            if entry is not None and entry.state == 'ready':
+                del self.entries[filePath]
+                self.memoryUsed -= entry.size
+                self.stats['hits'] += 1
+                self.condition.notify_all()
+                return entry.data
+            self.entries.pop(filePath,None)
+            self.stats['misses'] += 1
+        with open(filePath,'rb') as f:
+            return f.read()
+
+    def discard(self,managers):
+        '''
+        Drops the prefetched data of the output files of CompMan
+        instances managers, eg: once their dependents are done.
+        '''
+        if isinstance(managers,CompMan):
+            managers = [managers]
+        self.discardFiles([filePath for man in managers for filePath in getOutputFilePaths(man)])
+
+    def discardFiles(self,filePaths):
+        with self.condition:
+            for filePath in filePaths:
+                entry = self.entries.get(os.path.abspath(filePath))
+                if entry is None or entry.state == 'reading':
+                    continue
+                del self.entries[os.path.abspath(filePath)]
+                if entry.state == 'ready':
+                    self.memoryUsed -= entry.size
+                entry.state = 'taken'
+            self.condition.notify_all()
+
+    def close(self):
+        '''
+        Stops the threads and drops all prefetched data.
+        '''
+        with self.condition:
+            self.closed = True
+            self.queued.clear()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        with self.condition:
+            self.entries.clear()
+            self.memoryUsed = 0
+            self.threads    = []
+
+    def activate(self):
+        '''
+        Makes self the active prefetcher of the calling thread (see
+        getActivePrefetcher()) until deactivate() in that thread.
+        '''
+        _getActiveStack().append(self)
+
+    def deactivate(self):
+        stack = _getActiveStack()
+        for i in reversed(range(len(stack))):
+            if stack[i] is self:
+                del stack[i]
+                break
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self,excType,excValue,excTraceback):
+        self.deactivate()
+        self.close()
+
+    # --------------------
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queued and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                filePath = self.queued.popleft()
+                entry    = self.entries.get(filePath)
+                if entry is None or entry.state != 'queued':
+                    continue
+                entry.state = 'waiting'
+            try:
+                size = os.path.getsize(filePath)
+            except OSError:
+                size = None
+            with self.condition:
+                if entry.state != 'waiting':
+                    continue # taken by read() or discarded
+                if size is None or size > self.memoryLimit:
+                    del self.entries[filePath] # read() reads it directly
+                    continue
+                while entry.state == 'waiting' and not self.closed and self.memoryUsed + size > self.memoryLimit:
+                    self.condition.wait()
+                if entry.state != 'waiting' or self.closed:
+                    continue
+                entry.state = 'reading'
+                entry.size  = size
+                self.memoryUsed += size
+            blocks = []
+            try:
+                with open(filePath,'rb') as f:
+                    for block in iter(lambda: f.read(self.blockSize),b''):
+                        blocks.append(block)
+                data = b''.join(blocks)
+            except (IOError,OSError):
+                data = None
+            with self.condition:
+                self.memoryUsed -= size
+                if data is None:
+                    entry.state = 'failed' # read() reads it directly and gets the error
+                    self.entries.pop(filePath,None)
+                else:
+                    entry.state = 'ready'
+                    entry.data  = data
+                    entry.size  = len(data)
+                    self.memoryUsed += entry.size
+                    self.stats['prefetched'] += 1
+                    self.stats['bytesRead']  += entry.size
+                self.condition.notify_all()
+
+class _PrefetchEntry(object):
+    '''
+    Internal class
+    state: 'queued', 'waiting' (for memory), 'reading', 'ready',
+    'failed' or 'taken' (by read() or discarded)
+    '''
+    def __init__(self):
+        self.state = 'queued'
+        self.size  = 0
+        self.data  = None
+
+# --------------------
+_activeState = threading.local() # stack: prefetchers activated in the thread, last is active
+
+def getActivePrefetcher():
+    '''
+    Returns the Prefetcher entered with a with statement (or activated)
+    in the calling thread, or None.
+    '''
+    stack = getattr(_activeState,'stack',None)
+    return stack[-1] if stack else None
+
+def _getActiveStack():
+    '''
+    Internal function
+    '''
+    stack = getattr(_activeState,'stack',None)
+    if stack is None:
+        stack = _activeState.stack = []
+    return stack
+
+def getOutputFilePaths(man):
+    '''
+    Returns list of the absolute paths of the output files of CompMan
+    instance man read by its dependents: its getOutputFilesList()
+    (relative names are in getOutputPath()) or, if not implemented, its
+    result file (see compman_cache). Empty if it has no base path.
+    '''
+    if man.getBasePath() is None:
+        return []
+    try:
+        fileNames = man.getOutputFilesList()
+    except NotImplementedError:
+        if not man._overrides('computeOutput'):
+            return []
+        fileNames = [man.getResultCache().getResultFilePath(man)]
+    outputPath = man.getOutputPath()
+    return [os.path.abspath(os.path.join(outputPath,fileName)) for fileName in fileNames]
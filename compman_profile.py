@@ -0,0 +1,356 @@
+'''
+CompMan profiling.
+
+Opt-in timing and counters for the main CompMan entry points, per
+instance, with Chrome trace export (chrome://tracing, Perfetto) and
+hot node / critical path reports over dependency graphs.
+
+Usage:
+    with Profiler() as profiler:
+        runGraph(root)
+    profiler.saveTrace('trace.json')
+    print(profiler.formatReport())
+
+When no profiler is enabled nothing is instrumented: the methods are
+only wrapped while a profiler is enabled, so there is no cost at all
+otherwise.
+'''
+
+import json
+import time
+import types
+import functools
+import threading
+from collections import OrderedDict
+
+from compman import *
+
+# --------------------
+class ProfilerStateError(Exception):
+    def __init__(self,msg):
+        Exception.__init__(self,msg)
+
+class Profiler(object):
+    '''
+    Records an event (method, instance, thread, start and end times)
+    for each call of the profiled methods of CompMan and of its child
+    classes (classes defined while enabled are instrumented on their
+    first construction):
+        configure, configure_<metaParam>, getHashTag,
+        generateHashString, makeOutputPath, saveConfigCSVFile,
+        getOutput, computeOutput
+    plus any counters incremented with count().
+
+    Events keep a reference to their CompMan instance, tag prefixes are
+    only computed when reporting or exporting (so profiling does not
+    add hashing of its own). Only calls in this process are recorded:
+    with a process pool (DAGExecutor(useProcesses=True)), work done in
+    the worker processes is not seen.
+    '''
+    methodNames = ('configure','getHashTag','generateHashString','makeOutputPath',
+                   'saveConfigCSVFile','getOutput','computeOutput')
+
+    def __init__(self,methodNames=None):
+        if methodNames is not None:
+            self.methodNames = tuple(methodNames)
+        self.events       = [] # [name,man,threadId,startTime,endTime]
+        self.counters     = OrderedDict()
+        self.lock         = threading.Lock()
+        self.local        = threading.local()
+        self.originals    = [] # (cls,name,function) replaced by enable()
+        self.instrumented = set() # classes instrumented by enable()
+        self.startTime    = None
+
+    # --------------------
+    def enable(self):
+        '''
+        Instruments CompMan and all of its child classes.
+        '''
+        global _activeProfiler
+        if _activeProfiler is not None:
+            raise ProfilerStateError('Another Profiler is already enabled')
+        _activeProfiler = self
+        if self.startTime is None:
+            self.startTime = time.time()
+        for cls in _iterSubclasses(CompMan):
+            self._instrumentClass(cls)
+        initFunction = CompMan.__dict__['__init__']
+        self.originals.append((CompMan,'__init__',initFunction))
+        CompMan.__init__ = self._wrapInit(initFunction)
+
+    def disable(self):
+        '''
+        Restores the original methods. Recorded events are kept.
+        '''
+        global _activeProfiler
+        if _activeProfiler is not self:
+            return
+        for (cls,name,function) in reversed(self.originals):
+            setattr(cls,name,function)
+        self.originals    = []
+        self.instrumented = set()
+        _activeProfiler = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self,excType,excValue,excTraceback):
+        self.disable()
+
+    def clear(self):
+        with self.lock:
+            self.events    = []
+            self.counters  = OrderedDict()
+            self.startTime = time.time()
+
+    def count(self,name,n=1):
+        '''
+        Adds n to counter name.
+        '''
+        with self.lock:
+            self.counters[name] = self.counters.get(name,0) + n
+
+    # --------------------
+    def _instrumentClass(self,cls):
+        self.instrumented.add(cls)
+        for (name,function) in list(cls.__dict__.items()):
+            if not isinstance(function,types.FunctionType):
+                continue
+            if name in self.methodNames or name.startswith('configure_'):
+                self.originals.append((cls,name,function))
+                setattr(cls,name,self._wrap(name,function))
+
+    def _wrap(self,name,function):
+        profiler = self
+        local    = self.local
+        @functools.wraps(function)
+        def wrapper(man,*args,**kwargs):
+            if getattr(local,'paused',False):
+                return function(man,*args,**kwargs)
+            startTime = time.time()
+            try:
+                return function(man,*args,**kwargs)
+            finally:
+                endTime = time.time()
+                event   = [name,man,threading.current_thread().ident,startTime,endTime]
+                with profiler.lock:
+                    profiler.events.append(event)
+        wrapper.cmProfiled = function
+        return wrapper
+
+    def _wrapInit(self,function):
+        '''
+        Internal function
+        Wraps CompMan.__init__() to instrument the classes of each new
+        instance that are not yet, ie: defined while enabled.
+        '''
+        profiler = self
+        @functools.wraps(function)
+        def wrapper(man,*args,**kwargs):
+            if type(man) not in profiler.instrumented:
+                with profiler.lock:
+                    for cls in type(man).__mro__:
+                        if cls not in profiler.instrumented and issubclass(cls,CompMan):
+                            profiler._instrumentClass(cls)
+            return function(man,*args,**kwargs)
+        return wrapper
+
+    # --------------------
+    def getTagPrefixes(self):
+        '''
+        Returns dict id(man) -> getTagPrefix(True) for the instances in
+        the events. The profiled methods are not recorded meanwhile
+        (reentrancy guard), so reporting adds no events.
+        '''
+        with self.lock:
+            managers = dict((id(event[1]),event[1]) for event in self.events)
+        self.local.paused = True
+        try:
+            tagPrefixes = {}
+            for (manId,man) in managers.items():
+                try:
+                    tagPrefixes[manId] = man.getTagPrefix(True)
+                except Exception:
+                    tagPrefixes[manId] = '<{0} object at {1:#x}>'.format(type(man).__name__,manId)
+            return tagPrefixes
+        finally:
+            self.local.paused = False
+
+    def getSelfTimes(self):
+        '''
+        Returns list of (event,selfTime), selfTime being the duration of
+        the event minus that of the events nested in it (same thread).
+        '''
+        with self.lock:
+            events = sorted(self.events,key=lambda event: (event[2],event[3],-event[4]))
+        results = []
+        stack   = [] # [event,childTime] of the enclosing events
+        for event in events:
+            while stack and (stack[-1][0][2] != event[2] or stack[-1][0][4] <= event[3]):
+                (parent,childTime) = stack.pop()
+                results.append((parent,parent[4] - parent[3] - childTime))
+            if stack:
+                stack[-1][1] += event[4] - event[3]
+            stack.append([event,0.0])
+        while stack:
+            (parent,childTime) = stack.pop()
+            results.append((parent,parent[4] - parent[3] - childTime))
+        return results
+
+    def getMethodStats(self):
+        '''
+        Returns OrderedDict method name -> (calls, total time, self
+        time) in seconds, slowest self time first.
+        '''
+        stats = {}
+        for (event,selfTime) in self.getSelfTimes():
+            (calls,totalTime,totalSelfTime) = stats.get(event[0],(0,0.0,0.0))
+            stats[event[0]] = (calls + 1,totalTime + event[4] - event[3],totalSelfTime + selfTime)
+        return OrderedDict(sorted(stats.items(),key=lambda item: -item[1][2]))
+
+    def getNodeTimes(self):
+        '''
+        Returns dict id(man) -> total self time in seconds of all the
+        events of CompMan instance man.
+        '''
+        nodeTimes = {}
+        for (event,selfTime) in self.getSelfTimes():
+            nodeTimes[id(event[1])] = nodeTimes.get(id(event[1]),0.0) + selfTime
+        return nodeTimes
+
+    def getHotNodes(self,n=10):
+        '''
+        Returns list of the n (tagPrefix, self time in seconds, calls)
+        with the most self time, slowest first.
+        '''
+        nodeTimes   = self.getNodeTimes()
+        tagPrefixes = self.getTagPrefixes()
+        calls = {}
+        with self.lock:
+            for event in self.events:
+                calls[id(event[1])] = calls.get(id(event[1]),0) + 1
+        hotNodes = sorted(nodeTimes.items(),key=lambda item: -item[1])[:n]
+        return [(tagPrefixes[manId],selfTime,calls[manId]) for (manId,selfTime) in hotNodes]
+
+    def getCriticalPath(self,roots):
+        '''
+        Returns (time,tagPrefixes): the chain of dependencies from a leaf
+        to one of roots (CompMan instance or list of them) with the most
+        total profiled self time, ie: the time a parallel run could not
+        go below, and the tag prefixes along it, leaf first.
+        '''
+        if isinstance(roots,CompMan):
+            roots = [roots]
+        self.local.paused = True
+        try:
+            (nodes,deps) = getDependencyGraph(roots)
+        finally:
+            self.local.paused = False
+        nodeTimes = self.getNodeTimes()
+        pathTimes = {}
+        previous  = {}
+        for (tagPrefix,man) in nodes.items(): # topological order, dependencies first
+            best = None
+            for depTag in deps[tagPrefix]:
+                if best is None or pathTimes[depTag] > pathTimes[best]:
+                    best = depTag
+            pathTimes[tagPrefix] = nodeTimes.get(id(man),0.0) + (0.0 if best is None else pathTimes[best])
+            previous[tagPrefix]  = best
+        if not pathTimes:
+            return (0.0,[])
+        tagPrefix = max(pathTimes,key=pathTimes.get)
+        totalTime = pathTimes[tagPrefix]
+        path = []
+        while tagPrefix is not None:
+            path.append(tagPrefix)
+            tagPrefix = previous[tagPrefix]
+        return (totalTime,path[::-1])
+
+    # --------------------
+    def getTrace(self):
+        '''
+        Returns the events as a Chrome trace (Trace Event Format) dict,
+        viewable in chrome://tracing or Perfetto: one complete event per
+        call, annotated with the class and tag prefix of its instance,
+        and the counters as counter events at the end.
+        '''
+        tagPrefixes = self.getTagPrefixes()
+        with self.lock:
+            events    = list(self.events)
+            counters  = list(self.counters.items())
+        startTime = self.startTime if self.startTime is not None else 0.0
+        threadIds = {}
+        traceEvents = []
+        for (name,man,threadId,eventStart,eventEnd) in events:
+            tid = threadIds.setdefault(threadId,len(threadIds) + 1)
+            traceEvents.append(OrderedDict((
+                ('name',name),('cat','compman'),('ph','X'),
+                ('ts',1e6 * (eventStart - startTime)),('dur',1e6 * (eventEnd - eventStart)),
+                ('pid',1),('tid',tid),
+                ('args',OrderedDict((('class',type(man).__name__),('tagPrefix',tagPrefixes[id(man)])))),
+                )))
+        endTime = max([event[4] for event in events] or [startTime])
+        for (name,value) in counters:
+            traceEvents.append(OrderedDict((('name',name),('cat','compman'),('ph','C'),
+                                            ('ts',1e6 * (endTime - startTime)),('pid',1),
+                                            ('args',{'value':value}))))
+        return OrderedDict((('traceEvents',traceEvents),('displayTimeUnit','ms')))
+
+    def saveTrace(self,filePath):
+        '''
+        Writes getTrace() to JSON file filePath.
+        '''
+        with open(filePath,'w') as f:
+            json.dump(self.getTrace(),f)
+
+    def formatReport(self,n=10,roots=None):
+        '''
+        Returns printable report of the method stats, counters, the n
+        hot nodes and, if roots are given, the critical path.
+        '''
+        lines = ['{0:<24} {1:>8} {2:>12} {3:>12}'.format('method','calls','total s','self s')]
+        for (name,(calls,totalTime,selfTime)) in self.getMethodStats().items():
+            lines.append('{0:<24} {1:8d} {2:12.6f} {3:12.6f}'.format(name,calls,totalTime,selfTime))
+        for (name,value) in self.counters.items():
+            lines.append('counter {0:<16} {1}'.format(name,value))
+        lines.append('hot nodes:')
+        for (tagPrefix,selfTime,calls) in self.getHotNodes(n):
+            lines.append('  {0:12.6f} s {1:6d} calls  {2}'.format(selfTime,calls,tagPrefix))
+        if roots is not None:
+            (totalTime,path) = self.getCriticalPath(roots)
+            lines.append('critical path: {:.6f} s'.format(totalTime))
+            lines.extend('  ' + tagPrefix for tagPrefix in path)
+        return '\n'.join(lines)
+
+# --------------------
+_activeProfiler = None
+
+def getActiveProfiler():
+    '''
+    Returns the enabled Profiler, or None.
+    '''
+    return _activeProfiler
+
+def profileCount(name,n=1):
+    '''
+    Adds n to counter name of the enabled Profiler, if any. Cheap
+    enough to leave in code when profiling is disabled.
+    '''
+    if _activeProfiler is not None:
+        _activeProfiler.count(name,n)
+
+def _iterSubclasses(cls):
+    '''
+    Internal function
+    cls and all of its subclasses, each once.
+    '''
+    seen  = set()
+    stack = [cls]
+    while stack:
+        cls = stack.pop()
+        if cls in seen:
+            continue
+        seen.add(cls)
+        yield cls
+        stack.extend(type.__subclasses__(cls))
@@ -0,0 +1,400 @@
+'''
+CompMan distributed work queue.
+
+Spreads the nodes of a CompMan dependency graph over worker processes
+on many hosts sharing a cmBasePath, through a queue in an SQLite file
+(no server needed):
+    queue = WorkQueue(os.path.join(basePath,'compman_queue.sqlite'))
+    queue.enqueue(roots)
+    ...
+    # on each host, any number of times
+    QueueWorker(WorkQueue(queuePath)).run()
+    ...
+    print(queue.formatProgress())
+
+Nodes are stored as snapshots (see compman_snapshot), so workers do not
+rerun configuration: the classes of the nodes only need to be
+importable on every host. A worker claims a node whose dependencies are
+all done, runs its getOutput() and marks it done. Claims are leases
+renewed by a heartbeat thread while the node runs, so the nodes of a
+crashed worker are claimed again once their lease expires.
+
+NOTE: SQLite locking needs a file system with working POSIX locks (most
+NFS setups are fine, some network file systems are not), and leases
+assume that the clocks of the hosts are roughly in sync.
+'''
+
+import os
+import sys
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+import contextlib
+from collections import OrderedDict
+
+from compman import *
+from compman_snapshot import dumpSnapshot,loadSnapshotData
+
+queueStatuses = ('pending','running','done','failed','skipped')
+
+# --------------------
+class WorkQueue(object):
+    '''
+    Work queue in SQLite file queuePath, shared by all hosts. Each node
+    is keyed by its getTagPrefix(True), with a status:
+        'pending' - waiting for its dependencies or for a worker
+        'running' - claimed by a worker, until its lease expires
+        'done'    - getOutput() returned (or complete before enqueue)
+        'failed'  - getOutput() raised maxAttempts times, or the node
+                    could not be restored
+        'skipped' - a dependency failed
+    '''
+    def __init__(self,queuePath,timeout=60):
+        self.queuePath = queuePath
+        self.timeout   = timeout
+        self.local     = threading.local()
+        connection = self.getConnection()
+        with _transaction(connection):
+            connection.execute('CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY, data BLOB)')
+            connection.execute('CREATE TABLE IF NOT EXISTS nodes ('
+                               'tagprefix TEXT PRIMARY KEY, snapshotid INTEGER, status TEXT, numwaiting INTEGER, '
+                               'worker TEXT, leaseexpiry REAL, attempts INTEGER, error TEXT, '
+                               'enqueued REAL, started REAL, finished REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS deps (tagprefix TEXT, deptag TEXT)')
+            connection.execute('CREATE INDEX IF NOT EXISTS deps_deptag ON deps (deptag)')
+            connection.execute('CREATE INDEX IF NOT EXISTS nodes_status ON nodes (status,numwaiting)')
+
+    def getConnection(self):
+        '''
+        Returns the SQLite connection of the calling thread.
+        '''
+        connection = getattr(self.local,'connection',None)
+        if connection is None:
+            connection = sqlite3.connect(self.queuePath,timeout=self.timeout,isolation_level=None)
+            connection.text_factory = str
+            self.local.connection = connection
+        return connection
+
+    # --------------------
+    def enqueue(self,roots,skipComplete=True):
+        '''
+        Adds the nodes of the dependency graph of roots (CompMan
+        instance or list of them) to the queue, stored in one snapshot.
+        Nodes already in the queue are left as they are. If
+        skipComplete, nodes with a complete output (see
+        CompMan.outputExists()) are added as done. Nodes depending on a
+        failed or skipped node are added as skipped (see retry()).
+        Returns the number of nodes added.
+        '''
+        (nodes,deps) = getDependencyGraph(roots)
+        data = dumpSnapshot(list(nodes.values()))
+        now  = time.time()
+        connection = self.getConnection()
+        with _transaction(connection):
+            statuses = dict(connection.execute('SELECT tagprefix,status FROM nodes'))
+            new = [tagPrefix for tagPrefix in nodes if tagPrefix not in statuses]
+            if not new:
+                return 0
+            snapshotId = connection.execute('INSERT INTO snapshots VALUES (NULL,?)',(sqlite3.Binary(data),)).lastrowid
+            done = dict((tagPrefix,statuses.get(tagPrefix) == 'done') for tagPrefix in nodes)
+            failed = dict((tagPrefix,tagPrefix) for tagPrefix in nodes # tag -> failed tag it depends on
+                          if statuses.get(tagPrefix) in ('failed','skipped'))
+            for tagPrefix in new: # topological order, dependencies first
+                man = nodes[tagPrefix]
+                if skipComplete and man.getBasePath() is not None and man.outputExists('complete'):
+                    done[tagPrefix] = True
+                    connection.execute('INSERT INTO nodes VALUES (?,?,\'done\',0,NULL,NULL,0,NULL,?,NULL,?)',
+                                       (tagPrefix,snapshotId,now,now))
+                    continue
+                done[tagPrefix] = False
+                numWaiting = sum(1 for depTag in deps[tagPrefix] if not done[depTag])
+                failedTags = [failed[depTag] for depTag in deps[tagPrefix] if depTag in failed]
+                if failedTags:
+                    failed[tagPrefix] = failedTags[0]
+                    connection.execute('INSERT INTO nodes VALUES (?,?,\'skipped\',?,NULL,NULL,0,?,?,NULL,NULL)',
+                                       (tagPrefix,snapshotId,numWaiting,'dependency failed: ' + failedTags[0],now))
+                else:
+                    connection.execute('INSERT INTO nodes VALUES (?,?,\'pending\',?,NULL,NULL,0,NULL,?,NULL,NULL)',
+                                       (tagPrefix,snapshotId,numWaiting,now))
+                connection.executemany('INSERT INTO deps VALUES (?,?)',
+                                       [(tagPrefix,depTag) for depTag in deps[tagPrefix]])
+        return len(new)
+
+    def claim(self,worker,leaseTime=60.0,maxAttempts=3):
+        '''
+        Claims a pending node whose dependencies are all done for worker
+        (a worker id string), for leaseTime seconds. Nodes of expired
+        leases are reclaimed first (or failed, after maxAttempts claims).
+        Returns (tagPrefix,snapshotId) or None if no node is ready.
+        '''
+        now = time.time()
+        connection = self.getConnection()
+        with _transaction(connection):
+            expired = connection.execute('SELECT tagprefix,attempts FROM nodes '
+                                         'WHERE status=\'running\' AND leaseexpiry<?',(now,)).fetchall()
+            for (tagPrefix,attempts) in expired:
+                if attempts >= maxAttempts:
+                    self._fail(connection,tagPrefix,'lease expired {} times'.format(attempts),now)
+                else:
+                    connection.execute('UPDATE nodes SET status=\'pending\',worker=NULL WHERE tagprefix=?',
+                                       (tagPrefix,))
+            row = connection.execute('SELECT tagprefix,snapshotid FROM nodes '
+                                     'WHERE status=\'pending\' AND numwaiting=0 ORDER BY rowid LIMIT 1').fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE nodes SET status=\'running\',worker=?,leaseexpiry=?,attempts=attempts+1,'
+                               'started=? WHERE tagprefix=?',(worker,now + leaseTime,now,row[0]))
+        return row
+
+    def renewLease(self,tagPrefix,worker,leaseTime=60.0):
+        '''
+        Extends the lease of worker on node tagPrefix. Returns False if
+        worker lost it (expired and claimed by another worker).
+        '''
+        connection = self.getConnection()
+        cursor = connection.execute('UPDATE nodes SET leaseexpiry=? WHERE tagprefix=? AND worker=? '
+                                    'AND status=\'running\'',(time.time() + leaseTime,tagPrefix,worker))
+        return cursor.rowcount > 0
+
+    def complete(self,tagPrefix,worker):
+        '''
+        Marks node tagPrefix, claimed by worker, as done and releases
+        its dependents. Returns False, and changes nothing, if worker
+        does not hold the node (eg: its lease expired and another worker
+        claimed it).
+        '''
+        connection = self.getConnection()
+        with _transaction(connection):
+            cursor = connection.execute('UPDATE nodes SET status=\'done\',finished=?,leaseexpiry=NULL '
+                                        'WHERE tagprefix=? AND worker=? AND status=\'running\'',
+                                        (time.time(),tagPrefix,worker))
+            if not cursor.rowcount:
+                return False
+            connection.execute('UPDATE nodes SET numwaiting=numwaiting-1 WHERE tagprefix IN '
+                               '(SELECT tagprefix FROM deps WHERE deptag=?) AND status=\'pending\'',
+                               (tagPrefix,))
+        return True
+
+    def fail(self,tagPrefix,worker,error,maxAttempts=3):
+        '''
+        Records that getOutput() of node tagPrefix raised error (string)
+        in worker. The node is claimed again later unless it already
+        was maxAttempts times, in which case it fails and its dependents
+        are skipped. Returns False, and changes nothing, if worker does
+        not hold the node.
+        '''
+        now = time.time()
+        connection = self.getConnection()
+        with _transaction(connection):
+            row = connection.execute('SELECT attempts FROM nodes WHERE tagprefix=? AND worker=? '
+                                     'AND status=\'running\'',(tagPrefix,worker)).fetchone()
+            if row is None:
+                return False # lease lost meanwhile
+            if row[0] >= maxAttempts:
+                self._fail(connection,tagPrefix,error,now)
+            else:
+                connection.execute('UPDATE nodes SET status=\'pending\',worker=NULL,error=? WHERE tagprefix=?',
+                                   (error,tagPrefix))
+        return True
+
+    def retry(self):
+        '''
+        Puts failed and skipped nodes back to pending, with their
+        attempt counts reset.
+        '''
+        connection = self.getConnection()
+        with _transaction(connection):
+            connection.execute('UPDATE nodes SET status=\'pending\',attempts=0,worker=NULL '
+                               'WHERE status IN (\'failed\',\'skipped\')')
+            connection.execute('UPDATE nodes SET numwaiting=(SELECT COUNT(*) FROM deps JOIN nodes AS dep '
+                               'ON dep.tagprefix=deps.deptag WHERE deps.tagprefix=nodes.tagprefix '
+                               'AND dep.status!=\'done\') WHERE status=\'pending\'')
+
+    def _fail(self,connection,tagPrefix,error,now):
+        connection.execute('UPDATE nodes SET status=\'failed\',error=?,finished=?,leaseexpiry=NULL '
+                           'WHERE tagprefix=?',(error,now,tagPrefix))
+        stack = [tagPrefix]
+        while stack:
+            depTag = stack.pop()
+            for (dependent,) in connection.execute('SELECT tagprefix FROM deps WHERE deptag=?',(depTag,)).fetchall():
+                cursor = connection.execute('UPDATE nodes SET status=\'skipped\',error=? WHERE tagprefix=? '
+                                            'AND status=\'pending\'',('dependency failed: ' + tagPrefix,dependent))
+                if cursor.rowcount:
+                    stack.append(dependent)
+
+    # --------------------
+    def getSnapshot(self,snapshotId):
+        '''
+        Returns the snapshot bytes snapshotId.
+        '''
+        row = self.getConnection().execute('SELECT data FROM snapshots WHERE id=?',(snapshotId,)).fetchone()
+        return bytes(row[0])
+
+    def getStatus(self,tagPrefix):
+        row = self.getConnection().execute('SELECT status FROM nodes WHERE tagprefix=?',(tagPrefix,)).fetchone()
+        return None if row is None else row[0]
+
+    def getErrors(self):
+        '''
+        Returns OrderedDict tagPrefix -> error of the failed nodes.
+        '''
+        return OrderedDict(self.getConnection().execute('SELECT tagprefix,error FROM nodes '
+                                                        'WHERE status=\'failed\' ORDER BY rowid'))
+
+    def isFinished(self):
+        '''
+        True if no node is pending or running.
+        '''
+        row = self.getConnection().execute('SELECT COUNT(*) FROM nodes '
+                                           'WHERE status IN (\'pending\',\'running\')').fetchone()
+        return row[0] == 0
+
+    def getProgress(self,window=300.0):
+        '''
+        Returns OrderedDict with the number of nodes per status, the
+        total, the ready nodes (pending with all dependencies done), the
+        active workers, the throughput in nodes per second over the last
+        window seconds, and the estimated seconds left at that rate.
+        '''
+        now = time.time()
+        connection = self.getConnection()
+        counts = dict(connection.execute('SELECT status,COUNT(*) FROM nodes GROUP BY status'))
+        progress = OrderedDict((status,counts.get(status,0)) for status in queueStatuses)
+        progress['total']   = sum(counts.values())
+        progress['ready']   = connection.execute('SELECT COUNT(*) FROM nodes WHERE status=\'pending\' '
+                                                 'AND numwaiting=0').fetchone()[0]
+        progress['workers'] = connection.execute('SELECT COUNT(DISTINCT worker) FROM nodes '
+                                                 'WHERE status=\'running\'').fetchone()[0]
+        (numRecent,firstTime) = connection.execute('SELECT COUNT(*),MIN(finished) FROM nodes WHERE status=\'done\' '
+                                                   'AND started IS NOT NULL AND finished>?',(now - window,)).fetchone()
+        throughput = numRecent / max(now - firstTime,1.0) if numRecent else 0.0
+        progress['throughput'] = throughput
+        remaining = progress['pending'] + progress['running']
+        progress['etaSeconds'] = remaining / throughput if throughput > 0 else None
+        return progress
+
+    def formatProgress(self,window=300.0):
+        '''
+        Returns getProgress() as a printable one-line summary.
+        '''
+        progress = self.getProgress(window)
+        eta = '?' if progress['etaSeconds'] is None else '{:.0f}s'.format(progress['etaSeconds'])
+        return ('{done}/{total} done, {running} running on {workers} workers, {ready} ready, {pending} pending, '
+                '{failed} failed, {skipped} skipped, {throughput:.2f} nodes/s, eta {eta}').format(eta=eta,**progress)
+
+# --------------------
+class QueueWorker(object):
+    '''
+    Runs nodes of WorkQueue queue until it is finished (or maxNodes
+    nodes ran): claims a ready node, restores it from its snapshot, runs
+    its getOutput() while a heartbeat thread renews the lease every
+    leaseTime/3 seconds, and marks it done or failed. Waits
+    pollInterval seconds when no node is ready.
+
+    stats
+      - 'done', 'failed' - nodes run
+      - 'lost'           - nodes whose lease expired while they ran, so
+      another worker claimed them and their outcome was dropped
+      - 'busySeconds'    - time spent running nodes
+    '''
+    def __init__(self,queue,workerId=None,leaseTime=60.0,pollInterval=2.0,maxAttempts=3):
+        if workerId is None:
+            workerId = '{0}:{1}:{2}'.format(socket.gethostname(),os.getpid(),threading.current_thread().ident)
+        self.queue        = queue
+        self.workerId     = workerId
+        self.leaseTime    = leaseTime
+        self.pollInterval = pollInterval
+        self.maxAttempts  = maxAttempts
+        self.snapshots    = {} # snapshot id -> bytes
+        self.stats        = OrderedDict((('done',0),('failed',0),('lost',0),('busySeconds',0.0)))
+
+    def run(self,maxNodes=None,exitWhenIdle=True):
+        '''
+        Returns self.stats. If exitWhenIdle is False, keeps polling once
+        the queue is finished (eg: for queues that are fed over time).
+        '''
+        numNodes = 0
+        while maxNodes is None or numNodes < maxNodes:
+            claimed = self.queue.claim(self.workerId,self.leaseTime,self.maxAttempts)
+            if claimed is None:
+                if exitWhenIdle and self.queue.isFinished():
+                    break
+                time.sleep(self.pollInterval)
+                continue
+            self.runNode(*claimed)
+            numNodes += 1
+        return self.stats
+
+    def runNode(self,tagPrefix,snapshotId):
+        '''
+        Runs claimed node tagPrefix of snapshot snapshotId.
+        '''
+        startTime = time.time()
+        stopEvent = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat,args=(tagPrefix,stopEvent))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            if snapshotId not in self.snapshots:
+                self.snapshots[snapshotId] = self.queue.getSnapshot(snapshotId)
+            (man,) = loadSnapshotData(self.snapshots[snapshotId],[tagPrefix])
+            man.getOutput()
+        except Exception:
+            (excType,excValue,excTraceback) = sys.exc_info()
+            error = '{0}: {1}\n{2}'.format(excType.__name__,excValue,
+                                           ''.join(traceback.format_exception(excType,excValue,excTraceback)))
+            ok = False
+        else:
+            ok = True
+        finally:
+            stopEvent.set()
+            heartbeat.join()
+        if ok:
+            held = self.queue.complete(tagPrefix,self.workerId)
+        else:
+            held = self.queue.fail(tagPrefix,self.workerId,error,self.maxAttempts)
+        if not held:
+            self.stats['lost'] += 1 # lease expired meanwhile, the node is another worker's now
+        elif ok:
+            self.stats['done'] += 1
+        else:
+            self.stats['failed'] += 1
+        self.stats['busySeconds'] += time.time() - startTime
+
+    def _heartbeat(self,tagPrefix,stopEvent):
+        while not stopEvent.wait(self.leaseTime / 3.0):
+            if not self.queue.renewLease(tagPrefix,self.workerId,self.leaseTime):
+                return
+
+# --------------------
+@contextlib.contextmanager
+def _transaction(connection):
+    '''
+    Internal function
+    Write transaction taking the database lock at once (BEGIN
+    IMMEDIATE), so concurrent claims are serialized.
+    '''
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+def runQueueWorkers(queuePath,numWorkers=1,**kwargs):
+    '''
+    Runs numWorkers QueueWorker threads on queue file queuePath until
+    it is finished. Returns list of their stats.
+    '''
+    results = [None] * numWorkers
+    def runWorker(index):
+        results[index] = QueueWorker(WorkQueue(queuePath),**kwargs).run()
+    threads = [threading.Thread(target=runWorker,args=(index,)) for index in range(numWorkers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
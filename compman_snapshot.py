@@ -0,0 +1,245 @@
+'''
+CompMan graph snapshots.
+
+Compact binary serialization of configured CompMan graphs, so worker
+processes can restore a pipeline without rerunning any
+configure_<metaParam>() or rehashing anything:
+    saveSnapshot('graph.cmsnap',roots)
+    ...
+    roots = loadSnapshot('graph.cmsnap')
+    (node,) = loadSnapshot('graph.cmsnap',[tagPrefix]) # only its subgraph
+
+A snapshot is a flat table with one record per CompMan instance: its
+class and its pickled state, in which references to other CompMan
+instances are replaced by their index in the table. Shared references
+(the same instance held by several dependents) are kept as such, and
+the cached hash tags are restored with the state. The table is
+zlib-compressed.
+
+A snapshot records, for each class of its instances, a fingerprint of
+its source code and the cmCodeTag values of its instances, and
+optionally a code tag chosen by the caller (eg: the version of the
+pipeline). Loading it raises SnapshotInvalidError, see
+loadSnapshotOrBuild(), after the source of one of those classes
+changed, or the code tag a class declares (class attribute cmCodeTag,
+see getClassCodeTag()) is not the cmCodeTag of its instances any more,
+or with another caller code tag.
+'''
+
+import io
+import os
+import sys
+import zlib
+import inspect
+import hashlib
+from collections import OrderedDict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from compman import *
+
+snapshotMagic   = b'CMSNAP1\n'
+snapshotVersion = 2
+
+# --------------------
+class SnapshotInvalidError(Exception):
+    def __init__(self,msg):
+        Exception.__init__(self,msg)
+
+# --------------------
+def dumpSnapshot(roots,codeTag=None,level=6):
+    '''
+    Returns the snapshot of roots (CompMan instance or list of them) and
+    of every CompMan instance they refer to, as bytes. Hash tags not
+    cached yet are computed first (see cacheHashTags()), so the restored
+    instances never hash. level is the zlib compression level.
+    '''
+    if isinstance(roots,CompMan):
+        roots = [roots]
+    cacheHashTags(roots)
+    indices  = {}  # id(man) -> index in managers
+    managers = []
+    def getIndex(man):
+        if id(man) not in indices:
+            indices[id(man)] = len(managers)
+            managers.append(man)
+        return indices[id(man)]
+    rootIndices = [getIndex(root) for root in roots]
+    classIndices = {}
+    classes      = [] # (module,name,source fingerprint)
+    codeTags     = [] # per class: set of the cmCodeTag of its instances
+    records      = [] # (class index,pickled state,indices of the instances referred to)
+    tagPrefixes  = []
+    i = 0
+    while i < len(managers): # grows while pickling, as new instances are found
+        man   = managers[i]
+        refs  = []
+        def persistentId(obj):
+            if isinstance(obj,CompMan):
+                index = getIndex(obj)
+                refs.append(index)
+                return index
+            return None
+        stream  = io.BytesIO()
+        pickler = pickle.Pickler(stream,pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistentId
+        pickler.dump(man.__getstate__())
+        cls = type(man)
+        if cls not in classIndices:
+            classIndices[cls] = len(classes)
+            classes.append((cls.__module__,cls.__name__,getClassFingerprint(cls)))
+            codeTags.append(set())
+        codeTags[classIndices[cls]].add(man.cmCodeTag)
+        records.append((classIndices[cls],stream.getvalue(),sorted(set(refs))))
+        tagPrefixes.append(_getCachedTagPrefix(man))
+        i += 1
+    header = OrderedDict((
+        ('version',snapshotVersion),
+        ('codeTag',codeTag),
+        ('classes',classes),
+        ('codeTags',[sorted(tags) for tags in codeTags]),
+        ('roots',rootIndices),
+        ('tagPrefixes',tagPrefixes),
+        ))
+    data = pickle.dumps((header,records),pickle.HIGHEST_PROTOCOL)
+    return snapshotMagic + zlib.compress(data,level)
+
+def loadSnapshotData(data,tagPrefixes=None,codeTag=None):
+    '''
+    Restores snapshot bytes data (see dumpSnapshot()). Returns list of
+    the root instances, or if tagPrefixes (list of getTagPrefix(True)
+    values) is given, of the instances with those tag prefixes: then
+    only them and the instances they refer to are restored.
+    Raises SnapshotInvalidError if codeTag is not the one of the
+    snapshot, or if the source or the code tag (see getClassCodeTag())
+    of a class changed since.
+    '''
+    if not data.startswith(snapshotMagic):
+        raise SnapshotInvalidError('Not a CompMan snapshot')
+    (header,records) = pickle.loads(zlib.decompress(data[len(snapshotMagic):]))
+    if header['version'] != snapshotVersion:
+        raise SnapshotInvalidError('Snapshot version {0} is not {1}'.format(header['version'],snapshotVersion))
+    if header['codeTag'] != codeTag:
+        raise SnapshotInvalidError('Snapshot code tag {0!r} is not {1!r}'.format(header['codeTag'],codeTag))
+    if tagPrefixes is None:
+        wanted = header['roots']
+    else:
+        positions = dict((tagPrefix,index) for (index,tagPrefix) in enumerate(header['tagPrefixes']))
+        try:
+            wanted = [positions[tagPrefix] for tagPrefix in tagPrefixes]
+        except KeyError as e:
+            raise KeyError('No instance with tag prefix {} in snapshot'.format(e.args[0]))
+    # instances needed: wanted and everything they refer to
+    needed = set(wanted)
+    stack  = list(wanted)
+    while stack:
+        for ref in records[stack.pop()][2]:
+            if ref not in needed:
+                needed.add(ref)
+                stack.append(ref)
+    classes  = [_getClass(module,name,fingerprint,codeTags)
+                for ((module,name,fingerprint),codeTags) in zip(header['classes'],header['codeTags'])]
+    managers = dict((index,object.__new__(classes[records[index][0]])) for index in needed)
+    for index in sorted(needed):
+        unpickler = pickle.Unpickler(io.BytesIO(records[index][1]))
+        unpickler.persistent_load = managers.__getitem__
+        managers[index].__setstate__(unpickler.load())
+    return [managers[index] for index in wanted]
+
+def saveSnapshot(filePath,roots,codeTag=None,level=6):
+    '''
+    Writes dumpSnapshot() of roots to file filePath atomically
+    (temporary file then rename).
+    '''
+    data    = dumpSnapshot(roots,codeTag,level)
+    tmpPath = '{0}.tmp{1}'.format(filePath,os.getpid())
+    with open(tmpPath,'wb') as f:
+        f.write(data)
+    os.rename(tmpPath,filePath)
+
+def loadSnapshot(filePath,tagPrefixes=None,codeTag=None):
+    '''
+    Restores the snapshot in file filePath, see loadSnapshotData().
+    '''
+    with open(filePath,'rb') as f:
+        data = f.read()
+    return loadSnapshotData(data,tagPrefixes,codeTag)
+
+def loadSnapshotOrBuild(filePath,buildRoots,codeTag=None):
+    '''
+    Returns the roots restored from the snapshot in file filePath. If
+    the file is missing or the snapshot is invalid, calls buildRoots()
+    (returning CompMan instance or list of them) instead, saves its
+    snapshot to filePath and returns its roots as a list.
+    '''
+    try:
+        return loadSnapshot(filePath,codeTag=codeTag)
+    except (IOError,OSError,SnapshotInvalidError):
+        pass
+    roots = buildRoots()
+    if isinstance(roots,CompMan):
+        roots = [roots]
+    saveSnapshot(filePath,roots,codeTag)
+    return roots
+
+# --------------------
+_classFingerprints = {}
+
+def getClassFingerprint(cls):
+    '''
+    Returns SHA-1 of the source code of class cls and of its CompMan
+    base classes (None if some source is not available, eg: classes
+    defined interactively, which are then not checked).
+    '''
+    fingerprint = _classFingerprints.get(cls)
+    if fingerprint is None and cls not in _classFingerprints:
+        hasher = hashlib.sha1()
+        try:
+            for baseCls in inspect.getmro(cls):
+                if issubclass(baseCls,CompMan):
+                    hasher.update(inspect.getsource(baseCls).encode('utf-8'))
+            fingerprint = hasher.hexdigest()
+        except (IOError,OSError,TypeError):
+            fingerprint = None
+        _classFingerprints[cls] = fingerprint
+    return fingerprint
+
+def getClassCodeTag(cls):
+    '''
+    Returns the code tag declared by class cls, ie: its class attribute
+    cmCodeTag (eg: cmCodeTag = 'analysiscode_TestMan_v2', passed as
+    self.cmCodeTag to CompMan.__init__()), or None if it declares none.
+    '''
+    for baseCls in inspect.getmro(cls):
+        codeTag = baseCls.__dict__.get('cmCodeTag')
+        if isinstance(codeTag,str):
+            return codeTag
+    return None
+
+def _getClass(module,name,fingerprint,codeTags):
+    '''
+    Internal function
+    '''
+    try:
+        __import__(module)
+        cls = getattr(sys.modules[module],name)
+    except (ImportError,AttributeError):
+        raise SnapshotInvalidError('Class {0}.{1} not found'.format(module,name))
+    current = getClassFingerprint(cls)
+    if fingerprint is not None and current is not None and fingerprint != current:
+        raise SnapshotInvalidError('Source of class {0}.{1} changed'.format(module,name))
+    current = getClassCodeTag(cls)
+    if current is not None and any(codeTag != current for codeTag in codeTags):
+        raise SnapshotInvalidError('Code tag of class {0}.{1} is now {2!r}, not {3!r}'
+                                   .format(module,name,current,', '.join(codeTags)))
+    return cls
+
+def _getCachedTagPrefix(man):
+    '''
+    Internal function
+    '''
+    if 'cmPendingMetaParam' in man.__dict__:
+        return None # not configured, ie: not a node of the graph yet
+    return man.getTagPrefix(True)
@@ -0,0 +1,192 @@
+'''
+CompMan build stamps.
+
+Make-style staleness detection: markOutputComplete() writes a build
+stamp (JSON) in the output directory of a CompMan instance, recording
+that its output is complete, a unique build id, the build ids of the
+dependencies it was built from and fingerprints of its input files
+(see CompMan.getInputFiles()).
+
+A node is fresh, ie: its output can be reused as is, if its stamp
+exists, all of its dependencies are fresh and were not rebuilt since
+(same build ids), and its input files are unchanged. checkFreshness()
+decides this for a whole dependency graph at once, so a rerun after a
+crash or after a single upstream change only recomputes the affected
+subgraph (see DAGExecutor(skipFresh=True)).
+'''
+
+import os
+import json
+import time
+import uuid
+import hashlib
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+
+from compman import *
+
+# --------------------
+def writeStamp(man):
+    '''
+    Writes the build stamp of CompMan instance man, with a new build id,
+    atomically (temporary file then rename). Returns the stamp dict.
+    '''
+    dependencies = OrderedDict()
+    for depMan in man.getDependencies():
+        if depMan.getBasePath() is None:
+            continue
+        depStamp = readStamp(depMan)
+        dependencies[depMan.getTagPrefix(True)] = None if depStamp is None else depStamp['buildId']
+    contentHash = man.cmInputFingerprint == 'content'
+    stamp = OrderedDict((
+        ('complete',True),
+        ('buildId',uuid.uuid4().hex),
+        ('time',time.time()),
+        ('tagPrefix',man.getTagPrefix(True)),
+        ('dependencies',dependencies),
+        ('inputs',OrderedDict((filePath,fingerprintFile(filePath,contentHash)) for filePath in man.getInputFiles())),
+        ))
+    man.makeOutputPath()
+    filePath = man.getStampFilePath()
+    tmpPath  = '{0}.tmp{1}'.format(filePath,os.getpid())
+    with open(tmpPath,'w') as f:
+        json.dump(stamp,f,indent=1)
+    os.rename(tmpPath,filePath)
+    return stamp
+
+def readStamp(man):
+    '''
+    Returns the build stamp dict of CompMan instance man, or None if it
+    has none (or an unreadable one, eg: written by a crashed process).
+    '''
+    try:
+        with open(man.getStampFilePath()) as f:
+            stamp = json.load(f)
+    except (IOError,OSError,ValueError):
+        return None
+    if not stamp.get('complete'):
+        return None
+    return stamp
+
+def removeStamp(man):
+    '''
+    Deletes the build stamp of CompMan instance man, so it is stale.
+    '''
+    try:
+        os.remove(man.getStampFilePath())
+    except OSError:
+        pass
+
+def fingerprintFile(filePath,contentHash=False):
+    '''
+    Returns dict with the size and mtime of file filePath, plus the
+    SHA-256 of its content if contentHash. None if it does not exist.
+    '''
+    try:
+        stat = os.stat(filePath)
+    except OSError:
+        return None
+    fingerprint = OrderedDict((('size',stat.st_size),('mtime',stat.st_mtime)))
+    if contentHash:
+        hasher = hashlib.sha256()
+        with open(filePath,'rb') as f:
+            for block in iter(lambda: f.read(2**20),b''):
+                hasher.update(block)
+        fingerprint['sha256'] = hasher.hexdigest()
+    return fingerprint
+
+# --------------------
+def checkFreshness(roots,checkInputs=True,numThreads=8):
+    '''
+    Decides which nodes of the dependency graph of roots (CompMan
+    instance or list of them, see getDependencyGraph()) are fresh.
+    Returns OrderedDict tagPrefix -> reason in topological order, with
+    reason None for fresh nodes, else why the node must be rebuilt:
+        'no stamp', 'dependencies changed', 'dependency stale: <tag>',
+        'dependency rebuilt: <tag>', 'inputs changed',
+        'input changed: <path>'
+
+    Stamps (and input file stats) are read by numThreads threads, then
+    staleness is propagated from dependencies to dependents. Nodes
+    without a base path have no stamp: they are fresh if all of their
+    dependencies are. If checkInputs is False, input files are not
+    looked at.
+    With a content hash fingerprint (cmInputFingerprint = 'content'),
+    input files whose size and mtime changed are hashed, and only count
+    as changed if their content did.
+    '''
+    (nodes,deps) = getDependencyGraph(roots)
+    stamped = [(tagPrefix,man) for (tagPrefix,man) in nodes.items() if man.getBasePath() is not None]
+    pool = ThreadPool(max(1,min(numThreads,len(stamped))))
+    try:
+        checked = pool.map(lambda item: _readAndCheckInputs(item[1],checkInputs),stamped)
+    finally:
+        pool.close()
+        pool.join()
+    stamps       = {}
+    inputReasons = {}
+    for ((tagPrefix,man),(stamp,inputReason)) in zip(stamped,checked):
+        stamps[tagPrefix]       = stamp
+        inputReasons[tagPrefix] = inputReason
+    freshness = OrderedDict()
+    for (tagPrefix,man) in nodes.items(): # topological order, dependencies first
+        freshness[tagPrefix] = _getReason(tagPrefix,man,deps[tagPrefix],stamps,inputReasons,freshness)
+    return freshness
+
+def getStaleNodes(roots,checkInputs=True,numThreads=8):
+    '''
+    Returns list of the tag prefixes of the nodes of the dependency
+    graph of roots that must be rebuilt, see checkFreshness().
+    '''
+    freshness = checkFreshness(roots,checkInputs,numThreads)
+    return [tagPrefix for (tagPrefix,reason) in freshness.items() if reason is not None]
+
+# --------------------
+def _readAndCheckInputs(man,checkInputs):
+    '''
+    Internal function
+    Returns (stamp,reason), reason being why the input files make man
+    stale, or None.
+    '''
+    stamp = readStamp(man)
+    if stamp is None or not checkInputs:
+        return (stamp,None)
+    inputs = stamp.get('inputs',{})
+    if set(inputs) != set(man.getInputFiles()):
+        return (stamp,'inputs changed')
+    for (filePath,recorded) in inputs.items():
+        current = fingerprintFile(filePath)
+        if current is None or recorded is None:
+            if current != recorded:
+                return (stamp,'input changed: {}'.format(filePath))
+            continue
+        if current['size'] == recorded['size'] and current['mtime'] == recorded['mtime']:
+            continue
+        if 'sha256' in recorded and current['size'] == recorded['size']:
+            if fingerprintFile(filePath,True)['sha256'] == recorded['sha256']:
+                continue
+        return (stamp,'input changed: {}'.format(filePath))
+    return (stamp,None)
+
+def _getReason(tagPrefix,man,depTags,stamps,inputReasons,freshness):
+    '''
+    Internal function
+    Why node tagPrefix is stale, or None, its dependencies being
+    decided already.
+    '''
+    for depTag in depTags:
+        if freshness[depTag] is not None:
+            return 'dependency stale: {}'.format(depTag)
+    if man.getBasePath() is None:
+        return None
+    stamp = stamps[tagPrefix]
+    if stamp is None:
+        return 'no stamp'
+    recorded = stamp.get('dependencies',{})
+    stampedDeps = [depTag for depTag in depTags if depTag in stamps]
+    if set(recorded) != set(stampedDeps):
+        return 'dependencies changed'
+    for depTag in stampedDeps:
+        if recorded[depTag] is None or recorded[depTag] != stamps[depTag]['buildId']:
+            return 'dependency rebuilt: {}'.format(depTag)
+    return inputReasons[tagPrefix]
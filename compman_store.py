@@ -0,0 +1,186 @@
+'''
+CompMan output storage.
+
+Saves outputs in the output directory of a CompMan instance (see
+CompMan.getOutputPath()) in memory-mappable files, and loads them back
+as read-only memory-mapped views: nothing is read or copied until
+accessed, and all consumers in a process share one mapping per file.
+
+Mapped outputs pickle as a reference to their file, so passing them
+between processes (eg: DAGExecutor with useProcesses=True) or storing
+them in the result cache (see compman_cache) does not copy the data:
+each process maps the same file, backed by the same OS page cache.
+'''
+
+import os
+import mmap
+import weakref
+import threading
+try:
+    import numpy
+    from numpy.lib import format as npyformat
+except ImportError:
+    numpy = None
+
+from compman import *
+
+# --------------------
+if numpy is not None:
+    class MappedArray(numpy.memmap):
+        '''
+        Read-only memory-mapped NumPy array returned by loadArray().
+        The array returned by loadArray() pickles as a reference to its
+        .npy file, views and results derived from it pickle as normal
+        arrays (ie: copies).
+        '''
+        def __reduce__(self):
+            if self.filename is not None and _mappedArrays.get(self.filename) is self:
+                return (loadArray,(self.filename,))
+            return numpy.asarray(self).__reduce__()
+
+class MappedBuffer(object):
+    '''
+    Read-only memory-mapped bytes returned by loadBuffer(). Pickles as
+    a reference to its file.
+    '''
+    def __init__(self,filePath):
+        self.filePath = filePath
+        with open(filePath,'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self.mmap = b'' # empty files cannot be mapped
+            else:
+                self.mmap = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+
+    def getView(self):
+        '''
+        Returns a zero-copy read-only view of the bytes (memoryview, or
+        buffer on Python 2).
+        '''
+        try:
+            return memoryview(self.mmap)
+        except TypeError:
+            return buffer(self.mmap)
+
+    def getArray(self,dtype='uint8',offset=0,count=-1):
+        '''
+        Returns a zero-copy read-only NumPy array of the bytes.
+        '''
+        return numpy.frombuffer(self.mmap,dtype=dtype,count=count,offset=offset)
+
+    def __len__(self):
+        return len(self.mmap)
+
+    def __getitem__(self,index):
+        return self.mmap[index]
+
+    def __reduce__(self):
+        return (loadBuffer,(self.filePath,))
+
+# --------------------
+_mappedArrays  = weakref.WeakValueDictionary() # filePath -> MappedArray
+_mappedBuffers = weakref.WeakValueDictionary() # filePath -> MappedBuffer
+_lock          = threading.Lock()
+
+def saveArray(filePath,array):
+    '''
+    Writes NumPy array to .npy file filePath atomically (temporary file
+    then rename). Object arrays are not supported, they cannot be
+    memory-mapped.
+    '''
+    array = numpy.asanyarray(array)
+    if array.dtype.hasobject:
+        raise TypeError('Object arrays cannot be memory-mapped')
+    tmpPath = '{0}.tmp{1}'.format(filePath,os.getpid())
+    with open(tmpPath,'wb') as f:
+        npyformat.write_array(f,array,allow_pickle=False)
+    os.rename(tmpPath,filePath)
+
+def loadArray(filePath):
+    '''
+    Returns read-only MappedArray of .npy file filePath. Returns the
+    same mapping for every call in this process while it is in use and
+    the file has not been rewritten.
+    '''
+    filePath = os.path.abspath(filePath)
+    with _lock:
+        array = _getMapped(_mappedArrays,filePath)
+        if array is None:
+            array = npyformat.open_memmap(filePath,mode='r').view(MappedArray)
+            _setMapped(_mappedArrays,filePath,array)
+    return array
+
+def saveBuffer(filePath,data):
+    '''
+    Writes bytes-like data (bytes, bytearray, memoryview, NumPy array)
+    to file filePath atomically.
+    '''
+    tmpPath = '{0}.tmp{1}'.format(filePath,os.getpid())
+    with open(tmpPath,'wb') as f:
+        f.write(data)
+    os.rename(tmpPath,filePath)
+
+def loadBuffer(filePath):
+    '''
+    Returns read-only MappedBuffer of file filePath, shared like
+    loadArray().
+    '''
+    filePath = os.path.abspath(filePath)
+    with _lock:
+        mappedBuffer = _getMapped(_mappedBuffers,filePath)
+        if mappedBuffer is None:
+            mappedBuffer = MappedBuffer(filePath)
+            _setMapped(_mappedBuffers,filePath,mappedBuffer)
+    return mappedBuffer
+
+def isMapped(value):
+    '''
+    True if value is a mapping returned by loadArray() or loadBuffer(),
+    ie: it takes no memory of its own and pickles as a file reference.
+    '''
+    if isinstance(value,MappedBuffer):
+        return True
+    filePath = getattr(value,'filename',None)
+    return numpy is not None and isinstance(value,MappedArray) and _mappedArrays.get(filePath) is value
+
+def getMappedFile(value):
+    '''
+    Returns the path of the file mapped by value if isMapped(value),
+    else None.
+    '''
+    if isinstance(value,MappedBuffer):
+        return value.filePath
+    if isMapped(value):
+        return value.filename
+    return None
+
+# --------------------
+def _getMapped(mapped,filePath):
+    '''
+    Internal function
+    Returns the live mapping of filePath in mapped, or None if there is
+    none or the file changed since it was mapped.
+    '''
+    value = mapped.get(filePath)
+    if value is not None and value.cmFileStamp != _getFileStamp(filePath):
+        del mapped[filePath]
+        value = None
+    return value
+
+def _setMapped(mapped,filePath,value):
+    '''
+    Internal function
+    Registers mapping value of filePath, with the (mtime,size,inode) of
+    the file kept on value so it goes away with the mapping.
+    '''
+    value.cmFileStamp = _getFileStamp(filePath)
+    mapped[filePath]  = value
+
+def _getFileStamp(filePath):
+    '''
+    Internal function
+    '''
+    try:
+        stat = os.stat(filePath)
+    except OSError:
+        return None
+    return (stat.st_mtime,stat.st_size,stat.st_ino)
@@ -0,0 +1,98 @@
+'''
+CompMan parameter sweeps.
+
+Builds many instances of a CompMan child class over a grid of
+metaparameters / constructor arguments / config overrides, with the
+dependencies that are identical across points constructed only once
+and the hash tags of all instances computed in one batched pass.
+'''
+
+import inspect
+import itertools
+from collections import OrderedDict
+
+from compman import *
+
+# --------------------
+def sweepGrid(axes):
+    '''
+    Returns list of dicts, one per point of the cartesian product of
+    axes: OrderedDict / dict / list of (name, list of values). The last
+    axis varies fastest.
+        sweepGrid([('cmMetaParam',['a','b']),('field1',[1,2,3])])
+    '''
+    if isinstance(axes,dict):
+        axes = list(axes.items())
+    names = [name for (name,values) in axes]
+    return [dict(zip(names,point)) for point in itertools.product(*[values for (name,values) in axes])]
+
+def buildSweep(cls,points,args=(),kwargs=None,shareDependencies=True,batchHashTags=True):
+    '''
+    Returns list of instances of CompMan child class cls, one for each
+    point in points (list of dicts, eg: from sweepGrid()):
+      - point keys that are arguments of cls.__init__() (eg:
+      cmMetaParam) are passed to the constructor, with args and kwargs
+      - other point keys override config values after construction: in
+      cmExConfigDict if already set there, otherwise in cmConfigDict
+
+    shareDependencies
+      - True (default): instances are constructed inside
+      sharedConstruction(), so dependencies constructed with the same
+      class and arguments (eg: the TemplateMan instances of TestMan) are
+      constructed once and shared by all points. Only dependencies of
+      classes using CMConstructionMixin are shared, cls itself does not
+      need it. Shared dependencies must not be modified afterwards.
+    batchHashTags
+      - True (default): the hash tags of all instances and dependencies
+      are computed in one batched pass, see compman.cacheHashTags()
+    '''
+    if kwargs is None:
+        kwargs = {}
+    initArgNames = set(_getInitArgNames(cls))
+    managers = []
+    with sharedConstruction(deferHashing=batchHashTags) if shareDependencies else _noContext():
+        for point in points:
+            manKwargs = dict(kwargs)
+            overrides = []
+            for (name,value) in point.items():
+                if name in initArgNames:
+                    manKwargs[name] = value
+                else:
+                    overrides.append((name,value))
+            man = constructShared(cls,*args,**manKwargs)
+            if overrides:
+                man.ensureConfigured()
+            for (name,value) in overrides:
+                if name in man.cmExConfigDict:
+                    man.cmExConfigDict[name] = value
+                else:
+                    man.cmConfigDict[name] = value
+            managers.append(man)
+    if batchHashTags:
+        cacheHashTags(managers)
+    return managers
+
+# --------------------
+def _getInitArgNames(cls):
+    '''
+    Internal function
+    '''
+    try:
+        getArgSpec = inspect.getfullargspec
+    except AttributeError:
+        getArgSpec = inspect.getargspec
+    try:
+        return getArgSpec(cls.__init__).args
+    except TypeError:
+        return []
+
+class _noContext(object):
+    '''
+    Internal class
+    Context manager that does nothing.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,excTraceback):
+        pass
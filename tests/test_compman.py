@@ -0,0 +1,371 @@
+'''
+Tests of compman core: hashing, configuration and attribute access.
+Run from the repository root: python -m unittest discover -s tests -t .
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import types
+import pickle
+import threading
+import unittest
+
+import numpy as np
+
+from compman import *
+from compman import _valueDigestCache
+
+# --------------------
+class _LeafMan(CompMan):
+    def __init__(self,value):
+        CompMan.__init__(self,'leaf','test_compman_LeafMan','leafparam')
+        self.value = value
+        self.configure(self.cmMetaParam)
+
+    def configure_leafparam(self):
+        self.setConfig('leafValue',self.value)
+
+class _RootMan(CompMan):
+    def __init__(self,leaf,cmHashMode='legacy'):
+        CompMan.__init__(self,'root','test_compman_RootMan','rootparam')
+        self.cmHashMode = cmHashMode
+        self.leaf = leaf
+        self.configure(self.cmMetaParam)
+
+    def configure_rootparam(self):
+        self.cmConfigDict['dep']   = self.leaf
+        self.cmConfigDict['field'] = 1
+
+class _DigestLeafMan(_LeafMan):
+    cmDigestValues = True
+
+class _BaselineStrLeafMan(_LeafMan):
+    '''
+    Overrides __str__() with the signature of earlier CompMan versions.
+    '''
+    def __str__(self,includeHashTag=True,includeExtraConfig=True):
+        return 'custom leaf {0}'.format(self.value)
+
+class _BaselineHashStringLeafMan(_LeafMan):
+    '''
+    Overrides generateHashString() with the signature of earlier
+    CompMan versions.
+    '''
+    def generateHashString(self,includeExtraConfig):
+        return 'custom hash string {0}'.format(self.value)
+
+class _BaselineHashTagLeafMan(_LeafMan):
+    '''
+    Overrides getHashTag() with the signature of earlier CompMan
+    versions.
+    '''
+    def getHashTag(self,includeExtraConfig):
+        return 'tag{0}'.format(self.value)
+
+class _CustomHashLeafMan(_LeafMan):
+    '''
+    Overrides hashOnString().
+    '''
+    def hashOnString(self,string,alg='djb2'):
+        return 'custom{0}'.format(len(string))
+
+def _loopHash(string,seed,mult,modulus,width):
+    '''
+    Per-character djb2/sdbm loop of earlier CompMan versions.
+    '''
+    hashnum = seed
+    for c in string:
+        hashnum = (hashnum * mult + ord(c)) % modulus
+    return '{0:0{1}}'.format(hashnum,width)
+
+# --------------------
+class HashBackendTest(unittest.TestCase):
+    strings = ['','a','hello world','x' * 5000,'<TemplateMan>\nTemplateMan,cmDesc,foo\n' * 300]
+
+    def test_polynomial_matches_loop(self):
+        for (alg,params) in (('djb2',(5381,33,2**32-1,10)),('short',(5381,33,2**16-1,5)),
+                             ('sdbm',(0,65599,2**32-1,10))):
+            expected = [_loopHash(string,*params) for string in self.strings]
+            self.assertEqual([hashOnString(string,alg) for string in self.strings],expected)
+            self.assertEqual(hashMany(self.strings,alg),expected)
+
+    def test_hashMany_and_hashRows(self):
+        for alg in hashBackends:
+            self.assertEqual(hashMany(self.strings,alg),[hashOnString(string,alg) for string in self.strings])
+            rows = ['row{}'.format(i) for i in range(1000)]
+            self.assertEqual(hashRows(iter(rows),alg),hashOnString('\n'.join(rows),alg))
+        self.assertEqual(hashMany([]),[])
+        self.assertEqual(len(hashOnString('abc','sha256')),64)
+
+    def test_register(self):
+        class _LengthBackend(HashBackend):
+            def hash(self,string):
+                return str(len(string))
+        registerHashBackend(_LengthBackend('test_length'))
+        try:
+            leaf = _LeafMan(1)
+            leaf.cmHashAlg = 'test_length'
+            self.assertEqual(leaf.getHashTag(True),str(len(leaf.generateHashString(True))))
+        finally:
+            del hashBackends['test_length']
+        self.assertRaises(Exception,hashOnString,'abc','test_length')
+
+class HashModeTest(unittest.TestCase):
+    def test_legacy(self):
+        leaf = _LeafMan(1)
+        root = _RootMan(leaf,'legacy')
+        hashString = root.generateHashString(True)
+        self.assertIn('_LeafMan,leafValue,1',hashString)
+        self.assertIn('_LeafMan,cmHashTag,{}'.format(leaf.getHashTag(True)),hashString)
+        self.assertEqual(root.getHashTag(True),hashOnString(hashString))
+
+    def test_merkle(self):
+        leaf = _LeafMan(1)
+        root = _RootMan(leaf,'merkle')
+        hashString = root.generateHashString(True)
+        self.assertNotIn('leafValue',hashString)
+        self.assertIn('_LeafMan,cmHashTag,{}'.format(leaf.getHashTag(True)),hashString)
+        self.assertEqual(root.getHashTag(True),hashOnString(hashString))
+        self.assertNotEqual(root.getHashTag(True),_RootMan(_LeafMan(1),'legacy').getHashTag(True))
+        self.assertNotEqual(root.getHashTag(True),_RootMan(_LeafMan(2),'merkle').getHashTag(True))
+
+    def test_merkle_string_size(self):
+        lengths = {}
+        for cmHashMode in ('legacy','merkle'):
+            man = _LeafMan(0)
+            for depth in range(6):
+                man = _RootMan(man,cmHashMode)
+                lengths.setdefault(cmHashMode,[]).append(len(man.generateHashString(True)))
+        self.assertEqual(len(set(lengths['merkle'])),1)
+        self.assertLess(lengths['legacy'][0],lengths['legacy'][-1])
+
+    def test_shared_dependency(self):
+        leaf   = _LeafMan(1)
+        shared = _RootMan(leaf,'merkle')
+        root   = _RootMan([shared,_RootMan(shared,'merkle'),shared],'merkle')
+        self.assertEqual(root.getHashTag(True),hashOnString(root.generateHashString(True)))
+        self.assertEqual(root.getDependencies(),[shared,root.dep[1]])
+
+class InvalidationTest(unittest.TestCase):
+    def test_config_change(self):
+        leaf   = _LeafMan(1)
+        middle = _RootMan(leaf)
+        root   = _RootMan(middle)
+        oldTags = [man.getHashTag(True) for man in (leaf,middle,root)]
+        leaf.cmConfigDict['leafValue'] = 2
+        self.assertIsNone(root.cmHashTagWithExtraConfig)
+        newTags = [man.getHashTag(True) for man in (leaf,middle,root)]
+        self.assertEqual(newTags,[man.getHashTag(True) for man in (_LeafMan(2),_RootMan(_LeafMan(2)),
+                                                                   _RootMan(_RootMan(_LeafMan(2))))])
+        self.assertTrue(all(old != new for (old,new) in zip(oldTags,newTags)))
+        self.assertEqual(leaf.getDependents(),[middle])
+
+    def test_attribute_and_extra_config_change(self):
+        leaf = _LeafMan(1)
+        root = _RootMan(leaf)
+        tags = (root.getHashTag(True),root.getHashTag(False))
+        leaf.cmExConfigDict['extra'] = 1
+        self.assertNotEqual(root.getHashTag(True),tags[0])
+        self.assertEqual(root.getHashTag(False),tags[1])
+        tags = (root.getHashTag(True),root.getHashTag(False))
+        leaf.setMetaParam('other')
+        self.assertNotEqual(root.getHashTag(True),tags[0])
+
+    def test_replaced_dependency(self):
+        (oldLeaf,newLeaf) = (_LeafMan(1),_LeafMan(2))
+        root = _RootMan(oldLeaf)
+        root.cmConfigDict['dep'] = newLeaf
+        self.assertEqual(oldLeaf.getDependents(),[])
+        tag = root.getHashTag(True)
+        oldLeaf.cmConfigDict['leafValue'] = 3
+        self.assertEqual(root.cmHashTagWithExtraConfig,tag)
+        newLeaf.cmConfigDict['leafValue'] = 3
+        self.assertIsNone(root.cmHashTagWithExtraConfig)
+
+class AttributeAccessTest(unittest.TestCase):
+    def test_config_attributes(self):
+        leaf = _LeafMan(1)
+        self.assertEqual(leaf.leafValue,1)
+        leaf.cmConfigDict['leafValue'] = 2
+        self.assertEqual(leaf.leafValue,2)
+        leaf.setExConfig('extra',3)
+        self.assertEqual(leaf.extra,3)
+        del leaf.cmExConfigDict['extra']
+        self.assertRaises(AttributeError,getattr,leaf,'extra')
+        self.assertRaises(AttributeError,getattr,leaf,'missing')
+
+    def test_duplicate_names(self):
+        leaf = _LeafMan(1)
+        self.assertRaises(CMDuplicateNameError,leaf.setConfig,'value',1) # instance attribute
+        self.assertRaises(CMDuplicateNameError,leaf.setConfig,'getHashTag',1) # method
+        self.assertRaises(CMDuplicateNameError,leaf.setExConfig,'leafValue',1)
+        self.assertEqual(leaf.getSep(),'.')
+
+    def test_config_first_mixin(self):
+        class _ConfigFirstLeafMan(CMConfigFirstMixin,_LeafMan):
+            pass
+        leaf = _ConfigFirstLeafMan(4)
+        self.assertEqual((leaf.leafValue,leaf.value,leaf.getMetaParam()),(4,4,'leafparam'))
+
+class ValueDigestTest(unittest.TestCase):
+    def test_large_arrays(self):
+        (a,b) = (np.zeros(10000),np.zeros(10000))
+        b[5000] = 1 # hidden by the '...' of str()
+        self.assertEqual(_LeafMan(a).getHashTag(True),_LeafMan(b).getHashTag(True))
+        self.assertNotEqual(_DigestLeafMan(a).getHashTag(True),_DigestLeafMan(b).getHashTag(True))
+        self.assertEqual(_DigestLeafMan(a).getHashTag(True),_DigestLeafMan(a.copy()).getHashTag(True))
+
+    def test_array_metadata(self):
+        a = np.arange(6,dtype=np.int32)
+        digests = [getValueDigest(val) for val in (a,a.reshape(2,3),a.view(np.float32),a[::2])]
+        self.assertEqual(len(set(digests)),4)
+        self.assertTrue(digests[1].startswith('<ndarray <i4 2x3>'))
+        self.assertEqual(getValueDigest(a[::2]),getValueDigest(a[::2].copy())) # non-contiguous
+        self.assertIsNone(getValueDigest(np.array([None,1])))
+        self.assertIsNone(getValueDigest([1,2]))
+
+    def test_bytearray(self):
+        data = bytearray(b'abc')
+        digest = getValueDigest(data)
+        self.assertTrue(digest.startswith('<bytearray 3>'))
+        data[0] = ord('x')
+        self.assertNotEqual(getValueDigest(data),digest) # writable values are not cached
+
+    def test_read_only_cache(self):
+        a = np.arange(3)
+        a.flags.writeable = False
+        digest = getValueDigest(a)
+        self.assertEqual(_valueDigestCache[id(a)][1],digest)
+        key = id(a)
+        del a
+        self.assertNotIn(key,_valueDigestCache)
+
+    def test_registered_hasher(self):
+        class Point(object):
+            def __init__(self,x):
+                self.x = x
+        registerValueHasher(Point,lambda val: '<Point {0}>'.format(val.x))
+        try:
+            self.assertEqual(_DigestLeafMan(Point(1)).getHashTag(True),_DigestLeafMan(Point(1)).getHashTag(True))
+            self.assertNotEqual(_DigestLeafMan(Point(1)).getHashTag(True),_DigestLeafMan(Point(2)).getHashTag(True))
+        finally:
+            del valueHashers[Point]
+
+class ConfigRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_rows_match_str(self):
+        man = TestMan('testparam',self.tempDir)
+        self.assertIsInstance(man.iterConfigRows(),types.GeneratorType)
+        for includeHashTag in (True,False):
+            for includeExtraConfig in (True,False):
+                self.assertEqual('\n'.join(man.iterConfigRows(includeHashTag,includeExtraConfig)),
+                                 man.__str__(includeHashTag,includeExtraConfig))
+        self.assertEqual(next(man.iterConfigRows()),'<TestMan>')
+        self.assertEqual(man.__str__(includeConfig=False).count('\n'),5) # header, 4 attributes, hash tag
+
+    def test_config_csv_file(self):
+        man = TestMan('testparam',self.tempDir)
+        man.saveConfigCSVFile()
+        with open(man.getConfigCSVFilePath()) as f:
+            self.assertEqual(f.read(),man.generateHashString(True))
+        self.assertEqual([name for name in os.listdir(man.getOutputPath()) if '.tmp' in name],[])
+        man.cmConfigDict['field1'] = 101 # new hash tag, new file
+        man.saveConfigCSVFile()
+        with open(man.getConfigCSVFilePath()) as f:
+            self.assertIn('TestMan,field1,101',f.read())
+
+class BaselineOverrideTest(unittest.TestCase):
+    '''
+    Child classes overriding hashing methods with the signatures of
+    earlier CompMan versions (without memo) still hash.
+    '''
+    def test_str_override(self):
+        for cmHashMode in ('legacy','merkle'):
+            leaf = _BaselineStrLeafMan(1)
+            root = _RootMan(leaf,cmHashMode)
+            self.assertEqual(leaf.getHashTag(False),leaf.hashOnString('custom leaf 1'))
+            self.assertIn('custom leaf 1',root.generateHashString(False))
+            self.assertNotEqual(root.getHashTag(False),_RootMan(_BaselineStrLeafMan(2),cmHashMode).getHashTag(False))
+
+    def test_generateHashString_override(self):
+        leaf = _BaselineHashStringLeafMan(1)
+        root = _RootMan(leaf,'merkle')
+        self.assertEqual(leaf.getHashTag(True),leaf.hashOnString('custom hash string 1'))
+        self.assertEqual(len(root.getHashTag(True)),len(_RootMan(_LeafMan(1)).getHashTag(True)))
+
+    def test_getHashTag_override(self):
+        leaf = _BaselineHashTagLeafMan(3)
+        root = _RootMan(leaf)
+        self.assertIn('cmHashTag,tag3',root.generateHashString(False))
+        leaf.cacheHashTag()
+        root.cacheHashTag()
+        cacheHashTags([_RootMan(_BaselineHashTagLeafMan(4))])
+
+    def test_cacheHashTags_matches_getHashTag(self):
+        roots = [_RootMan(_BaselineStrLeafMan(i)) for i in range(3)]
+        expected = [_RootMan(_BaselineStrLeafMan(i)).getHashTag(True) for i in range(3)]
+        cacheHashTags(roots)
+        self.assertEqual([root.getHashTag(True) for root in roots],expected)
+
+class CacheHashTagsTest(unittest.TestCase):
+    def test_matches_getHashTag(self):
+        for cmHashMode in ('legacy','merkle'):
+            with sharedConstruction(): # hash tags left to cacheHashTags()
+                roots = [_RootMan(_LeafMan(i),cmHashMode) for i in range(5)]
+            self.assertIsNone(roots[0].cmHashTagWithExtraConfig)
+            expected = [[man.getHashTag(includeExtraConfig) for man in (_RootMan(_LeafMan(i),cmHashMode),_LeafMan(i))
+                         for includeExtraConfig in (True,False)] for i in range(5)]
+            cacheHashTags(roots)
+            self.assertEqual([[man.cmHashTagWithExtraConfig if includeExtraConfig else man.cmHashTagWithoutExtraConfig
+                               for man in (root,root.leaf) for includeExtraConfig in (True,False)] for root in roots],
+                             expected)
+
+    def test_hashOnString_override(self):
+        with sharedConstruction():
+            roots = [_RootMan(_CustomHashLeafMan(i)) for i in (1,22)]
+        cacheHashTags(roots)
+        for (i,root) in zip((1,22),roots):
+            leaf = _CustomHashLeafMan(i)
+            self.assertTrue(root.leaf.cmHashTagWithExtraConfig.startswith('custom'))
+            self.assertEqual(root.leaf.cmHashTagWithExtraConfig,leaf.getHashTag(True))
+            self.assertEqual(root.cmHashTagWithExtraConfig,_RootMan(leaf).getHashTag(True))
+
+class LazyDependencyTest(unittest.TestCase):
+    def test_resolves_once(self):
+        calls = []
+        def factory(value):
+            calls.append(value)
+            time.sleep(0.01)
+            return None
+        lazy = LazyDependency(factory,5)
+        self.assertFalse(lazy.isResolved())
+        threads = [threading.Thread(target=lazy.resolve) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIsNone(lazy.resolve())
+        self.assertTrue(lazy.isResolved())
+        self.assertEqual(calls,[5])
+
+    def test_pickle(self):
+        lazy = pickle.loads(pickle.dumps(LazyDependency(_LeafMan,7),pickle.HIGHEST_PROTOCOL))
+        self.assertFalse(lazy.isResolved())
+        self.assertEqual(lazy.resolve().value,7)
+
+    def test_config_value(self):
+        lazy = LazyDependency(_LeafMan,1)
+        root = _RootMan(lazy)
+        self.assertEqual(root.getHashTag(True),_RootMan(_LeafMan(1)).getHashTag(True))
+        self.assertTrue(lazy.isResolved())
+        self.assertIs(root.dep,lazy.resolve())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+'''
+Tests of compman_artifact.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from compman import *
+from compman_cache import ResultCache
+import compman_artifact
+from compman_artifact import *
+
+# --------------------
+class _ArtifactMan(CompMan):
+    '''
+    Child class implementing computeOutput(), counting its calls.
+    '''
+    numComputed = 0
+
+    def __init__(self,value,cmBasePath,artifactStore):
+        CompMan.__init__(self,'artifact','test_compman_artifact_ArtifactMan','artifactparam',cmBasePath=cmBasePath)
+        self.cmArtifactStore = artifactStore
+        self.cmResultCache   = ResultCache()
+        self.value = value
+        self.configure(self.cmMetaParam)
+
+    def configure_artifactparam(self):
+        self.cmConfigDict['artifactValue'] = self.value
+
+    def computeOutput(self):
+        _ArtifactMan.numComputed += 1
+        return 'output {}'.format(self.cmConfigDict['artifactValue'])
+
+# --------------------
+class ArtifactStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        _ArtifactMan.numComputed = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def checkShared(self,store):
+        first = _ArtifactMan(1,os.path.join(self.tempDir,'host1'),store)
+        self.assertEqual(first.getOutput(),'output 1')
+        self.assertTrue(store.has(first.getTagPrefix(True)))
+        second = _ArtifactMan(1,os.path.join(self.tempDir,'host2'),store)
+        self.assertEqual(second.getOutput(),'output 1')
+        self.assertEqual(_ArtifactMan.numComputed,1)
+        self.assertTrue(second.outputExists('complete'))
+        self.assertFalse(publishOutput(second,store))
+
+    def test_local_store(self):
+        self.checkShared(LocalArtifactStore(os.path.join(self.tempDir,'store')))
+
+    def test_http_store(self):
+        server = startArtifactServer(os.path.join(self.tempDir,'store'))
+        try:
+            self.checkShared(HTTPArtifactStore(server.getURL()))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def checkRecomputed(self,store,man):
+        '''
+        getOutput() of man, whose artifact in store is invalid, computes
+        its output, warns and replaces the artifact.
+        '''
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(man.getOutput(),'output 1')
+        self.assertEqual([warning.category for warning in caught],[ArtifactWarning])
+        self.assertEqual(_ArtifactMan.numComputed,2)
+        self.assertEqual([name for name in os.listdir(man.getOutputPath()) if name.startswith('extra')],[])
+        other = _ArtifactMan(1,os.path.join(self.tempDir,'host3'),store) # republished
+        self.assertEqual(other.getOutput(),'output 1')
+        self.assertEqual(_ArtifactMan.numComputed,2)
+
+    def test_corrupt_archive(self):
+        store = LocalArtifactStore(os.path.join(self.tempDir,'store'))
+        first = _ArtifactMan(1,os.path.join(self.tempDir,'host1'),store)
+        first.getOutput()
+        with open(store.getPath(first.getTagPrefix(True)),'r+b') as f:
+            f.seek(20)
+            f.write(b'corrupt')
+        self.checkRecomputed(store,_ArtifactMan(1,os.path.join(self.tempDir,'host2'),store))
+
+    def test_partial_extraction(self):
+        store = LocalArtifactStore(os.path.join(self.tempDir,'store'))
+        _ArtifactMan(1,os.path.join(self.tempDir,'host1'),store).getOutput()
+        man = _ArtifactMan(1,os.path.join(self.tempDir,'host2'),store)
+        man.makeOutputPath()
+        blockingPath = man.getCompleteFilePath() # extracted last, cannot replace a directory
+        os.mkdir(blockingPath)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertFalse(fetchOutput(man))
+        self.assertEqual([warning.category for warning in caught],[ArtifactWarning])
+        self.assertEqual(os.listdir(man.getOutputPath()),[os.path.basename(blockingPath)]) # extracted files removed
+        self.assertTrue(store.has(man.getTagPrefix(True))) # local error, artifact kept
+        os.rmdir(blockingPath)
+        self.assertTrue(fetchOutput(man))
+        self.assertEqual(man.getOutput(),'output 1')
+        self.assertEqual(_ArtifactMan.numComputed,1)
+
+    def test_http_discard(self):
+        server = startArtifactServer(os.path.join(self.tempDir,'store'))
+        try:
+            store = HTTPArtifactStore(server.getURL())
+            man   = _ArtifactMan(1,os.path.join(self.tempDir,'host1'),store)
+            man.getOutput()
+            store.discard(man.getTagPrefix(True))
+            self.assertFalse(store.has(man.getTagPrefix(True)))
+            self.assertEqual(os.listdir(os.path.join(self.tempDir,'store')),[])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_file_regex(self):
+        tagPrefix = 'artifact.code.param.123'
+        regex = getArtifactFileRegex(tagPrefix)
+        self.assertIs(getArtifactFileRegex(tagPrefix),regex)
+        for fileName in ('compman_config.{}.csv','compman_complete.{}','compman_result.{}.pkl'):
+            self.assertTrue(regex.match(fileName.format(tagPrefix)),fileName)
+        for fileName in ('compman_lock.{}.lock','compman_result.{}.pkl.tmp12','compman_result.{}4.pkl'):
+            self.assertFalse(regex.match(fileName.format(tagPrefix)),fileName)
+
+    def test_file_regex_cache_bounded(self):
+        for i in range(2 * compman_artifact.maxArtifactFileRegexes):
+            getArtifactFileRegex('artifact.code.param.{}'.format(i))
+        self.assertEqual(len(compman_artifact._artifactFileRegexes),compman_artifact.maxArtifactFileRegexes)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+'''
+Tests of compman_bench.
+'''
+
+import copy
+import unittest
+
+from compman import *
+from compman_bench import *
+
+# --------------------
+class SyntheticGraphTest(unittest.TestCase):
+    def test_graph(self):
+        (root,nodes) = buildSyntheticGraph(depth=2,fanout=2,sharing=0.0,nConfig=3)
+        self.assertEqual(len(nodes),1 + 2 + 4)
+        self.assertEqual(len(root.getDependencies()),2)
+        self.assertEqual((root.getConfigDict()['level'],root.getConfigDict()['index']),(2,0))
+        self.assertEqual((root.level,root.index),(2,0))
+        self.assertRaises(CMDuplicateNameError,root.setConfig,'graph',None)
+
+    def test_sharing(self):
+        (root,nodes) = buildSyntheticGraph(depth=3,fanout=3,sharing=0.9)
+        self.assertLess(len(nodes),1 + 3 + 9 + 27)
+
+class RunBenchmarksTest(unittest.TestCase):
+    def test_report(self):
+        report = runBenchmarks(depths=(1,),fanouts=(2,),sharings=(0.0,),hashModes=('merkle',),repeat=1,attributeNumber=10)
+        self.assertEqual(len(report['graphs']),1)
+        self.assertEqual(report['graphs'][0]['results']['nodes'],3)
+        self.assertIn('fast.config',report['attributes'])
+        self.assertIn('construct',formatReport(report))
+        self.assertEqual(compareReports(report,report),[])
+        slower = copy.deepcopy(report)
+        slower['graphs'][0]['results']['construct'] = 10.0 * max(report['graphs'][0]['results']['construct'],1.0)
+        self.assertEqual([name for (name,oldValue,value) in compareReports(report,slower)],
+                         ['depth=1,fanout=2,hashMode=merkle,nConfig=10,sharing=0.0 construct'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+'''
+Tests of compman_cache.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_cache import *
+
+# --------------------
+class _CachedMan(CompMan):
+    '''
+    Child class implementing computeOutput(), counting its calls.
+    '''
+    numComputed = 0
+
+    def __init__(self,value,cmBasePath,resultCache):
+        CompMan.__init__(self,'cached','test_compman_cache_CachedMan','cachedparam',cmBasePath=cmBasePath)
+        self.cmResultCache = resultCache
+        self.value = value
+        self.configure(self.cmMetaParam)
+
+    def configure_cachedparam(self):
+        self.cmConfigDict['cachedValue'] = self.value
+
+    def computeOutput(self):
+        _CachedMan.numComputed += 1
+        return b'x' * (100 * self.cmConfigDict['cachedValue'])
+
+# --------------------
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        _CachedMan.numComputed = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_tiers(self):
+        cache = ResultCache()
+        man   = _CachedMan(1,self.tempDir,cache)
+        self.assertEqual(man.getOutput(),b'x' * 100)
+        self.assertEqual(man.getOutput(),b'x' * 100)
+        self.assertEqual(_CachedMan.numComputed,1)
+        self.assertEqual(cache.stats['memoryHits'],1)
+        self.assertTrue(man.outputExists('complete'))
+        self.assertFalse(os.path.exists(man.getComputeLockPath()))
+        otherCache = ResultCache()
+        self.assertEqual(_CachedMan(1,self.tempDir,otherCache).getOutput(),b'x' * 100)
+        self.assertEqual((_CachedMan.numComputed,otherCache.stats['diskHits']),(1,1))
+
+    def test_memory_eviction(self):
+        cache    = ResultCache(memoryBudget=250,diskBudget=0)
+        managers = [_CachedMan(1,self.tempDir,cache),_CachedMan(2,self.tempDir,cache)]
+        for man in managers:
+            man.getOutput() # evicts value 1 (lru)
+        self.assertEqual((cache.getMemoryUsage(),cache.stats['memoryEvictions']),(200,1))
+        managers[0].getOutput() # computed again, evicts value 2
+        self.assertEqual((cache.getMemoryUsage(),cache.stats['memoryEvictions']),(100,2))
+        self.assertEqual(_CachedMan.numComputed,3)
+        self.assertFalse(managers[0].outputExists())
+
+    def test_disk_eviction(self):
+        cache    = ResultCache(diskBudget=600) # pickled sizes: a bit over 100, 200, 300
+        managers = [_CachedMan(i,self.tempDir,cache) for i in (1,2,3)]
+        for man in managers:
+            man.getOutput()
+        self.assertEqual(cache.stats['diskEvictions'],1)
+        self.assertFalse(os.path.exists(cache.getResultFilePath(managers[0])))
+        self.assertEqual([man.getOutputStatus() for man in managers],['configured','complete','complete'])
+
+    def test_lock_options(self):
+        lockOptions = {'staleTimeout':60.0}
+        cache = ResultCache(lockOptions=lockOptions)
+        lockOptions['timeout'] = 0.0
+        self.assertEqual(cache.lockOptions,{'staleTimeout':60.0})
+        self.assertEqual(ResultCache().lockOptions,{})
+        self.assertIsNot(ResultCache().lockOptions,ResultCache().lockOptions)
+        self.assertIsNone(ResultCache(computeLock=False).lockOptions)
+        man = _CachedMan(1,self.tempDir,cache)
+        man.makeOutputPath()
+        with man.getComputeLock():
+            self.assertEqual(_CachedMan(1,self.tempDir,ResultCache(computeLock=False)).getOutput(),b'x' * 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+'''
+Tests of compman_catalog.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_catalog import *
+
+# --------------------
+class _CatalogMan(CompMan):
+    def __init__(self,value,cmBasePath):
+        CompMan.__init__(self,'catalog','test_compman_catalog_CatalogMan','catalogparam',cmBasePath=cmBasePath)
+        self.value = value
+        self.configure(self.cmMetaParam)
+
+    def configure_catalogparam(self):
+        self.cmConfigDict['catalogValue'] = self.value
+
+# --------------------
+class OutputCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_statusFileRegex(self):
+        prefix = 'catalog.code.param.123456'
+        self.assertEqual(statusFileRegex.match('compman_config.{}.csv'.format(prefix)).groups(),('config',prefix))
+        self.assertEqual(statusFileRegex.match('compman_complete.{}'.format(prefix)).groups(),('complete',prefix))
+        for fileName in ('compman_config.{}.csv.tmp123'.format(prefix),
+                         'compman_complete.{}.tmp123.456'.format(prefix),
+                         'compman_lock.{}.lock'.format(prefix)):
+            self.assertIsNone(statusFileRegex.match(fileName),fileName)
+
+    def test_scan(self):
+        managers = [_CatalogMan(i,self.tempDir) for i in range(4)]
+        managers[0].makeOutputPath()
+        managers[1].saveConfigCSVFile()
+        managers[2].saveConfigCSVFile()
+        managers[2].markOutputComplete()
+        managers[3].makeOutputPath()
+        with open(managers[3].getConfigCSVFilePath() + '.tmp123','w') as f:
+            f.write('partial')
+        catalog = OutputCatalog(self.tempDir)
+        catalog.scan()
+        expected = ['created','configured','complete','created']
+        self.assertEqual(catalog.getStatusMany(managers),expected)
+        self.assertEqual([man.getOutputStatus() for man in managers],expected)
+        self.assertEqual(sorted(prefix for (relPath,prefix) in catalog.outputs),
+                         sorted(man.getTagPrefix(True) for man in managers[1:3]))
+        self.assertEqual(catalog.existsMany(managers,'configured'),[False,True,True,False])
+        self.assertEqual(catalog.findByHashTag(managers[2].getHashTag(True)),[managers[2].getOutputPath()])
+        catalog.close()
+
+    def test_attached(self):
+        catalog = openOutputCatalog(self.tempDir)
+        try:
+            man = _CatalogMan(1,self.tempDir)
+            self.assertEqual(man.getOutputStatus(),'missing')
+            man.saveConfigCSVFile()
+            self.assertEqual(man.getOutputStatus(),'configured')
+            self.assertEqual(OutputCatalog(self.tempDir).getStatus(man),'configured') # from the index file
+        finally:
+            catalog.close()
+
+class ConfigCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def makeManagers(self):
+        managers = [TestMan('testparam',self.tempDir) for i in range(3)]
+        for (i,man) in enumerate(managers):
+            man.cmConfigDict['field1'] = i
+            man.saveConfigCSVFile()
+        return managers
+
+    def test_ingest(self):
+        managers = self.makeManagers()
+        catalog  = openConfigCatalog(self.tempDir)
+        self.assertEqual(len(catalog),3)
+        self.assertEqual(catalog.ingest(),0) # unchanged files are skipped
+        self.assertEqual(catalog.findConfigFiles({'field1':1}),[os.path.abspath(managers[1].getConfigCSVFilePath())])
+        self.assertEqual(len(catalog.findConfigFiles({'field2':200,'templateMan1.cmMetaParam':'p1'},
+                                                     className='TestMan')),3)
+        self.assertEqual(len(catalog.findConfigFiles(depHashTag=managers[0].templateMan2.getHashTag(True))),3)
+        self.assertEqual(catalog.findConfigFiles(hashTag=managers[2].getHashTag(True)),
+                         [os.path.abspath(managers[2].getConfigCSVFilePath())])
+        self.assertEqual(catalog.findOutputPaths(metaParam='other'),[])
+        config = catalog.getConfig(managers[0].getConfigCSVFilePath())
+        self.assertEqual((config['field1'],config['templateMan1']),('0',managers[0].templateMan1.getHashTag(True)))
+        os.remove(managers[0].getConfigCSVFilePath())
+        catalog.ingest()
+        self.assertEqual(catalog.findConfigFiles({'field1':0}),[])
+        catalog.close()
+
+    def test_parseConfigString(self):
+        man = TestMan('testparam',self.tempDir)
+        man.cmConfigDict['field3'] = 'two\nlines'
+        (values,deps) = parseConfigString(man.generateHashString(True))
+        values = dict(values)
+        self.assertEqual(values['field3'],'two\nlines')
+        self.assertEqual(values['templateMan3'],man.templateMan3.getHashTag(True))
+        self.assertEqual(deps['templateMan2'][1]['cmMetaParam'],'p2')
+        self.assertEqual(deps[''][0],'TestMan')
+        self.assertRaises(ValueError,parseConfigString,'not a config')
+
+if __name__ == '__main__':
+    unittest.main()
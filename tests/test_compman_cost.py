@@ -0,0 +1,95 @@
+'''
+Tests of compman_cost.
+'''
+
+import shutil
+import pickle
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from compman import *
+from compman_cost import *
+from compman_exec import DAGExecutor
+
+# --------------------
+class _CostMan(CompMan):
+    '''
+    Node whose cost estimates are keyed by its metaparameter.
+    '''
+    def __init__(self,cmMetaParam,deps,cmBasePath):
+        CompMan.__init__(self,'cost','test_compman_cost_CostMan',cmMetaParam,cmBasePath=cmBasePath)
+        self.deps = list(deps)
+        self.configure(self.cmMetaParam)
+
+    def configureNode(self):
+        for (index,dep) in enumerate(self.deps):
+            self.cmConfigDict['dep{0}'.format(index)] = dep
+
+    configure_a = configure_b = configure_c = configure_d = configureNode
+
+    def computeOutput(self):
+        return [dep.getOutput() for dep in self.deps] + [self.cmMetaParam]
+
+# --------------------
+class CostTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.history = CostHistory(self.tempDir,window=2,defaultTime=3.0)
+        a = _CostMan('a',[],self.tempDir)
+        (b,c) = (_CostMan('b',[a],self.tempDir),_CostMan('c',[a],self.tempDir))
+        self.managers = (a,b,c,_CostMan('d',[b,c],self.tempDir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def recordTimes(self,times):
+        for (man,wallTime) in zip(self.managers,times):
+            self.history.record(man,wallTime,peakMemory=100 * wallTime,outputSize=10)
+
+    def test_estimates(self):
+        (a,b,c,d) = self.managers
+        self.assertEqual(self.history.getEstimate(a),(3.0,0,0,0))
+        for wallTime in (10.0,1.0,2.0):
+            self.history.record(a,wallTime,peakMemory=int(wallTime))
+        self.assertEqual(self.history.getEstimate(a),(1.5,2,0,2)) # last window runs, largest memory
+        other = _CostMan('a',[b],self.tempDir) # same code tag and metaparameter
+        self.assertEqual(self.history.getEstimate(other),(1.5,2,0,2))
+        self.assertEqual(self.history.getEstimate(b),(1.5,2,0,2)) # same code tag only
+        copy = pickle.loads(pickle.dumps(self.history,pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.getEstimate(a),(1.5,2,0,2))
+
+    def test_upward_ranks(self):
+        nodes = OrderedDict((tagPrefix,None) for tagPrefix in 'abcd')
+        deps  = {'a':[],'b':['a'],'c':['a'],'d':['b','c']}
+        ranks = getUpwardRanks(nodes,deps,{'a':1.0,'b':5.0,'c':2.0,'d':1.0})
+        self.assertEqual(ranks,{'a':7.0,'b':6.0,'c':3.0,'d':1.0})
+
+    def test_plan(self):
+        (a,b,c,d) = self.managers
+        self.recordTimes((1.0,5.0,2.0,1.0))
+        plan = planGraph(d,self.history,numWorkers=2)
+        self.assertEqual((plan['numNodes'],plan['numToRun'],plan['totalTime']),(4,4,9.0))
+        self.assertEqual(plan['criticalPath'],[man.getTagPrefix(True) for man in (a,b,d)])
+        self.assertEqual((plan['criticalPathTime'],plan['makespan'],plan['peakMemory']),(7.0,7.0,500))
+        self.assertEqual(planGraph(d,self.history,numWorkers=1)['makespan'],9.0)
+        self.assertEqual(planGraph(d,self.history,numWorkers=2,memoryLimit=600)['makespan'],9.0) # b and c one after the other
+        a.getOutput()
+        plan = planGraph(d,self.history,numWorkers=2)
+        self.assertFalse(plan['nodes'][a.getTagPrefix(True)]['run'])
+        self.assertEqual((plan['numToRun'],plan['totalTime'],plan['criticalPath']),
+                         (3,8.0,[b.getTagPrefix(True),d.getTagPrefix(True)]))
+        self.assertIn('critical path:',formatPlan(plan))
+
+    def test_executor_records(self):
+        (a,b,c,d) = self.managers
+        results = DAGExecutor(numWorkers=2,costHistory=self.history).run(d)
+        self.assertEqual(results[d.getTagPrefix(True)].value,[[['a'],'b'],[['a'],'c'],'d'])
+        self.history.reload()
+        self.assertEqual(self.history.getEstimate(b)[3],1)
+        DAGExecutor(numWorkers=2,costHistory=self.history).run(d) # complete: loaded, not recorded
+        self.history.reload()
+        self.assertEqual(self.history.getEstimate(b)[3],1)
+        (value,wallTime,peakMemory) = measureCall(sum,[1,2])
+        self.assertEqual(value,3)
+        self.assertGreaterEqual(wallTime,0.0)
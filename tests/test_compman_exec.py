@@ -0,0 +1,81 @@
+'''
+Tests of compman_exec.
+'''
+
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_exec import *
+
+# --------------------
+class _SumNodeMan(CompMan):
+    '''
+    Node whose output is its value plus the outputs of its
+    dependencies, counting its calls. Fails if its value is negative.
+    '''
+    numComputed = {} # node value -> number of computeOutput() calls
+
+    def __init__(self,value,deps,cmBasePath):
+        CompMan.__init__(self,'sumnode','test_compman_exec_SumNodeMan','nodeparam',cmBasePath=cmBasePath)
+        self.value = value
+        self.deps  = list(deps)
+        self.configure(self.cmMetaParam)
+
+    def configure_nodeparam(self):
+        self.cmConfigDict['nodeValue'] = self.value
+        for (index,dep) in enumerate(self.deps):
+            self.cmConfigDict['dep{0}'.format(index)] = dep
+
+    def computeOutput(self):
+        value = self.cmConfigDict['nodeValue']
+        _SumNodeMan.numComputed[value] = _SumNodeMan.numComputed.get(value,0) + 1
+        if value < 0:
+            raise ValueError('negative node value')
+        return value + sum(dep.getOutput() for dep in self.deps)
+
+# --------------------
+class DAGExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        _SumNodeMan.numComputed = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def makeDiamond(self,leftValue=2):
+        leaf  = _SumNodeMan(1,[],self.tempDir)
+        left  = _SumNodeMan(leftValue,[leaf],self.tempDir)
+        right = _SumNodeMan(3,[leaf],self.tempDir)
+        return (leaf,left,right,_SumNodeMan(10,[left,right],self.tempDir))
+
+    def test_diamond(self):
+        (leaf,left,right,root) = self.makeDiamond()
+        results = DAGExecutor(numWorkers=2).run(root)
+        self.assertEqual(list(results.keys())[0],leaf.getTagPrefix(True))
+        self.assertEqual(list(results.keys())[-1],root.getTagPrefix(True))
+        self.assertTrue(all(result.status == 'done' for result in results.values()))
+        self.assertEqual(results[root.getTagPrefix(True)].value,10 + (2 + 1) + (3 + 1))
+        self.assertEqual(_SumNodeMan.numComputed,{1:1,2:1,3:1,10:1}) # shared leaf computed once
+        self.assertTrue(all(result.getDuration() >= 0 for result in results.values()))
+
+    def test_failure(self):
+        (leaf,left,right,root) = self.makeDiamond(leftValue=-1)
+        results = DAGExecutor(numWorkers=2).run(root)
+        self.assertEqual(results[left.getTagPrefix(True)].status,'failed')
+        self.assertIn('ValueError',results[left.getTagPrefix(True)].error)
+        self.assertEqual(results[right.getTagPrefix(True)].status,'done')
+        self.assertEqual(results[root.getTagPrefix(True)].status,'skipped')
+        self.assertNotIn(10,_SumNodeMan.numComputed)
+        self.assertEqual(getFailedResults(results),[results[left.getTagPrefix(True)]])
+        self.assertRaises(DAGExecutionError,DAGExecutor().run,root,True)
+
+    def test_keep_results(self):
+        (leaf,left,right,root) = self.makeDiamond()
+        results = DAGExecutor(numWorkers=1,keepResults=False).run(root)
+        self.assertEqual([result.value for result in results.values()],[None,None,None,17])
+
+    def test_run_graph(self):
+        (leaf,left,right,root) = self.makeDiamond()
+        self.assertEqual(runGraph([left,root],numWorkers=3),[3,17])
@@ -0,0 +1,85 @@
+'''
+Tests of compman_gc.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_gc import *
+from compman_lock import ComputeLock
+
+# --------------------
+class _GCMan(CompMan):
+    def __init__(self,value,cmBasePath):
+        CompMan.__init__(self,'gc','test_compman_gc_GCMan','gcparam',cmBasePath=cmBasePath)
+        self.value = value
+        self.configure(self.cmMetaParam)
+
+    def configure_gcparam(self):
+        self.cmConfigDict['gcValue'] = self.value
+
+# --------------------
+class OutputCollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def makeOutput(self,value,size,mtime):
+        '''
+        Output directory with a data file of size bytes, all modified at
+        mtime.
+        '''
+        man = _GCMan(value,self.tempDir)
+        man.saveConfigCSVFile()
+        with open(os.path.join(man.getOutputPath(),'data.bin'),'wb') as f:
+            f.write(b'x' * size)
+        for fileName in os.listdir(man.getOutputPath()):
+            os.utime(os.path.join(man.getOutputPath(),fileName),(mtime,mtime))
+        os.utime(man.getOutputPath(),(mtime,mtime))
+        return man
+
+    def test_collect_budget(self):
+        managers = [self.makeOutput(value,1000,1000000000 + value) for value in range(4)]
+        root = managers[0] # oldest but reachable
+        notOutput = os.path.join(self.tempDir,'gc','other')
+        os.makedirs(notOutput)
+        with open(os.path.join(notOutput,'data.bin'),'wb') as f:
+            f.write(b'x' * 1000)
+        os.utime(notOutput,(0,0))
+        collector = OutputCollector(self.tempDir,root)
+        usages    = collector.scan()
+        self.assertEqual(sum(usage.reachable for usage in usages),1)
+        total = sum(usage.size for usage in usages)
+        report = collector.collect(budget=total - 1,dryRun=True)
+        self.assertEqual([usage.path for usage in report['evicted']],[managers[1].getOutputPath()]) # oldest first
+        self.assertTrue(os.path.isdir(managers[1].getOutputPath()))
+        self.assertIn('would evict 1 directories',collector.formatReport(report))
+        report = collector.collect(budget=0)
+        self.assertEqual([usage.path for usage in report['evicted']],[man.getOutputPath() for man in managers[1:]])
+        self.assertFalse(report['budgetMet'])
+        self.assertEqual(report['remainingBytes'],total - report['freedBytes'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tempDir,'gc'))),
+                         sorted(['other',root.getTagPrefix(False)]))
+
+    def test_lru_policy(self):
+        managers = [self.makeOutput(value,1000,1000000000 + value) for value in range(3)]
+        os.utime(os.path.join(managers[0].getOutputPath(),'data.bin'),(1000000100,1000000000)) # read recently
+        total  = sum(usage.size for usage in OutputCollector(self.tempDir).scan())
+        report = collectOutputs(self.tempDir,[],budget=total - 1,policy='lru',dryRun=True)
+        self.assertEqual([usage.path for usage in report['evicted']],[managers[1].getOutputPath()])
+        self.assertRaises(ValueError,OutputCollector,self.tempDir,policy='newest')
+
+    def test_recent_and_locked(self):
+        recent = _GCMan(1,self.tempDir)
+        recent.saveConfigCSVFile()
+        self.assertEqual(collectOutputs(self.tempDir,[])['evicted'],[]) # younger than minAge
+        with ComputeLock(recent.getComputeLockPath()):
+            report = collectOutputs(self.tempDir,[],minAge=0)
+            self.assertEqual((report['evicted'],report['numLocked']),([],1))
+        self.assertEqual(len(collectOutputs(self.tempDir,[],minAge=0)['evicted']),1)
+        self.assertFalse(os.path.exists(recent.getOutputPath()))
@@ -0,0 +1,74 @@
+'''
+Tests of compman_intern.
+'''
+
+import unittest
+
+import numpy as np
+
+from compman import *
+from compman_intern import *
+
+# --------------------
+_registry = InternRegistry()
+
+class _InternedMan(CMConstructionMixin,CompMan):
+    '''
+    Interned child class, using its own registry.
+    '''
+    cmIntern         = True
+    cmInternRegistry = _registry
+
+    def __init__(self,value,dep=None):
+        CompMan.__init__(self,'interned','test_compman_intern_InternedMan','internparam')
+        self.value = value
+        self.dep   = dep
+        self.configure(self.cmMetaParam)
+
+    def configure_internparam(self):
+        self.cmConfigDict['internValue'] = self.value
+        self.cmConfigDict['internDep']   = self.dep
+
+class _PlainInternMan(CompMan):
+    cmIntern = True
+
+    def __init__(self):
+        CompMan.__init__(self,'plain','test_compman_intern_PlainInternMan','plainparam')
+
+# --------------------
+class InternRegistryTest(unittest.TestCase):
+    def setUp(self):
+        _registry.clear()
+        for name in _registry.stats:
+            _registry.stats[name] = 0
+
+    def test_intern(self):
+        leaf = _InternedMan(1)
+        self.assertIs(_InternedMan(1),leaf)
+        self.assertIsNot(_InternedMan(2),leaf)
+        self.assertIs(_InternedMan(3,leaf),_InternedMan(3,_InternedMan(1)))
+        self.assertIn(leaf,_registry)
+        self.assertEqual(_registry.stats['duplicates'],3)
+        report = _registry.getMemoryReport()
+        self.assertEqual(report['byClass']['_InternedMan'],len(_registry))
+        self.assertGreater(report['bytesSaved'],0)
+        self.assertIn('duplicatesAvoided',_registry.formatMemoryReport())
+
+    def test_changed_instance_is_discarded(self):
+        leaf = _InternedMan(1)
+        leaf.cmConfigDict['internValue'] = 5
+        self.assertNotIn(leaf,_registry)
+        self.assertIsNot(_InternedMan(1),leaf)
+        self.assertIsNot(_InternedMan(5),leaf) # changed instances are never registered again
+
+    def test_unhashable(self):
+        man = _InternedMan(np.arange(3))
+        self.assertIsNot(_InternedMan(np.arange(3)),man)
+        self.assertEqual(_registry.stats['unhashable'],2)
+
+    def test_weak(self):
+        _InternedMan(1)
+        self.assertEqual(len(_registry),0)
+
+    def test_requires_mixin(self):
+        self.assertRaises(InvalidStateError,_PlainInternMan)
@@ -0,0 +1,147 @@
+'''
+Tests of compman_lock.
+'''
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import warnings
+
+import compman_lock
+from compman_lock import *
+
+# --------------------
+class ComputeLockTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir  = tempfile.mkdtemp()
+        self.lockPath = os.path.join(self.tempDir,'compman_lock.test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_exclusive(self):
+        lock = ComputeLock(self.lockPath)
+        self.assertTrue(lock.tryAcquire())
+        self.assertFalse(ComputeLock(self.lockPath).tryAcquire())
+        lock.release()
+        self.assertFalse(os.path.exists(self.lockPath))
+        with ComputeLock(self.lockPath):
+            self.assertTrue(os.path.exists(self.lockPath))
+
+    def test_release_stops_heartbeat(self):
+        lock = ComputeLock(self.lockPath,heartbeatInterval=0.01)
+        lock.acquire()
+        thread = lock.heartbeatThread
+        self.assertTrue(thread.is_alive())
+        lock.release()
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(lock.heartbeatThread)
+        # a lock file recreated by another holder is not touched
+        with open(self.lockPath,'w') as f:
+            f.write('other holder')
+        os.utime(self.lockPath,(1000.0,1000.0))
+        time.sleep(0.05)
+        self.assertEqual(os.path.getmtime(self.lockPath),1000.0)
+
+    def test_breaks_stale_lock(self):
+        with open(self.lockPath,'w') as f:
+            f.write(json.dumps({'host':'otherhost','pid':1,'thread':1,'time':0}))
+        os.utime(self.lockPath,(1000.0,1000.0))
+        with ComputeLock(self.lockPath,staleTimeout=1.0,pollInterval=0.01,timeout=5.0) as lock:
+            self.assertTrue(lock.waited)
+
+    def writeStaleLock(self):
+        token = json.dumps({'host':'otherhost','pid':1,'thread':1,'time':0})
+        with open(self.lockPath,'w') as f:
+            f.write(token)
+        os.utime(self.lockPath,(1000.0,1000.0))
+        return token
+
+    def breakWithRace(self,beforeRename,afterRename=lambda: None):
+        '''
+        Runs breakIfStale() on a stale lock, with beforeRename() and
+        afterRename() run by "other processes" around its rename.
+        '''
+        rename = os.rename
+        def racingRename(src,dst):
+            beforeRename()
+            rename(src,dst)
+            afterRename()
+        self.writeStaleLock()
+        compman_lock.os.rename = racingRename
+        try:
+            return ComputeLock(self.lockPath,staleTimeout=1.0).breakIfStale()
+        finally:
+            compman_lock.os.rename = rename
+
+    def test_break_stale(self):
+        self.writeStaleLock()
+        self.assertTrue(ComputeLock(self.lockPath,staleTimeout=1.0).breakIfStale())
+        self.assertEqual(os.listdir(self.tempDir),[])
+
+    def test_break_replaced_lock(self):
+        holder = ComputeLock(self.lockPath,staleTimeout=60.0)
+        def takeLock():
+            os.remove(self.lockPath) # broken by another waiter
+            self.assertTrue(holder.tryAcquire())
+        self.assertFalse(self.breakWithRace(takeLock))
+        self.assertFalse(holder.isLost()) # put back
+        self.assertEqual(os.listdir(self.tempDir),[os.path.basename(self.lockPath)])
+        holder.release()
+        self.assertFalse(holder.lost)
+
+    def test_break_refreshed_lock(self):
+        self.assertFalse(self.breakWithRace(lambda: os.utime(self.lockPath,None))) # holder woke up
+        self.assertEqual(json.loads(_readLock(self.lockPath))['host'],'otherhost')
+
+    def test_break_replaced_lock_then_recreated(self):
+        holder = ComputeLock(self.lockPath,staleTimeout=60.0,heartbeatInterval=0.01)
+        third  = ComputeLock(self.lockPath,staleTimeout=60.0)
+        def takeLock():
+            os.remove(self.lockPath)
+            self.assertTrue(holder.tryAcquire())
+        self.assertFalse(self.breakWithRace(takeLock,lambda: self.assertTrue(third.tryAcquire())))
+        stalePaths = [name for name in os.listdir(self.tempDir) if '.stale.' in name]
+        self.assertEqual(len(stalePaths),1) # the holder's lock is kept, not deleted
+        self.assertEqual(_readLock(os.path.join(self.tempDir,stalePaths[0])),holder.token)
+        self.assertTrue(holder.isLost())
+        time.sleep(0.05)
+        self.assertTrue(holder.lostEvent.is_set())
+        mtime = os.path.getmtime(self.lockPath)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            holder.release()
+        self.assertEqual([warning.category for warning in caught],[LockLostWarning])
+        self.assertTrue(holder.lost)
+        self.assertEqual(_readLock(self.lockPath),third.token) # not removed by the holder
+        self.assertEqual(os.path.getmtime(self.lockPath),mtime) # nor refreshed by its heartbeat
+        third.release()
+
+    def test_timeout(self):
+        with ComputeLock(self.lockPath):
+            self.assertRaises(LockTimeoutError,ComputeLock(self.lockPath,pollInterval=0.01,timeout=0.05).acquire)
+
+    def test_single_flight(self):
+        computed = []
+        def compute():
+            with ComputeLock(self.lockPath,pollInterval=0.01):
+                if not computed:
+                    time.sleep(0.05)
+                    computed.append(threading.current_thread().ident)
+        threads = [threading.Thread(target=compute) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(computed),1)
+
+def _readLock(lockPath):
+    with open(lockPath) as f:
+        return f.read()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+'''
+Tests of compman_prefetch.
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from compman import *
+from compman_exec import DAGExecutor
+from compman_prefetch import *
+
+# --------------------
+class _PrefetchNodeMan(CompMan):
+    '''
+    Node that records the prefetcher active while it computes.
+    '''
+    seenPrefetchers = {} # node name -> active prefetcher
+
+    def __init__(self,name,deps,cmBasePath):
+        CompMan.__init__(self,'prefetchnode','test_compman_prefetch_PrefetchNodeMan','nodeparam',cmBasePath=cmBasePath)
+        self.name = name
+        self.deps = list(deps)
+        self.configure(self.cmMetaParam)
+
+    def configure_nodeparam(self):
+        self.cmConfigDict['nodeName'] = self.name
+        self.cmConfigDict['nodeDeps'] = self.deps
+
+    def computeOutput(self):
+        _PrefetchNodeMan.seenPrefetchers[self.cmConfigDict['nodeName']] = getActivePrefetcher()
+        return [dep.getOutput() for dep in self.cmConfigDict['nodeDeps']]
+
+# --------------------
+class PrefetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_read(self):
+        filePaths = []
+        for i in range(5):
+            filePaths.append(os.path.join(self.tempDir,'file{}'.format(i)))
+            with open(filePaths[-1],'wb') as f:
+                f.write(b'data' * (i + 1))
+        with Prefetcher(numThreads=2) as prefetcher:
+            prefetcher.prefetchFiles(filePaths)
+            self.assertEqual([prefetcher.read(filePath) for filePath in filePaths],
+                             [b'data' * (i + 1) for i in range(5)])
+            self.assertEqual(prefetcher.read(filePaths[0]),b'data') # read directly once consumed
+            self.assertEqual(prefetcher.stats['hits'] + prefetcher.stats['waits'] + prefetcher.stats['misses'],6)
+
+    def test_active_per_thread(self):
+        seen = []
+        with Prefetcher() as outer:
+            with Prefetcher() as inner:
+                self.assertIs(getActivePrefetcher(),inner)
+                thread = threading.Thread(target=lambda: seen.append(getActivePrefetcher()))
+                thread.start()
+                thread.join()
+                outer.deactivate() # out of order, inner stays active
+                self.assertIs(getActivePrefetcher(),inner)
+            self.assertIsNone(getActivePrefetcher())
+        self.assertEqual(seen,[None])
+
+    def test_executors_use_own_prefetcher(self):
+        graphs      = []
+        prefetchers = []
+        for g in range(2):
+            leaves = [_PrefetchNodeMan('leaf{0}_{1}'.format(g,i),[],self.tempDir) for i in range(4)]
+            graphs.append(_PrefetchNodeMan('root{}'.format(g),leaves,self.tempDir))
+            prefetchers.append(Prefetcher())
+        results = [None,None]
+        def runGraph(g):
+            results[g] = DAGExecutor(numWorkers=2,prefetcher=prefetchers[g]).run(graphs[g],raiseOnFailure=True)
+        threads = [threading.Thread(target=runGraph,args=(g,)) for g in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for prefetcher in prefetchers:
+            prefetcher.close()
+        for g in range(2):
+            self.assertEqual(results[g][graphs[g].getTagPrefix(True)].value,[[]] * 4)
+            for name in ['root{}'.format(g)] + ['leaf{0}_{1}'.format(g,i) for i in range(4)]:
+                self.assertIs(_PrefetchNodeMan.seenPrefetchers[name],prefetchers[g])
+        self.assertIsNone(getActivePrefetcher())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+'''
+Tests of compman_profile.
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_profile import *
+
+# --------------------
+class _ProfiledMan(CompMan):
+    def __init__(self,value):
+        CompMan.__init__(self,'profiled','test_compman_profile_ProfiledMan','profiledparam')
+        self.value = value
+        self.configure(self.cmMetaParam)
+
+    def configure_profiledparam(self):
+        self.cmConfigDict['profiledValue'] = self.value
+
+# --------------------
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_events(self):
+        with Profiler() as profiler:
+            self.assertIs(getActiveProfiler(),profiler)
+            man = _ProfiledMan(1)
+            man.getHashTag(True)
+            profileCount('items',3)
+        self.assertIsNone(getActiveProfiler())
+        stats = profiler.getMethodStats()
+        self.assertEqual(stats['configure'][0],1)
+        self.assertEqual(stats['configure_profiledparam'][0],1)
+        self.assertTrue(all(selfTime <= totalTime + 1e-9 for (calls,totalTime,selfTime) in stats.values()))
+        self.assertEqual(profiler.counters['items'],3)
+        self.assertEqual(profiler.getHotNodes(1)[0][0],man.getTagPrefix(True))
+        numEvents = len(profiler.events)
+        _ProfiledMan(2).getHashTag(True) # disabled, not recorded
+        self.assertEqual(len(profiler.events),numEvents)
+
+    def test_disable_restores(self):
+        originals = (CompMan.__dict__['__init__'],_ProfiledMan.__dict__['configure_profiledparam'])
+        with Profiler():
+            self.assertIsNot(_ProfiledMan.__dict__['configure_profiledparam'],originals[1])
+        self.assertEqual((CompMan.__dict__['__init__'],_ProfiledMan.__dict__['configure_profiledparam']),originals)
+
+    def test_class_defined_while_enabled(self):
+        with Profiler() as profiler:
+            class LateMan(_ProfiledMan):
+                def configure_profiledparam(self):
+                    _ProfiledMan.configure_profiledparam(self)
+                    self.cmConfigDict['late'] = True
+            LateMan(1)
+            self.assertTrue(hasattr(LateMan.__dict__['configure_profiledparam'],'cmProfiled'))
+        self.assertFalse(hasattr(LateMan.__dict__['configure_profiledparam'],'cmProfiled'))
+        self.assertEqual(profiler.getMethodStats()['configure_profiledparam'][0],2) # LateMan's and _ProfiledMan's
+
+    def test_single_profiler(self):
+        with Profiler():
+            self.assertRaises(ProfilerStateError,Profiler().enable)
+
+    def test_trace_and_report(self):
+        with Profiler() as profiler:
+            root = TestMan('testparam',self.tempDir)
+            root.saveConfigCSVFile()
+            profileCount('files')
+        filePath = os.path.join(self.tempDir,'trace.json')
+        profiler.saveTrace(filePath)
+        with open(filePath) as f:
+            trace = json.load(f)
+        phases = [event['ph'] for event in trace['traceEvents']]
+        self.assertEqual(phases[-1],'C')
+        self.assertEqual(len(phases),len(profiler.events) + 1)
+        numEvents = len(profiler.events)
+        (totalTime,path) = profiler.getCriticalPath(root)
+        self.assertEqual(path[-1],root.getTagPrefix(True))
+        self.assertIn('critical path',profiler.formatReport(roots=root))
+        self.assertEqual(len(profiler.events),numEvents) # reporting adds no events
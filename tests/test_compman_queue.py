@@ -0,0 +1,84 @@
+'''
+Tests of compman_queue.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_queue import *
+
+# --------------------
+class _QueueNodeMan(CompMan):
+    '''
+    Node whose getOutput() raises if fail is set.
+    '''
+    def __init__(self,name,deps=(),fail=False):
+        CompMan.__init__(self,'queuenode','test_compman_queue_QueueNodeMan','nodeparam')
+        self.name = name
+        self.deps = list(deps)
+        self.fail = fail
+        self.configure(self.cmMetaParam)
+
+    def configure_nodeparam(self):
+        self.cmConfigDict['nodeName'] = self.name
+        self.cmConfigDict['nodeDeps'] = self.deps
+        self.cmExConfigDict['fail']   = self.fail
+
+    def getOutput(self):
+        if self.cmExConfigDict['fail']:
+            raise ValueError('node {} failed'.format(self.cmConfigDict['nodeName']))
+        return self.cmConfigDict['nodeName']
+
+# --------------------
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.queue   = WorkQueue(os.path.join(self.tempDir,'queue.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def runWorker(self):
+        return QueueWorker(self.queue,'worker',pollInterval=0.01,maxAttempts=1).run(maxNodes=100)
+
+    def test_runs_graph(self):
+        leaf = _QueueNodeMan('leaf')
+        root = _QueueNodeMan('root',[leaf])
+        self.assertEqual(self.queue.enqueue(root),2)
+        self.assertEqual(self.queue.enqueue(root),0)
+        stats = self.runWorker()
+        self.assertEqual(stats['done'],2)
+        self.assertTrue(self.queue.isFinished())
+        self.assertEqual(self.queue.getStatus(root.getTagPrefix(True)),'done')
+
+    def test_failure_skips_dependents(self):
+        leaf = _QueueNodeMan('leaf',fail=True)
+        root = _QueueNodeMan('root',[leaf])
+        self.queue.enqueue(root)
+        stats = self.runWorker()
+        self.assertEqual((stats['done'],stats['failed']),(0,1))
+        self.assertEqual(self.queue.getStatus(leaf.getTagPrefix(True)),'failed')
+        self.assertEqual(self.queue.getStatus(root.getTagPrefix(True)),'skipped')
+        self.assertTrue(self.queue.isFinished())
+
+    def test_enqueue_on_failed_dependency(self):
+        leaf = _QueueNodeMan('leaf',fail=True)
+        self.queue.enqueue(leaf)
+        self.runWorker()
+        self.assertEqual(self.queue.getStatus(leaf.getTagPrefix(True)),'failed')
+        root  = _QueueNodeMan('root',[leaf])
+        above = _QueueNodeMan('above',[root])
+        self.assertEqual(self.queue.enqueue(above),2)
+        self.assertEqual(self.queue.getStatus(root.getTagPrefix(True)),'skipped')
+        self.assertEqual(self.queue.getStatus(above.getTagPrefix(True)),'skipped')
+        self.assertTrue(self.queue.isFinished())
+        self.assertEqual(self.runWorker()['done'],0)
+        self.queue.retry()
+        self.assertFalse(self.queue.isFinished())
+        self.assertEqual(self.queue.getProgress()['ready'],1) # only the failed leaf, its dependents wait
+
+if __name__ == '__main__':
+    unittest.main()
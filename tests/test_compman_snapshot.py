@@ -0,0 +1,83 @@
+'''
+Tests of compman_snapshot.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_snapshot import *
+
+# --------------------
+class _SnapNodeMan(CompMan):
+    '''
+    Node declaring its code tag as a class attribute.
+    '''
+    cmCodeTag = 'test_compman_snapshot_SnapNodeMan_v1'
+
+    def __init__(self,name,deps=()):
+        CompMan.__init__(self,'snapnode',self.cmCodeTag,'nodeparam')
+        self.name = name
+        self.deps = list(deps)
+        self.configure(self.cmMetaParam)
+
+    def configure_nodeparam(self):
+        self.cmConfigDict['nodeName'] = self.name
+        self.cmConfigDict['nodeDeps'] = self.deps
+
+def _buildGraph():
+    shared = _SnapNodeMan('shared')
+    left   = _SnapNodeMan('left',[shared])
+    right  = _SnapNodeMan('right',[shared])
+    return (_SnapNodeMan('root',[left,right]),left,right)
+
+# --------------------
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_roundtrip(self):
+        (root,left,right) = _buildGraph()
+        (restored,) = loadSnapshotData(dumpSnapshot(root))
+        self.assertEqual(restored.getTagPrefix(True),root.getTagPrefix(True))
+        self.assertEqual(restored.cmHashTagWithoutExtraConfig,root.getHashTag(False))
+        (restoredLeft,restoredRight) = restored.nodeDeps
+        self.assertIs(restoredLeft.nodeDeps[0],restoredRight.nodeDeps[0])
+        restored.invalidateHashTag()
+        self.assertEqual(restored.getHashTag(True),root.getHashTag(True))
+
+    def test_subgraph(self):
+        (root,left,right) = _buildGraph()
+        (restoredLeft,) = loadSnapshotData(dumpSnapshot(root),[left.getTagPrefix(True)])
+        self.assertEqual(restoredLeft.nodeName,'left')
+        self.assertRaises(KeyError,loadSnapshotData,dumpSnapshot(left),[right.getTagPrefix(True)])
+
+    def test_caller_code_tag(self):
+        data = dumpSnapshot(_buildGraph()[0],codeTag='pipeline1')
+        loadSnapshotData(data,codeTag='pipeline1')
+        self.assertRaises(SnapshotInvalidError,loadSnapshotData,data,codeTag='pipeline2')
+
+    def test_class_code_tag(self):
+        data = dumpSnapshot(_buildGraph()[0])
+        self.assertEqual(getClassCodeTag(_SnapNodeMan),'test_compman_snapshot_SnapNodeMan_v1')
+        self.assertIsNone(getClassCodeTag(TemplateMan))
+        _SnapNodeMan.cmCodeTag = 'test_compman_snapshot_SnapNodeMan_v2'
+        try:
+            self.assertRaises(SnapshotInvalidError,loadSnapshotData,data)
+            filePath = os.path.join(self.tempDir,'graph.cmsnap')
+            with open(filePath,'wb') as f:
+                f.write(data)
+            (root,) = loadSnapshotOrBuild(filePath,lambda: _buildGraph()[0])
+            self.assertEqual(root.cmCodeTag,'test_compman_snapshot_SnapNodeMan_v2')
+            (root,) = loadSnapshot(filePath)
+            self.assertEqual(root.cmCodeTag,'test_compman_snapshot_SnapNodeMan_v2')
+        finally:
+            _SnapNodeMan.cmCodeTag = 'test_compman_snapshot_SnapNodeMan_v1'
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+'''
+Tests of compman_stamp.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_stamp import *
+
+# --------------------
+class _StampMan(CompMan):
+    '''
+    Node reading an optional input file.
+    '''
+    def __init__(self,name,deps,cmBasePath,inputFile=None):
+        CompMan.__init__(self,'stamp','test_compman_stamp_StampMan','stampparam',cmBasePath=cmBasePath)
+        self.name      = name
+        self.deps      = list(deps)
+        self.inputFile = inputFile
+        self.configure(self.cmMetaParam)
+
+    def configure_stampparam(self):
+        self.cmConfigDict['stampName'] = self.name
+        self.cmConfigDict['stampDeps'] = self.deps
+
+    def getInputFiles(self):
+        return [self.inputFile] if self.inputFile is not None else []
+
+class _ContentStampMan(_StampMan):
+    cmInputFingerprint = 'content'
+
+# --------------------
+class FreshnessTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir   = tempfile.mkdtemp()
+        self.inputFile = os.path.join(self.tempDir,'input.txt')
+        self.writeInput('abc')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def writeInput(self,data,mtime=1000000000):
+        with open(self.inputFile,'w') as f:
+            f.write(data)
+        os.utime(self.inputFile,(mtime,mtime))
+
+    def makeChain(self,cls=_StampMan):
+        leaf   = cls('leaf',[],self.tempDir,self.inputFile)
+        middle = cls('middle',[leaf],self.tempDir)
+        root   = cls('root',[middle],self.tempDir)
+        for man in (leaf,middle,root):
+            man.markOutputComplete()
+        return (leaf,middle,root)
+
+    def test_fresh(self):
+        (leaf,middle,root) = self.makeChain()
+        freshness = checkFreshness(root)
+        self.assertEqual(list(freshness.values()),[None,None,None])
+        self.assertTrue(root.isOutputFresh())
+        self.assertEqual(readStamp(root)['dependencies'],{middle.getTagPrefix(True):readStamp(middle)['buildId']})
+        self.assertEqual(getStaleNodes(root),[])
+
+    def test_no_stamp(self):
+        (leaf,middle,root) = self.makeChain()
+        removeStamp(root)
+        self.assertEqual(getStaleNodes(root),[root.getTagPrefix(True)])
+        self.assertEqual(checkFreshness(root)[root.getTagPrefix(True)],'no stamp')
+
+    def test_input_changed(self):
+        (leaf,middle,root) = self.makeChain()
+        self.writeInput('abcd')
+        freshness = checkFreshness(root)
+        self.assertEqual(freshness[leaf.getTagPrefix(True)],'input changed: {}'.format(self.inputFile))
+        self.assertEqual(freshness[middle.getTagPrefix(True)],'dependency stale: {}'.format(leaf.getTagPrefix(True)))
+        self.assertEqual(freshness[root.getTagPrefix(True)],'dependency stale: {}'.format(middle.getTagPrefix(True)))
+        self.assertEqual(getStaleNodes(root,checkInputs=False),[])
+
+    def test_dependency_rebuilt(self):
+        (leaf,middle,root) = self.makeChain()
+        leaf.writeBuildStamp()
+        self.assertEqual(getStaleNodes(root),[middle.getTagPrefix(True),root.getTagPrefix(True)])
+        self.assertEqual(checkFreshness(root)[middle.getTagPrefix(True)],
+                         'dependency rebuilt: {}'.format(leaf.getTagPrefix(True)))
+        middle.markOutputComplete()
+        self.assertEqual(getStaleNodes(root),[root.getTagPrefix(True)])
+        root.markOutputComplete()
+        self.assertEqual(getStaleNodes(root),[])
+
+    def test_no_base_path(self):
+        leaf   = _StampMan('leaf',[],self.tempDir,self.inputFile)
+        middle = _StampMan('middle',[leaf],None) # no stamp, fresh if its dependencies are
+        leaf.markOutputComplete()
+        self.assertEqual(list(checkFreshness(middle).values()),[None,None])
+        self.writeInput('abcd')
+        self.assertEqual(getStaleNodes(middle),[leaf.getTagPrefix(True),middle.getTagPrefix(True)])
+
+    def test_content_fingerprint(self):
+        (leaf,middle,root) = self.makeChain(_ContentStampMan)
+        self.assertIn('sha256',readStamp(leaf)['inputs'][self.inputFile])
+        self.writeInput('abc',mtime=1000000100) # touched, same content
+        self.assertEqual(getStaleNodes(root),[])
+        self.writeInput('xyz',mtime=1000000200)
+        self.assertEqual(getStaleNodes(root)[0],leaf.getTagPrefix(True))
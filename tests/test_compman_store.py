@@ -0,0 +1,57 @@
+'''
+Tests of compman_store.
+'''
+
+import os
+import gc
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import compman_store
+from compman_store import *
+
+# --------------------
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_array(self):
+        filePath = os.path.join(self.tempDir,'a.npy')
+        saveArray(filePath,numpy.arange(10))
+        array = loadArray(filePath)
+        self.assertTrue(isMapped(array))
+        self.assertIs(loadArray(filePath),array)
+        self.assertEqual(list(array),list(range(10)))
+        self.assertIs(pickle.loads(pickle.dumps(array,pickle.HIGHEST_PROTOCOL)),array)
+        self.assertFalse(isMapped(array[2:]))
+        self.assertRaises(TypeError,saveArray,filePath,numpy.array([None]))
+
+    def test_rewritten_file(self):
+        filePath = os.path.join(self.tempDir,'b.bin')
+        saveBuffer(filePath,b'first')
+        first = loadBuffer(filePath)
+        self.assertIs(loadBuffer(filePath),first)
+        self.assertEqual(bytes(first.getView()),b'first')
+        saveBuffer(filePath,b'second!')
+        second = loadBuffer(filePath)
+        self.assertIsNot(second,first)
+        self.assertEqual(second[:],b'second!')
+        self.assertEqual(getMappedFile(second),os.path.abspath(filePath))
+
+    def test_nothing_kept_once_unused(self):
+        for i in range(20):
+            filePath = os.path.join(self.tempDir,'c{}.bin'.format(i))
+            saveBuffer(filePath,b'data')
+            loadBuffer(filePath)
+        gc.collect()
+        self.assertEqual(len(compman_store._mappedBuffers),0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+'''
+Tests of compman_sweep.
+'''
+
+import shutil
+import tempfile
+import unittest
+
+from compman import *
+from compman_sweep import *
+
+# --------------------
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_sweep_grid(self):
+        self.assertEqual(sweepGrid([('a',[1,2]),('b',['x','y'])]),
+                         [{'a':1,'b':'x'},{'a':1,'b':'y'},{'a':2,'b':'x'},{'a':2,'b':'y'}])
+
+    def test_build_sweep(self):
+        points   = sweepGrid([('cmMetaParam',['testparam']),('field1',[1,2,3]),('templateMan3',[None])])
+        managers = buildSweep(TestMan,points,kwargs={'cmBasePath':self.tempDir})
+        self.assertEqual([man.field1 for man in managers],[1,2,3])
+        self.assertIn('templateMan3',managers[0].cmExConfigDict) # override kept in extra config
+        self.assertTrue(all(man.templateMan1 is managers[0].templateMan1 for man in managers))
+        self.assertIsNot(managers[0].templateMan1,managers[0].templateMan2)
+        for (man,point) in zip(managers,points):
+            reference = TestMan('testparam',self.tempDir)
+            reference.cmConfigDict['field1'] = point['field1']
+            reference.cmExConfigDict['templateMan3'] = None
+            self.assertEqual(man.getHashTag(True),reference.getHashTag(True))
+            self.assertEqual(man.getHashTag(False),reference.getHashTag(False))
+        self.assertEqual(len(set(man.getHashTag(True) for man in managers)),3)
+
+    def test_no_sharing(self):
+        points   = sweepGrid([('cmMetaParam',['testparam']),('field2',[1,2])])
+        managers = buildSweep(TestMan,points,kwargs={'cmBasePath':self.tempDir},
+                              shareDependencies=False,batchHashTags=False)
+        self.assertIsNot(managers[0].templateMan1,managers[1].templateMan1)
+        self.assertEqual(managers[0].templateMan1.getHashTag(True),managers[1].templateMan1.getHashTag(True))
+
+    def test_shared_construction(self):
+        with sharedConstruction():
+            managers = [constructShared(TestMan,'testparam',self.tempDir) for index in range(2)]
+            unshared = TestMan('testparam',self.tempDir) # not a CMConstructionMixin class
+            self.assertIsNone(managers[0].cmHashTagWithExtraConfig) # deferred
+        self.assertIsNot(managers[0],managers[1]) # top level never shared
+        self.assertIs(managers[0].templateMan2,managers[1].templateMan2)
+        self.assertIs(managers[0].templateMan2,managers[0].templateMan3)
+        self.assertIsNot(unshared.templateMan1,managers[0].templateMan1)
+        self.assertIsNot(TemplateMan('p1',self.tempDir),TemplateMan('p1',self.tempDir))